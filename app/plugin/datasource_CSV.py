@@ -1,16 +1,244 @@
 # Created by Sanshiro Enomoto on 13 May 2024 #
 
 
-import sys, os, time, glob, logging
+import sys, os, re, time, glob, csv, json, itertools, threading, logging
 from sd_dataschema import Schema
 from sd_datasource import DataSource
 from sd_datasource_TableStore import DataSource_TableStore
 
+
+
+class CSVIndex:
+    """Sparse byte-offset index of a CSV file, for a time column and a tag column
+    - The data lines are grouped into blocks of about "block_size" bytes; for each block, the byte range
+      and the time range of the records are recorded, so that a query reads only the blocks overlapping
+      with the requested time range.
+    - Tag values are recorded with the offset of the first line of each, which also serves as a tag list cache.
+    - The index is extended incrementally as the file grows (only complete lines are indexed),
+      and rebuilt if the file is replaced or truncated.
+    - If "index_path" is given, the index is saved to the file and reused on the next start.
+    """
     
+    version = 1
+    csv_format = { 'delimiter': ',', 'quoting': csv.QUOTE_NONE, 'escapechar': '\\' }
+    save_interval = 60
+    
+    def __init__(self, filepath, time_col, tag_col, block_size=1048576, index_path=None):
+        self.filepath = filepath
+        self.time_col = time_col
+        self.tag_col = tag_col
+        self.block_size = block_size
+        self.index_path = index_path
+        
+        self._reset()
+        self.saved_end, self.saved_time = 0, 0
+        if self.index_path is not None:
+            self._load()
+
+            
+    def _reset(self):
+        self.inode = None
+        self.end = 0          # offset after the last indexed line
+        self.columns = None
+        self.time_column, self.tag_column = None, None
+        self.blocks = []      # [ begin_offset, end_offset, min_time, max_time ]
+        self.tags = {}        # tag value -> offset of the first line
+
+        
+    def refresh(self):
+        stat = os.stat(self.filepath)
+        if stat.st_ino != self.inode or stat.st_size < self.end:
+            if self.inode is not None:
+                logging.info('CSV file replaced or truncated, rebuilding the index: %s' % self.filepath)
+            self._reset()
+            self.inode = stat.st_ino
+        if stat.st_size == self.end:
+            return
+
+        with open(self.filepath, 'rb') as f:
+            if self.columns is None:
+                header = f.readline()
+                if not header.endswith(b'\n'):
+                    return
+                self.columns = self._parse(header) or []
+                self.end = f.tell()
+                if self.time_col in self.columns:
+                    self.time_column = self.columns.index(self.time_col)
+                if self.tag_col in self.columns:
+                    self.tag_column = self.columns.index(self.tag_col)
+                
+            f.seek(self.end)
+            while True:
+                data = f.read(self.block_size)
+                if len(data) == 0:
+                    break
+                if not data.endswith(b'\n'):
+                    data += f.readline()
+                    if not data.endswith(b'\n'):
+                        data = data[0:data.rfind(b'\n')+1]   # the last line is incomplete
+                        if len(data) == 0:
+                            break
+                self._add_block(data)
+                
+        if self.index_path is not None and self.end > self.saved_end:
+            if self.end - self.saved_end >= self.block_size or time.time() - self.saved_time > self.save_interval:
+                self._save()
+                
+                
+    def _add_block(self, data):
+        begin = self.end
+        t_min, t_max = None, None
+        for offset, record in self._parse_block(data, begin):
+            if self.time_column is not None:
+                try:
+                    t = float(record[self.time_column])
+                    if t_min is None or t < t_min:
+                        t_min = t
+                    if t_max is None or t > t_max:
+                        t_max = t
+                except:
+                    pass
+            if self.tag_column is not None:
+                tag = record[self.tag_column]
+                if tag not in self.tags:
+                    self.tags[tag] = offset
+        self.end = begin + len(data)
+
+        last = self.blocks[-1] if len(self.blocks) > 0 else None
+        if last is not None and last[1] == begin and last[1] - last[0] < self.block_size:
+            # growing file: extend the last block instead of making many small blocks
+            last[1] = self.end
+            if t_min is not None:
+                last[2] = t_min if last[2] is None else min(last[2], t_min)
+                last[3] = t_max if last[3] is None else max(last[3], t_max)
+        else:
+            self.blocks.append([ begin, self.end, t_min, t_max ])
+
+            
+    def find_blocks(self, time_from=None, time_to=None):
+        """returns the blocks that might contain records in the time range [time_from, time_to)
+        """
+        if self.time_column is None or time_from is None or time_to is None:
+            return self.blocks
+        return [
+            block for block in self.blocks
+            if block[2] is not None and block[2] < time_to and block[3] >= time_from
+        ]
+
+    
+    def read_records(self, f, begin, end):
+        """returns an iterator of (offset, record) for the records in the byte range; end=None to read to the end of file
+        """
+        f.seek(begin)
+        data = f.read() if end is None else f.read(end - begin)
+        return self._parse_block(data, begin)
+
+            
+    def read_line(self, offset):
+        with open(self.filepath, 'rb') as f:
+            f.seek(offset)
+            return self._parse(f.readline())
+
+    
+    def _parse_block(self, data, begin):
+        """yields (offset, record) for the records with the right number of fields in the data read from the offset "begin"
+        """
+        lines = data.split(b'\n')
+        if len(lines[-1]) == 0:
+            lines.pop()
+        offsets = list(itertools.accumulate((len(line) + 1 for line in lines), initial=begin))
+        text_lines = data.decode('utf-8', errors='replace').split('\n')  # decoding never adds or removes newlines
+        
+        nlines, ncols = len(lines), len(self.columns)
+        def make_reader(first_line):
+            return csv.reader((line.rstrip('\r') for line in text_lines[first_line:nlines]), **self.csv_format)
+        
+        base, line_num = 0, 0
+        reader = make_reader(base)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                break
+            except csv.Error:
+                # skip the broken record and continue with a new reader
+                base += max(reader.line_num, line_num + 1)
+                line_num = 0
+                reader = make_reader(base)
+                continue
+            if len(record) == ncols:
+                yield offsets[base + line_num], record
+            line_num = reader.line_num
+
+            
+    def _parse(self, line):
+        try:
+            return next(csv.reader([ line.decode('utf-8', errors='replace').rstrip('\r\n') ], **self.csv_format), [])
+        except csv.Error:
+            return None
+
+        
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                doc = json.load(f)
+            if doc.get('version', None) != self.version or doc.get('file', None) != os.path.abspath(self.filepath):
+                return
+            if doc.get('time_col', None) != self.time_col or doc.get('tag_col', None) != self.tag_col:
+                return
+            if doc.get('block_size', None) != self.block_size:
+                return
+            with open(self.filepath, 'rb') as f:
+                if self._parse(f.readline()) != doc['columns']:
+                    return
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning('unable to load CSV index: %s: %s' % (self.index_path, str(e)))
+            return
+        
+        self.inode, self.end = doc['inode'], doc['end']
+        self.columns = doc['columns']
+        self.time_column, self.tag_column = doc['time_column'], doc['tag_column']
+        self.blocks = doc['blocks']
+        self.tags = doc['tags']
+        self.saved_end, self.saved_time = self.end, time.time()
+
+        
+    def _save(self):
+        doc = {
+            'version': self.version,
+            'file': os.path.abspath(self.filepath),
+            'time_col': self.time_col, 'tag_col': self.tag_col,
+            'block_size': self.block_size,
+            'inode': self.inode, 'end': self.end,
+            'columns': self.columns,
+            'time_column': self.time_column, 'tag_column': self.tag_column,
+            'blocks': self.blocks,
+            'tags': self.tags,
+        }
+        try:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(doc, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logging.warning('unable to save CSV index: %s: %s' % (self.index_path, str(e)))
+        self.saved_end, self.saved_time = self.end, time.time()
+
+        
+
 class DataSource_CSV(DataSource_TableStore):
+    has_latest_per_tag_query = True
+
+    
     def __init__(self, app, project, params):
         self.directory = None
         self.time_sep = 'T'
+        self.indices = {}
+        self.index_lock = threading.Lock()   # indices are created and extended in the thread pool
+        self.index_directory = None
+        self.index_block_size = 1048576
         
         dburl = Schema.parse_dburl(params.get('url', ''))
         directory = params.get('directory', dburl.get('db', None))
@@ -37,6 +265,16 @@ class DataSource_CSV(DataSource_TableStore):
 
         super()._configure(params)
 
+        ### INDEX ###
+        self.index_block_size = int(params.get('index_block_size', 1048576))
+        index_directory = params.get('index_directory', None)   # the index is kept only in memory by default
+        if index_directory is not None and index_directory is not False:
+            try:
+                os.makedirs(index_directory, exist_ok=True)
+                self.index_directory = index_directory
+            except Exception as e:
+                logging.warning('unable to create CSV index directory: %s: %s' % (index_directory, str(e)))
+
         ### TABLES ###
         self.tables = {}
         tables = params.get('table', [])
@@ -58,51 +296,97 @@ class DataSource_CSV(DataSource_TableStore):
             }
 
 
+    def _get_index(self, table_name, time_col, tag_col, time_from=None, time_to=None):
+        """returns (index, blocks, end, tags): the CSVIndex for the table, created and/or extended to the current end
+        of the file, and a snapshot of it taken under the lock, as another thread might extend the index while reading:
+          - blocks: copies of the blocks overlapping with the time range
+          - end: the offset after the last indexed line; the rest of the file is read from here
+          - tags: copy of the tag value -> offset table
+        index is None on error.
+        """
+        filepath = os.path.join(self.directory, table_name + '.csv')
+        key = (filepath, time_col, tag_col)
+        with self.index_lock:
+            index = self.indices.get(key, None)
+            if index is None:
+                index_path = None
+                if self.index_directory is not None:
+                    name = re.sub(r'[^\w.-]', '_', '%s.csv.%s.%s.index.json' % (table_name, time_col or '', tag_col or ''))
+                    index_path = os.path.join(self.index_directory, name)
+                index = CSVIndex(filepath, time_col, tag_col, block_size=self.index_block_size, index_path=index_path)
+                self.indices[key] = index
+            
+            try:
+                index.refresh()
+            except Exception as e:
+                logging.error('unable to read CSV file: %s: %s' % (filepath, str(e)))
+                return None, [], 0, {}
+        
+            if index.columns is None:
+                return None, [], 0, {}
+        
+            blocks = [ list(block) for block in index.find_blocks(time_from, time_to) ]
+            return index, blocks, index.end, dict(index.tags)
+
+    
+    # file reading (index building and block reading) is done in the thread pool, not to block the event loop
     async def _get_tag_values_from_data(self, schema):
+        return await self.sync_executor.run(self._read_tag_values, schema)
+
+    
+    async def _get_first_data_row(self, schema):
+        return await self.sync_executor.run(self._read_first_data_row, schema, default=(None, []))
+
+    
+    async def _get_first_data_value(self, table_name, tag_name, tag_value, field):
+        return await self.sync_executor.run(self._read_first_data_value, table_name, tag_name, tag_value, field)
+
+    
+    async def _execute_query(self, table_name, time_col, time_type, time_from, time_to, tag_col, tag_values, fields, resampling=None, reducer=None, stop=None, lastonly=False, use_server_resampling=True):
+        return await self.sync_executor.run(
+            self._read_query, table_name, time_col, time_from, time_to, tag_col, tag_values, fields, lastonly,
+            default=([], [])
+        )
+
+    
+    def _read_tag_values(self, schema):
         if self.directory is None:
             return None
         
-        columns, tag_value_set = [], set()
-        tag_column = None
-        filepath = os.path.join(self.directory, schema.table + '.csv')
+        index, blocks, end, tags = self._get_index(schema.table, schema.time, schema.tag)
+        if index is None:
+            return None
+        if index.tag_column is None:
+            logging.error('unable to find tag column: %s: %s' % (schema.tag, index.filepath))
+            return None
+
+        tag_values = set(tags.keys())
         try:
-            with open(filepath) as f:
-                for line in f:
-                    if len(columns) == 0:
-                        columns = self._split(line)
-                        for k in range(len(columns)):
-                            if columns[k] == schema.tag:
-                                tag_column = k
-                                break
-                        else:
-                            logging.error('unable to find tag column: %s: %s' % (schema.tag, filepath))
-                            return None
-                    else:
-                        record = self._split(line)
-                        if len(record) == len(columns):
-                            tag_value_set.add(self._split(line)[tag_column])
+            with open(index.filepath, 'rb') as f:
+                # the last line not terminated by a newline is not indexed
+                tag_values.update(record[index.tag_column] for offset, record in index.read_records(f, end, None))
         except Exception as e:
-            logging.error('unable to read CSV file: %s: %s' % (filepath, str(e)))
+            logging.error('unable to read CSV file: %s: %s' % (index.filepath, str(e)))
             return None
         
-        return sorted([ tag for tag in tag_value_set ])
+        return sorted(tag_values)
 
     
-    async def _get_first_data_row(self, schema):
+    def _read_first_data_row(self, schema):
         if self.directory is None:
             return None, []
         
         columns, record = [], []
         filepath = os.path.join(self.directory, schema.table + '.csv')
         try:
-            with open(filepath) as f:
-                for line in f:
+            with open(filepath, encoding='utf-8', errors='replace', newline='') as f:
+                for record in csv.reader(f, **CSVIndex.csv_format):
                     if len(columns) == 0:
-                        columns = self._split(line)
-                    else:
-                        record = self._split(line)
-                        if len(record) == len(columns):
-                            break
+                        columns = record
+                    elif len(record) == len(columns):
+                        break
+                else:
+                    record = []
         except Exception as e:
             logging.error('unable to read CSV file: %s: %s' % (filepath, str(e)))
             return None, []
@@ -110,79 +394,113 @@ class DataSource_CSV(DataSource_TableStore):
         return columns, record
 
     
-    async def _get_first_data_value(self, table_name, tag_name, tag_value, field):
+    def _read_first_data_value(self, table_name, tag_name, tag_value, field):
         if self.directory is None:
             return None
 
-        value = None
-        columns, tag_column, value_column = [], None, None
         filepath = os.path.join(self.directory, table_name + '.csv')
+        for (index_filepath, time_col, tag_col), index in list(self.indices.items()):
+            if index_filepath == filepath and tag_col == tag_name:
+                index, blocks, end, tags = self._get_index(table_name, time_col, tag_col)
+                break
+        else:
+            index, blocks, end, tags = self._get_index(table_name, None, tag_name)
+        if index is None:
+            return None
+        
+        if index.tag_column is None:
+            logging.error('unable to find tag column: %s: %s' % (tag_name, filepath))
+            return None
+        if field not in index.columns:
+            logging.error('unable to find field column: %s: %s' % (field, filepath))
+            return None
+        
         try:
-            with open(filepath) as f:
-                for line in f:
-                    if len(columns) == 0:
-                        columns = self._split(line)
-                        for k in range(len(columns)):
-                            if columns[k] == tag_name:
-                                tag_column = k
-                            elif columns[k] == field:
-                                value_column = k
-                        if tag_column is None:
-                            logging.error('unable to find tag column: %s: %s' % (tag_name, filepath))
-                            return None
-                        if value_column is None:
-                            logging.error('unable to find field column: %s: %s' % (field, filepath))
-                            return None
-                    else:
-                        record = self._split(line)
-                        if (len(record) == len(columns)) and (record[tag_column] == tag_value):
-                            value = record[value_column]
-                            break
+            offset = tags.get(tag_value, None)
+            if offset is not None:
+                record = index.read_line(offset)
+            else:
+                with open(index.filepath, 'rb') as f:
+                    records = [ r for o, r in index.read_records(f, end, None) if r[index.tag_column] == tag_value ]
+                record = records[0] if len(records) > 0 else None
         except Exception as e:
             logging.error('unable to read CSV file: %s: %s' % (filepath, str(e)))
             return None
         
-        return value
+        return record[index.columns.index(field)] if record is not None else None
 
         
-    async def _execute_query(self, table_name, time_col, time_type, time_from, time_to, tag_col, tag_values, fields, resampling=None, reducer=None, stop=None, lastonly=False):
-        columns, table = [], []
-
-        time_from, time_to = int(time_from), int(time_to)
-        time_column, tag_column, field_columns = None, None, []
-        filepath = os.path.join(self.directory, table_name + '.csv')
+    def _read_query(self, table_name, time_col, time_from, time_to, tag_col, tag_values, fields, lastonly):
         try:
-            with open(filepath) as f:
-                for line in f:
-                    if len(columns) == 0:
-                        columns = self._split(line)
-                        for k in range(len(columns)):
-                            if time_col is not None and (columns[k] == time_col):
-                                time_column = k
-                            elif tag_col is not None and (columns[k] == tag_col):
-                                tag_column = k
-                            elif columns[k] in fields:
-                                field_columns.append(k)
-                    else:
-                        record = self._split(line)
-                        if len(record) != len(columns):
-                            continue
-                        time_val = int(record[time_column]) if time_column is not None else int(time.time())
-                        if time_column is not None and (time_val < time_from or time_val >= time_to):
-                            continue
-                        row = [ time_val ]
-                        if tag_column is not None:
-                            if record[tag_column] not in tag_values:
-                                continue
-                            else:
-                                row.append(record[tag_column])
-                        row += [ record[k] for k in field_columns ]
-                        if lastonly and len(table) > 0:
-                            table[0] = row
-                        else:
+            time_from, time_to = int(time_from), int(time_to)
+        except:
+            time_from, time_to = None, None
+        index, blocks, end, tags = self._get_index(table_name, time_col, tag_col, time_from, time_to)
+        if index is None:
+            return [], []
+        
+        columns, table = index.columns, []
+        time_column, tag_column = index.time_column, index.tag_column
+        field_columns = [ (columns.index(field) if field in columns else None) for field in fields ]
+        
+        if time_column is not None and time_from is None:
+            logging.error('CSV time column must be UNIX timestamps: %s' % index.filepath)
+            return [], []
+        tag_value_set = set(tag_values) if tag_column is not None else None
+            
+        now = int(time.time())
+        def make_row(record):
+            if time_column is None:
+                row = [ now ]
+            else:
+                try:
+                    row = [ float(record[time_column]) ]
+                except:
+                    return None
+                if row[0] < time_from or row[0] >= time_to:
+                    return None
+            if tag_column is not None:
+                if record[tag_column] not in tag_value_set:
+                    return None
+                row.append(record[tag_column])
+            row += [ (record[k] if k is not None else None) for k in field_columns ]
+            return row
+            
+        try:
+            with open(index.filepath, 'rb') as f:
+                if not lastonly:
+                    for begin, end, t_min, t_max in blocks:
+                        for offset, record in index.read_records(f, begin, end):
+                            row = make_row(record)
+                            if row is not None:
+                                table.append(row)
+                    for offset, record in index.read_records(f, end, None):
+                        row = make_row(record)
+                        if row is not None:
                             table.append(row)
+                    return columns, table
+                
+                # lastonly: the latest row for each tag value, scanning from the blocks with the latest time
+                latest = {}   # tag value -> (time, offset, row)
+                def update_latest(offset, record):
+                    row = make_row(record)
+                    if row is not None:
+                        key = row[1] if tag_column is not None else None
+                        if key not in latest or (row[0], offset) > latest[key][0:2]:
+                            latest[key] = (row[0], offset, row)
+                n_keys = len(tag_value_set) if tag_column is not None else 1
+                for offset, record in index.read_records(f, end, None):
+                    update_latest(offset, record)
+                for begin, end, t_min, t_max in sorted(blocks, key=lambda block: block[3] or 0, reverse=True):
+                    if len(latest) >= n_keys and t_max is not None:
+                        if min(entry[0] for entry in latest.values()) > t_max:
+                            break
+                    for offset, record in index.read_records(f, begin, end):
+                        update_latest(offset, record)
+                table = [ entry[2] for entry in sorted(latest.values(), key=lambda entry: entry[0:2], reverse=True) ]
+                
         except Exception as e:
-            logging.error('unable to read CSV file: %s: %s' % (filepath, str(e)))
+            logging.error('unable to read CSV file: %s: %s' % (index.filepath, str(e)))
             return [], []
         
         return columns, table
@@ -208,12 +526,12 @@ class DataSource_CSV(DataSource_TableStore):
             tail = entry.get('tail', None)
             try:
                 columns, table = None, []
-                with open(filepath) as f:
-                    for line in f:
+                with open(filepath, encoding='utf-8', errors='replace', newline='') as f:
+                    for record in csv.reader(f, **CSVIndex.csv_format):
                         if columns is None:
-                            columns = self._split(line)
+                            columns = record
                         else:
-                            table.append(self._split(line))
+                            table.append(record)
                         if head is not None and len(table) >= head:
                             break
                         # TODO: tail
@@ -228,23 +546,3 @@ class DataSource_CSV(DataSource_TableStore):
             
         return result
 
-
-    def _split(self, line):
-        result = []
-        token = ''
-        is_escaped = False
-        for ch in line:
-            if is_escaped:
-                token += ch
-                is_escaped = False
-            elif ch == '\\':
-                is_escaped = True
-            elif ch == ',':
-                result.append(token)
-                token = ''
-            else:
-                if ch != '\n':
-                    token += ch
-        result.append(token)
-        
-        return result
@@ -0,0 +1,226 @@
+# Created on 18 October 2026 #
+
+
+import sys, os, threading, logging
+import numpy as np
+from sd_dataschema import Schema
+from sd_datasource import DataSource
+
+import h5py
+
+
+class HDF5TimeIndex:
+    """Locates rows by time in a dataset sorted by the time field (e.g., written by slowpy DataStore_HDF5)
+    - Binary search over the chunks using the first timestamp of each chunk, then within the chunk found.
+    - The first timestamps are cached; they do not change as the dataset is append-only.
+    """
+
+    def __init__(self, dataset, time_field):
+        self.dataset = dataset
+        self.time_field = time_field
+        self.chunk_rows = dataset.chunks[0] if dataset.chunks else 8192
+        self.chunk_first = {}   # chunk index -> timestamp of the first row
+
+
+    def find(self, t, nrows):
+        """returns the index of the first row with the timestamp >= t
+        """
+        nchunks = (nrows + self.chunk_rows - 1) // self.chunk_rows
+        lo, hi = 0, nchunks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get_chunk_first(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+
+        begin = (lo - 1) * self.chunk_rows
+        end = min(lo * self.chunk_rows, nrows)
+        times = self.dataset.fields(self.time_field)[begin:end]
+        return begin + int(np.searchsorted(times, t, side='left'))
+
+
+    def _get_chunk_first(self, chunk):
+        t = self.chunk_first.get(chunk, None)
+        if t is None:
+            t = float(self.dataset.fields(self.time_field)[chunk * self.chunk_rows])
+            self.chunk_first[chunk] = t
+        return t
+
+
+
+class DataSource_HDF5(DataSource):
+    def __init__(self, app, project, params):
+        super().__init__(app, project, params)
+
+        dburl = Schema.parse_dburl(params.get('url', ''))
+        self.filepath = params.get('file', dburl.get('db', None))
+        self.time_field = params.get('time_field', 'timestamp')
+        self.dataset_names = params.get('dataset', None)
+        if self.dataset_names is not None and type(self.dataset_names) is not list:
+            self.dataset_names = [ self.dataset_names ]
+        if self.filepath is None:
+            logging.error('HDF5 file not specified')
+
+        self.hdf5_file = None
+        self.inode = None
+        self.datasets = {}  # dataset name -> (dataset, HDF5TimeIndex)
+        self.channels = {}  # channel name -> dataset name
+        self.lock = threading.Lock()
+        self.open_error_reported = False
+
+
+    def finalize(self):
+        with self.lock:
+            self._close()
+
+
+    def get_channels(self, force_rescan=False):
+        with self.lock:
+            if not self._open(reopen=force_rescan):
+                return []
+            return [ { 'name': name } for name in self.channels ]
+
+
+    def get_timeseries(self, channels, length, to, resampling=None, reducer='last', filler='fillna', envelope=0, prior_data=0):
+        start = to - length
+        result = {}
+
+        with self.lock:
+            if not self._open():
+                return {}
+
+            fields_of_dataset = {}
+            for ch in channels:
+                name = self.channels.get(ch, None)
+                if name is not None:
+                    fields_of_dataset.setdefault(name, []).append(ch)
+
+            for name, fields in fields_of_dataset.items():
+                dataset, index = self.datasets[name]
+                try:
+                    result.update(self._read(dataset, index, fields, start, to, prior_data))
+                except Exception as e:
+                    logging.error(f'unable to read HDF5 dataset: {self.filepath}/{name}: {e}')
+
+        for ch, data in result.items():
+            data['length'] = length
+
+        if resampling is not None:
+            return self.resample(result, length, to, resampling, reducer, filler, envelope, prior_data=prior_data)
+
+        # NumPy arrays are passed to the response as they are; the JSON serializer handles them
+        for data in result.values():
+            data['t'] = np.round(data['t'], 3)
+        return result
+
+
+    def _read(self, dataset, index, fields, start, stop, prior_data):
+        """reads only the rows in [start, stop) and the requested fields
+        Returns:
+          - { field: { 'start': start, 't': array, 'x': array } }, with NaN values removed
+        """
+        nrows = dataset.shape[0]
+        begin, end = index.find(start, nrows), index.find(stop, nrows)
+        data = dataset.fields([ self.time_field ] + fields)[begin:end]
+
+        prior = None
+        if prior_data > 0 and begin > 0:
+            # the latest non-NaN value of each field might be some rows before
+            prior = dataset.fields([ self.time_field ] + fields)[max(0, begin - index.chunk_rows):begin]
+
+        result = {}
+        for field in fields:
+            t, x = data[self.time_field], self._decode(data[field])
+            if x.dtype.kind == 'f':
+                selected = ~np.isnan(x)
+                t, x = t[selected], x[selected]
+            if prior is not None and (prior_data == 2 or len(t) == 0):
+                prior_t, prior_x = prior[self.time_field], self._decode(prior[field])
+                if prior_x.dtype.kind == 'f':
+                    selected = ~np.isnan(prior_x)
+                    prior_t, prior_x = prior_t[selected], prior_x[selected]
+                if len(prior_t) > 0:
+                    t = np.concatenate([ prior_t[-1:], t ])
+                    x = np.concatenate([ prior_x[-1:], x ])
+            if len(t) > 0:
+                result[field] = { 'start': start, 't': t - start, 'x': x }
+
+        return result
+
+
+    def _decode(self, x):
+        if x.dtype.kind in 'OS':
+            return np.array([ (v.decode() if isinstance(v, bytes) else v) for v in x ], dtype=object)
+        return x
+
+
+    def _open(self, reopen=False):
+        if self.filepath is None:
+            return False
+
+        try:
+            inode = os.stat(self.filepath).st_ino
+        except Exception as e:
+            if not self.open_error_reported:
+                logging.error(f'unable to find HDF5 file: {self.filepath}: {e}')
+                self.open_error_reported = True
+            self._close()
+            return False
+
+        if self.hdf5_file is not None and inode == self.inode and not reopen:
+            for dataset, index in self.datasets.values():
+                try:
+                    dataset.refresh()   # get the rows written after opening (SWMR)
+                except Exception:
+                    pass
+            return True
+
+        self._close()
+        try:
+            self.hdf5_file = h5py.File(self.filepath, 'r', libver='latest', swmr=True)
+        except Exception:
+            try:
+                # not written in the SWMR mode
+                self.hdf5_file = h5py.File(self.filepath, 'r')
+            except Exception as e:
+                if not self.open_error_reported:
+                    logging.error(f'unable to open HDF5 file: {self.filepath}: {e}')
+                    self.open_error_reported = True
+                self.hdf5_file = None
+                return False
+        self.inode = inode
+        self.open_error_reported = False
+
+        def add_dataset(name, obj):
+            if not isinstance(obj, h5py.Dataset) or obj.dtype.names is None:
+                return
+            if self.time_field not in obj.dtype.names or len(obj.shape) != 1:
+                return
+            if self.dataset_names is not None and name not in self.dataset_names:
+                return
+            self.datasets[name] = (obj, HDF5TimeIndex(obj, self.time_field))
+            for field in obj.dtype.names:
+                if field == self.time_field:
+                    continue
+                if field in self.channels:
+                    logging.warning(f'HDF5: duplicate channel name "{field}" in {name}: ignored')
+                    continue
+                self.channels[field] = name
+        self.hdf5_file.visititems(add_dataset)
+
+        return True
+
+
+    def _close(self):
+        if self.hdf5_file is not None:
+            try:
+                self.hdf5_file.close()
+            except Exception as e:
+                logging.warning(f'HDF5: error on closing file: {e}')
+        self.hdf5_file = None
+        self.inode = None
+        self.datasets = {}
+        self.channels = {}
@@ -13,6 +13,7 @@ class DataSource_PostgreSQL_NoAsync(DataSource_SQL):
         
         self.db_has_floor = True
         self.placeholder = '%s'
+        self.latest_per_tag_syntax = 'distinct_on'
         
         self.url = params.get('url', None)
         if self.url is not None and self.url[0:13] != 'postgresql://':
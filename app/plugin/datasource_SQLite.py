@@ -14,6 +14,7 @@ class DataSource_SQLite(DataSource_SQL):
         self.time_sep = ' '
         self.db_has_floor = False
         self.placeholder = '?'
+        self.latest_per_tag_syntax = 'window'
         
         url = params.get('url', '')
         if url[0:10] == 'sqlite:///':
@@ -38,7 +39,7 @@ class DataSource_SQLite(DataSource_SQL):
             return await super().connect()
 
         try:
-            conn = sqlite3.connect(db_file)
+            conn = sqlite3.connect(db_file, check_same_thread=False)  # queries run in the thread pool
         except Exception as e:
             logging.error(f'DB "{db_file}" cannot be connected: {str(e)}')
             conn = None
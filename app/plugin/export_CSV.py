@@ -1,7 +1,7 @@
 # Created by Sanshiro Enomoto on 28 December 2024 #
 
 
-import datetime, copy, logging
+import datetime, copy, asyncio, logging
 
 import slowlette
 from sd_component import ComponentPlugin
@@ -28,14 +28,23 @@ class Export_CSV(ComponentPlugin):
         if timeseries is None:
             return None
 
-        table = [ ['DateTime', 'TimeStamp'] ]
-        table[0].extend(timeseries.keys())
-        for name, data in timeseries.items():
-            start = data.get('start', 0)
-            tk = data.get('t', [])
-            xk = data.get('x', [])
-            for k in range(len(tk)):
-                if len(table) <= k+1:
+        return slowlette.Response(content_type='text/csv', content=self.generate_csv(timeseries, timezone))
+
+    
+    async def generate_csv(self, timeseries, timezone, rows_per_chunk=1000):
+        """yields the CSV text in chunks of rows, so that the entire table is not made in memory
+        """
+        columns = [ (data.get('start', 0), data.get('t', []), data.get('x', [])) for data in timeseries.values() ]
+        nrows = max([ len(tk) for start, tk, xk in columns ], default=0)
+        
+        lines = [ ','.join([ 'DateTime', 'TimeStamp' ] + list(timeseries.keys())) ]
+        separator = ''
+        for k in range(nrows):
+            row = None
+            for start, tk, xk in columns:
+                if k >= len(tk):
+                    continue
+                if row is None:
                     t = int(10*(start+tk[k]))/10.0
                     date_local = datetime.datetime.fromtimestamp(t)
                     date_utc = datetime.datetime.utcfromtimestamp(t)
@@ -47,12 +56,14 @@ class Export_CSV(ComponentPlugin):
                     else:
                         date = date_utc
                         tz = '+00:00'
-                        
-                    table.append([ date.strftime('%Y-%m-%dT%H:%M:%S') + tz, '%d' % t ])
-                table[k+1].append(str(xk[k]) if xk[k] is not None else 'null')
-
-        content = '\n'.join([
-            ','.join(['NaN' if col is None else col for col in row]) for row in table
-        ]).encode()
-                
-        return slowlette.Response(content_type='text/csv', content=content)
+                    row = [ date.strftime('%Y-%m-%dT%H:%M:%S') + tz, '%d' % t ]
+                row.append(str(xk[k]) if xk[k] is not None else 'null')
+            lines.append(','.join(row))
+            
+            if len(lines) >= rows_per_chunk:
+                yield separator + '\n'.join(lines)
+                lines, separator = [], '\n'
+                await asyncio.sleep(0)   # not to block the other requests for a large export
+
+        if len(lines) > 0:
+            yield separator + '\n'.join(lines)
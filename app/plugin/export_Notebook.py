@@ -29,7 +29,7 @@ class Export_Notebook(ComponentPlugin):
     @slowlette.get('/api/export/notebook/{channels}')
     def export_notebook(self, channels:str, opts:dict):
         notebook = self.generate_notebook(channels, opts)
-        return json.dumps(notebook, indent=4)
+        return slowlette.Response(content_type='text/plain', content=json.JSONEncoder(indent=4).iterencode(notebook))
 
     
     def generate_cells(self, params, opts):
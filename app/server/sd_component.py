@@ -1,10 +1,59 @@
 # Created by Sanshiro Enomoto on 25 December 2024 #
 
-import sys, os, copy, glob, inspect, logging, traceback
+import sys, os, time, copy, glob, inspect, threading, asyncio, logging, traceback
 import importlib.util
 import slowlette
 
 
+class RevisionNotifier:
+    """Revision counter for long-polls: wait() returns when the revision becomes newer than "since"
+    - notify() increments the revision and wakes all the waiters once; it can be called from any thread.
+    - The revision starts from the current UNIX time, so that a revision from before a server restart is older.
+    """
+    
+    def __init__(self):
+        self.revision = int(time.time())
+        self.loop = None
+        self.event = None
+        self.waiters = 0
+        self.lock = threading.Lock()
+
+        
+    def notify(self) -> None:
+        with self.lock:
+            self.revision = max(self.revision + 1, int(time.time()))
+        if self.waiters > 0 and self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass   # event loop already closed
+
+            
+    async def wait(self, since:int, timeout=None) -> int:
+        """returns the current revision, after waiting for it to become larger than "since" (or timeout)
+        """
+        self.loop = asyncio.get_running_loop()
+        self.waiters += 1
+        try:
+            while self.revision <= since:
+                if self.event is None:
+                    self.event = asyncio.Event()
+                await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.waiters -= 1
+        return self.revision
+
+    
+    def _wake(self):
+        # all the waiters of the current event are woken up; the next waits use a new event
+        if self.event is not None:
+            self.event.set()
+            self.event = None
+
+
+
 class Component(slowlette.App):
     """ Base class for App components
     """
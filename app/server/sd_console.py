@@ -1,40 +1,31 @@
 # Created by Sanshiro Enomoto on 31 December 2024 #
 
 
-import sys, io, collections, itertools, asyncio, logging
+import sys, io, collections, itertools, logging
 
 import slowlette
-from sd_component import Component
+from sd_component import Component, RevisionNotifier
 
 
 
 class AwaitableStringIO(io.StringIO):
-    def __init__(self, eventloop):
+    def __init__(self):
         super().__init__()
-        self.eventloop = eventloop
-        self._condition = asyncio.Condition()
+        self.notifier = RevisionNotifier()
 
         
-    async def wait_for_write(self):
-        async with self._condition:
-            await self._condition.wait()
+    async def wait_for_write(self, since:int) -> int:
+        """waits for a write after the revision "since"; returns the current write revision
+        """
+        return await self.notifier.wait(since)
 
             
     def write(self, s):
         # this might be called in a different thread from the async event loop
         result = super().write(s)
-        asyncio.run_coroutine_threadsafe(self._schedule_notification(), self.eventloop)
+        self.notifier.notify()
         return result
 
-            
-    async def _schedule_notification(self):
-        asyncio.create_task(self._notify_write())
-
-            
-    async def _notify_write(self):
-        async with self._condition:
-            self._condition.notify_all()
-
 
 
 class ConsoleComponent(Component):
@@ -62,7 +53,7 @@ class ConsoleComponent(Component):
         if not self.enabled:
             return
 
-        self.console_awaitable_stdout = AwaitableStringIO(asyncio.get_running_loop())
+        self.console_awaitable_stdout = AwaitableStringIO()
         sys.stdout = self.console_awaitable_stdout
         
         if self.console_stdout is not None:
@@ -104,9 +95,9 @@ class ConsoleComponent(Component):
                 # AwaitableStringIO cannot be used with WSGI, as there is no contineous event loop
                 await self.build()
 
+            write_revision = self.console_stdout.notifier.revision
             if (self.revision <= since) and (self.console_stdout.tell() == 0):
-                await self.console_stdout.wait_for_write()
-                await asyncio.sleep(0.2)
+                await self.console_stdout.wait_for_write(write_revision)
             
         if self.console_stdout.tell() > 0:
             output = self.console_stdout.getvalue()
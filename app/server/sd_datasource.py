@@ -1,6 +1,6 @@
 # Created by Sanshiro Enomoto on 20 March 2022 #
 
-import os, time, math, json, statistics, logging
+import os, time, math, json, statistics, asyncio, threading, concurrent.futures, logging
 
 import slowlette
 from sd_component import ComponentPlugin, PluginComponent
@@ -8,6 +8,83 @@ from sd_component import ComponentPlugin, PluginComponent
 from sd_dataschema import Schema
 import sd_blobstorage
 
+try:
+    import numpy as np
+except ImportError:
+    np = None   # resampling falls back to the pure-Python implementation
+
+
+class SyncCallExecutor:
+    """Runs blocking (synchronous) calls in a thread pool, so that they do not block the event loop
+    - At most "workers" calls run concurrently; further calls wait in the queue.
+    - If a call does not return within "timeout" seconds, the caller gets the "default" value.
+      The thread cannot be interrupted and keeps occupying a worker until the call returns.
+    - workers=0 runs the calls directly in the event loop thread.
+    """
+    
+    def __init__(self, name, workers=4, timeout=None):
+        self.name = name
+        self.workers = workers
+        self.timeout = timeout if (timeout is not None and timeout > 0) else None
+        
+        self.executor = None
+        self.lock = threading.Lock()
+        self.queued, self.running = 0, 0
+        self.completed, self.timeouts, self.errors = 0, 0, 0
+
+        
+    async def run(self, func, *args, default=None, **kwargs):
+        if self.workers <= 0:
+            return func(*args, **kwargs)
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+
+        def call():
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+        with self.lock:
+            self.queued += 1
+        cf_future = self.executor.submit(call)
+        future = asyncio.wrap_future(cf_future)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # errors are reported by the awaiting side
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logging.error(f'{self.name}: {func.__name__}() did not finish in {self.timeout} sec')
+            return default
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            if cf_future.cancel():  # still in the queue (timed out or the request was cancelled)
+                with self.lock:
+                    self.queued -= 1
+                    
+        self.completed += 1
+        return result
+
+    
+    def stats(self):
+        return {
+            'workers': self.workers, 'queued': self.queued, 'running': self.running,
+            'completed': self.completed, 'timeouts': self.timeouts, 'errors': self.errors,
+        }
+
+    
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+            
 
 class DataSource(ComponentPlugin):
     """Base class for DataSource plugin
@@ -21,6 +98,16 @@ class DataSource(ComponentPlugin):
             blob_params = params.get('blob_storage')
             if blob_params.get('type', '') == 'file':
                 self.blob_storage = sd_blobstorage.BlobStorage_File(app, project, blob_params)
+
+        # blocking calls (sync get_*() methods, DB-API queries) are run in a thread pool
+        pool_params = params.get('thread_pool', {})
+        if type(pool_params) is not dict:
+            pool_params = {}
+        self.sync_executor = SyncCallExecutor(
+            name = f'DataSource_{params.get("type", "")}',
+            workers = int(pool_params.get('workers', 4)),
+            timeout = pool_params.get('timeout', None),
+        )
         
         
     @slowlette.on_event('startup')
@@ -30,7 +117,16 @@ class DataSource(ComponentPlugin):
     
     @slowlette.on_event('shutdown')
     async def api_finalize(self):
-        return await self.aio_finalize()
+        try:
+            return await self.aio_finalize()
+        finally:
+            self.sync_executor.shutdown()
+
+    
+    def public_config(self):
+        return {
+            'thread_pool': self.sync_executor.stats(),
+        }
 
     
     @slowlette.get('/api/channels')
@@ -96,26 +192,34 @@ class DataSource(ComponentPlugin):
                     
     async def aio_get_channels(self, force_rescan=False):
         """[implement in child class] returns a list of channels (async version)
+        Note:
+          - if not overridden, the sync version is called in the thread pool
         """
-        return self.get_channels(force_rescan=force_rescan)
+        return await self.sync_executor.run(self.get_channels, force_rescan=force_rescan, default=[])
 
     
     async def aio_get_timeseries(self, channels, length, to, resampling=None, reducer='last', filler='fillna', envelope=0, prior_data=0):
         """[implement in child class] returns a time-series data (async version)
+        Note:
+          - if not overridden, the sync version is called in the thread pool
         """
-        return self.get_timeseries(channels, length, to, resampling, reducer, filler, envelope, prior_data)
+        return await self.sync_executor.run(self.get_timeseries, channels, length, to, resampling, reducer, filler, envelope, prior_data)
 
     
     async def aio_get_object(self, channels, length, to):
         """[implement in child class] returns a single-point data object (async version)
+        Note:
+          - if not overridden, the sync version is called in the thread pool
         """
-        return self.get_object(channels, length, to)
+        return await self.sync_executor.run(self.get_object, channels, length, to)
 
     
     async def aio_get_blob(self, channel:str, blob_id:str):
         """[implement in child class] returns a tuple of content_type (str) and blob (bytes)  (async version)
+        Note:
+          - if not overridden, the sync version is called in the thread pool
         """
-        return self.get_blob(channel, blob_id)
+        return await self.sync_executor.run(self.get_blob, channel, blob_id, default=(None, None))
 
 
     def initialize(self):
@@ -175,8 +279,11 @@ class DataSource(ComponentPlugin):
                     continue
                 t = data.get('t', [])
                 if len(t) > 1:
-                    dt = [ t[k+1]-t[k] for k in range(len(t)-1) ]
-                    intervals.append(statistics.median(dt))
+                    if np is not None:
+                        intervals.append(float(np.median(np.diff(np.asarray(t, dtype=float)))))
+                    else:
+                        dt = [ t[k+1]-t[k] for k in range(len(t)-1) ]
+                        intervals.append(statistics.median(dt))
             if len(intervals) > 0:
                 interval = statistics.median(intervals)
             else:
@@ -190,10 +297,16 @@ class DataSource(ComponentPlugin):
             start = start - interval
             nbins = nbins + 1
 
-        def _reduce_buckets(buckets, reducer):
-            x = [ cls.reduce(bk, reducer) for bk in buckets ]
-            x = [ None if math.isnan(xk) else xk for xk in x ]
-            return x
+        # reducers to be applied: the main one, plus the ones for the envelope
+        methods = [ reducer ]
+        if envelope >= 1:
+            if reducer in ['first', 'last', 'mean', 'median']:
+                methods += [ 'min', 'max' ]
+        if envelope >= 2:
+            if reducer != 'count':
+                methods.append('count')
+            if reducer == 'mean':
+                methods.append('sem')
                 
         result = {}
         for name, data in set_of_timeseries.items():
@@ -213,37 +326,138 @@ class DataSource(ComponentPlugin):
                     else:
                         break
                     
-            buckets = []
-            for bin in range(nbins):
-                t.append(float(interval) * (bin + 0.5))
-                buckets.append([])
-
-            for k in range(len(x_in)):
-                bin = math.floor((t0 + t_in[k]) / interval)
-                if bin < 0 or bin >= nbins:
-                    continue
-                try:
-                    xk = float(x_in[k])
-                except:
-                    xk = float('nan')
-                buckets[bin].append(xk)
+            t.extend([ float(interval) * (bin + 0.5) for bin in range(nbins) ])
+            
+            reduced = None
+            if np is not None:
+                reduced = cls._reduce_timeseries_numpy(t0, t_in, x_in, interval, nbins, methods)
+            if reduced is None:
+                reduced = cls._reduce_timeseries_python(t0, t_in, x_in, interval, nbins, methods)
 
-            x.extend(_reduce_buckets(buckets, reducer))
+            x.extend(reduced[reducer])
             result[name] = { 'start': start, 'length': length, 't': t, 'x': x }
 
             if envelope >= 1:
                 if reducer in ['first', 'last', 'mean', 'median']:
-                    result[name]['x_min'] = _reduce_buckets(buckets, 'min')
-                    result[name]['x_max'] = _reduce_buckets(buckets, 'max')
+                    result[name]['x_min'] = reduced['min']
+                    result[name]['x_max'] = reduced['max']
             if envelope >= 2:
                 if reducer != 'count':
-                    result[name]['x_n'] = _reduce_buckets(buckets, 'count')
+                    result[name]['x_n'] = reduced['count']
                 if reducer == 'mean':
-                    result[name]['x_err'] = _reduce_buckets(buckets, 'sem')
+                    result[name]['x_err'] = reduced['sem']
             
         return result
 
 
+    @classmethod
+    def _reduce_timeseries_python(cls, t0, t_in, x_in, interval, nbins, methods):
+        """bucketing and reducing with DataSource.reduce(); used for non-numeric values or without NumPy
+        Returns:
+          - { method: list of reduced values for the buckets }
+        """
+        buckets = [ [] for bin in range(nbins) ]
+        for k in range(len(x_in)):
+            bin = math.floor((t0 + t_in[k]) / interval)
+            if bin < 0 or bin >= nbins:
+                continue
+            try:
+                xk = float(x_in[k])
+            except:
+                xk = float('nan')
+            buckets[bin].append(xk)
+
+        reduced = {}
+        for method in methods:
+            x = [ cls.reduce(bk, method) for bk in buckets ]
+            reduced[method] = [ None if math.isnan(xk) else xk for xk in x ]
+            
+        return reduced
+
+    
+    @classmethod
+    def _reduce_timeseries_numpy(cls, t0, t_in, x_in, interval, nbins, methods):
+        """vectorized bucketing and reducing, equivalent to _reduce_timeseries_python()
+        Returns:
+          - { method: list of reduced values for the buckets }
+          - None if the values cannot be handled as a numeric array
+        """
+        try:
+            t_array = np.asarray(t_in, dtype=float)
+            x_array = np.asarray(x_in, dtype=float)
+        except (TypeError, ValueError):
+            return None
+        if t_array.ndim != 1 or x_array.shape != t_array.shape:
+            return None
+
+        bins = np.floor((t0 + t_array) / interval)
+        selected = (bins >= 0) & (bins < nbins) & ~np.isnan(x_array)
+        bins = bins[selected].astype(np.int64)
+        x_array = x_array[selected]
+
+        # group the values by bucket, preserving the time order within each bucket
+        order = np.argsort(bins, kind='stable')
+        bins, x_array = bins[order], x_array[order]
+        counts = np.bincount(bins, minlength=nbins)
+        filled = counts > 0
+        n = counts[filled]
+        ends = np.cumsum(n)
+        starts = ends - n
+
+        def to_list(values, min_count=1):
+            buckets = np.full(nbins, np.nan)
+            buckets[filled] = values
+            buckets[counts < min_count] = np.nan
+            return [ None if math.isnan(xk) else xk for xk in buckets.tolist() ]
+
+        stats = {}
+        def get_stat(name):
+            if name in stats:
+                return stats[name]
+            if len(x_array) == 0:
+                value = np.zeros(0)
+            elif name == 'sum':
+                value = np.add.reduceat(x_array, starts)
+            elif name == 'mean':
+                value = get_stat('sum') / n
+            elif name == 'stdev':
+                deviation = x_array - np.repeat(get_stat('mean'), n)
+                sum2 = np.add.reduceat(deviation**2, starts)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = np.sqrt(sum2 / (n - 1))
+            stats[name] = value
+            return value
+        
+        reduced = {}
+        for method in methods:
+            if method == 'count':
+                reduced[method] = counts.tolist()
+            elif len(x_array) == 0:
+                reduced[method] = [ None ] * nbins
+            elif method == 'first':
+                reduced[method] = to_list(x_array[starts])
+            elif method == 'last':
+                reduced[method] = to_list(x_array[ends-1])
+            elif method in ['mean', 'sum']:
+                reduced[method] = to_list(get_stat(method))
+            elif method == 'median':
+                x_sorted = x_array[np.lexsort((x_array, bins))]
+                lower, upper = x_sorted[starts + (n-1)//2], x_sorted[starts + n//2]
+                reduced[method] = to_list((lower + upper) / 2)
+            elif method == 'min':
+                reduced[method] = to_list(np.minimum.reduceat(x_array, starts))
+            elif method == 'max':
+                reduced[method] = to_list(np.maximum.reduceat(x_array, starts))
+            elif method in ['sd','std','stdev','rms','sigma']:
+                reduced[method] = to_list(get_stat('stdev'), min_count=2)
+            elif method in ['sem','err']:
+                reduced[method] = to_list(get_stat('stdev') / np.sqrt(n), min_count=2)
+            else:
+                reduced[method] = [ None ] * nbins
+
+        return reduced
+
+
     @classmethod
     def reduce(cls, x, method):
         """calculate a single scalar number out of the input list of values
@@ -293,6 +507,21 @@ class DataSource(ComponentPlugin):
         return math.nan
 
     
+    @classmethod
+    def time_offsets(cls, timestamps, start):
+        """converts the UNIX timestamps into the time from start, truncated to milliseconds (can be used in child class)
+        Returns:
+          - a NumPy array if NumPy is available, otherwise a list;
+            the Response JSON serializer handles both, and NumPy arrays are serialized without conversion.
+        """
+        if np is not None:
+            try:
+                return np.trunc(1000 * (np.asarray(timestamps, dtype=float) - start)) / 1000
+            except (TypeError, ValueError):
+                pass
+        return [ int(1000*(timestamp-start))/1000.0 for timestamp in timestamps ]
+
+    
     @classmethod
     def decode_if_json(cls, value):
         if type(value) is not str or len(value) < 2:
@@ -317,6 +546,9 @@ class DataSource(ComponentPlugin):
 class DataSourceComponent(PluginComponent):
     def __init__(self, app, project):
         super().__init__('data_source', app, project)
+
+        # data sources are independent: a slow backend should not delay the others
+        self.slowlette.concurrent_subapps = True
         
 
     def build(self, plugin_config):
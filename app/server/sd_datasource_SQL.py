@@ -1,7 +1,7 @@
 # Created by Sanshiro Enomoto on 10 April 2023 #
 
 
-import sys, os, asyncio, time, datetime, logging, traceback
+import sys, os, asyncio, threading, time, datetime, logging, traceback
 from sd_datasource import DataSource
 from sd_dataschema import Schema
 from sd_datasource_TableStore import DataSource_TableStore
@@ -11,6 +11,7 @@ class SQLQueryResult:
     def __init__(self, cursor=None):
         self.cursor = cursor
         self.is_error = False
+        self.columns, self.rows = None, None
 
         
     def __del__(self):
@@ -18,7 +19,21 @@ class SQLQueryResult:
             self.cursor.close()
 
             
+    def fetch_all(self):
+        """reads all the rows and closes the cursor, so that the cursor is not used later (possibly from another thread)
+        """
+        if self.cursor is not None:
+            has_rows = self.cursor.description is not None
+            self.columns = [ col[0] for col in self.cursor.description ] if has_rows else []
+            self.rows = self.cursor.fetchall() if has_rows else []
+            self.cursor.close()
+            self.cursor = None
+        return self
+
+    
     def get_column_names(self):
+        if self.columns is not None:
+            return self.columns
         if self.cursor:
             return [ col[0] for col in self.cursor.description ]
         else:
@@ -26,6 +41,8 @@ class SQLQueryResult:
 
     
     def get_table(self):
+        if self.rows is not None:
+            return self.rows
         if self.cursor:
             return self.cursor.fetchall()
         else:
@@ -64,9 +81,14 @@ class SQLBaseServer:
     
     
 class SQLServer(SQLBaseServer):
+    """SQL server with a DB-API (blocking) connection
+    - If "executor" (SyncCallExecutor) is set, the queries are run in its thread pool, one at a time.
+    """
     def __init__(self, conn):
         super().__init__()
         self.conn = conn
+        self.executor = None
+        self.lock = threading.Lock()   # DB-API connections are not necessarily thread-safe
 
         
     def is_connected(self):
@@ -84,38 +106,51 @@ class SQLServer(SQLBaseServer):
             return SQLQueryResult()
 
         logging.debug(f'SQL Execute: {sql}; params={params}')
+        def execute():
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute(sql, params)
+                self.conn.commit()
+                return SQLQueryResult(cursor).fetch_all()
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(sql, params)
-            self.conn.commit()
+            return await self._run(execute)
         except Exception as e:
             logging.error(f'SQL Execute Error: {e}')
             return SQLQueryErrorResult(str(e))
             
-        return SQLQueryResult(cursor)
-            
         
     async def fetch(self, sql, params=()):
         if not self.is_connected():
             return SQLQueryResult()
 
         logging.debug(f'SQL Fetch: {sql}; params={params}')
+        def fetch():
+            with self.lock:
+                cursor = self.conn.cursor()
+                cursor.execute(sql, params)
+                return SQLQueryResult(cursor).fetch_all()
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(sql, params)
+            return await self._run(fetch)
         except Exception as e:
             logging.error(f'SQL Fetch Error: {e}')
             return SQLQueryErrorResult(str(e))
-            
-        return SQLQueryResult(cursor)
+
+
+    async def _run(self, func):
+        if self.executor is None:
+            return func()
+        return await self.executor.run(func, default=SQLQueryErrorResult('query timed out'))
 
 
     
 class DataSource_SQL(DataSource_TableStore):
+    has_latest_per_tag_query = True
+    
     def __init__(self, app, project, params):
         self.time_sep = 'T'
         self.placeholder = '?'
         self.db_has_floor = False
+        self.latest_per_tag_syntax = 'group_by'  # 'group_by', 'window', or 'distinct_on'
         super().__init__(app, project, params)
 
         self.server = SQLBaseServer()
@@ -233,6 +268,8 @@ class DataSource_SQL(DataSource_TableStore):
         if not server.is_connected():
             return False
 
+        if isinstance(server, SQLServer) and server.executor is None:
+            server.executor = self.sync_executor
         self.server = server
         return True
 
@@ -321,6 +358,15 @@ class DataSource_SQL(DataSource_TableStore):
         else:
             return None
 
+
+    def _uses_server_resampling(self, time_type, resampling, reducer, use_server_resampling):
+        if resampling is None or resampling <= 0 or not self.db_has_floor or not use_server_resampling:
+            return False
+        if self._get_timediffsec_query('time', time_type, 0, 0) is None:
+            return False  # no DB-specific syntax for the time difference
+        
+        return reducer in ['first', 'last', 'mean', 'sum', 'min', 'max']
+
     
     async def _execute_query(self, table_name, time_col, time_type, time_from, time_to, tag_col, tag_values, fields, resampling=None, reducer=None, stop=None, lastonly=False, use_server_resampling=True):
         if not await self._try_reconnect():
@@ -357,8 +403,49 @@ class DataSource_SQL(DataSource_TableStore):
         else:
             sql_orderby = f"ORDER BY {time_col} ASC"
 
-        if time_col is None or lastonly:
+        if time_col is None:
             pass
+        elif lastonly:
+            if (tag_col is not None) and (len(tag_values) > 1):
+                # last row of each tag value: the syntax to use depends on the SQL type
+                columns = ','.join([ time_col, tag_col ] + fields)
+                if self.latest_per_tag_syntax == 'distinct_on':
+                    sql = ' '.join([
+                        f"SELECT DISTINCT ON ({tag_col}) {columns}",
+                        f"{sql_from}",
+                        f"{sql_where}",
+                        f"ORDER BY {tag_col}, {time_col} DESC"
+                    ])
+                elif self.latest_per_tag_syntax == 'window':
+                    sql = ' '.join([
+                        f"SELECT {columns} FROM (",
+                        f"    SELECT {columns},",
+                        f"        ROW_NUMBER() OVER (PARTITION BY {tag_col} ORDER BY {time_col} DESC) AS row_index",
+                        f"    {sql_from}",
+                        f"    {sql_where}",
+                        f") AS t",
+                        f"WHERE row_index = 1"
+                    ])
+                else:
+                    sql_cte_last = ' '.join([
+                        f"SELECT",
+                        f"    {tag_col}, max({time_col}) AS last_timestamp",
+                        f"{sql_from}",
+                        f"{sql_where}",
+                        f"GROUP BY {tag_col}"
+                    ])
+                    sql = ' '.join([
+                        f"SELECT",
+                        f"    {','.join([ 't.'+col for col in [ time_col, tag_col ] + fields ])}",
+                        f"FROM",
+                        f"    {table_name} AS t",
+                        f"JOIN",
+                        f"    ({sql_cte_last}) AS b",
+                        f"ON",
+                        f"    t.{tag_col} = b.{tag_col}",
+                        f"    AND t.{time_col} = b.last_timestamp"
+                    ])
+                params.extend(params_where)
         elif resampling is None or resampling <= 0:
             pass
         elif not self.db_has_floor:
@@ -1,7 +1,8 @@
 # Created by Sanshiro Enomoto on 10 April 2023 #
 
 
-import sys, os, datetime, logging
+import sys, os, time, asyncio, bisect, collections, datetime, logging
+import slowlette
 from sd_dataschema import Schema
 from sd_datasource import DataSource
 
@@ -12,10 +13,146 @@ def is_numeric_value(x):
 
 
 
+class TimeSeriesCache:
+    """Cache of raw time-series query results, with incremental "tail" update
+    - Each entry holds the data points of one channel for a contiguous time range [begin, end).
+    - A query within the cached range is answered from memory. For a query extending the range to
+      the future (e.g., auto-refreshing plots), only the new tail needs to be fetched from the DB;
+      the tail query overlaps with the cached range by "overlap" seconds to capture late-written data.
+    - Data older than "retention" seconds from the end of the range is dropped.
+    - Entries are evicted in the least-recently-used order if the total number of points exceeds "max_points".
+    """
+    
+    def __init__(self, retention=86400, max_points=10000000, overlap=10):
+        self.retention = retention
+        self.max_points = max_points
+        self.overlap = overlap
+        
+        self.entries = collections.OrderedDict()  # key -> [ begin, end, t_list, x_list ]
+        self.npoints = 0
+
+        
+    def get_missing_range(self, key, start, stop):
+        """returns the time range (begin, end) to be fetched from the DB, or None if fully cached
+        """
+        entry = self.entries.get(key, None)
+        if entry is None or start < entry[0] or start > entry[1]:
+            return (start, stop)
+        if stop <= entry[1]:
+            return None
+        return (max(entry[0], entry[1] - self.overlap), stop)
+
+    
+    def update(self, key, begin, end, t, x):
+        """stores the query result for the time range [begin, end), replacing the cached data in the range
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.npoints -= len(entry[2])
+        if entry is None or begin < entry[0] or begin > entry[1]:
+            entry = [ begin, end, list(t), list(x) ]
+        else:
+            k = bisect.bisect_left(entry[2], begin)
+            entry = [ entry[0], end, entry[2][:k] + list(t), entry[3][:k] + list(x) ]
+
+        if entry[0] < end - self.retention:
+            entry[0] = end - self.retention
+            k = bisect.bisect_left(entry[2], entry[0])
+            del entry[2][:k]
+            del entry[3][:k]
+            
+        self.entries[key] = entry
+        self.npoints += len(entry[2])
+        
+        while self.npoints > self.max_points and len(self.entries) > 0:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.npoints -= len(evicted[2])
+
+            
+    def get(self, key, start, stop):
+        """returns the cached data points in [start, stop) as a tuple of t (list) and x (list)
+        """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return [], []
+        self.entries.move_to_end(key)
+        
+        k0 = bisect.bisect_left(entry[2], start)
+        k1 = bisect.bisect_left(entry[2], stop)
+        return entry[2][k0:k1], entry[3][k0:k1]
+
+    
+
+
+class LastValueIndex:
+    """In-memory index of the last data point of each channel
+    - An entry is made from a "last-only" query result ending at the current time.
+    - The entry answers subsequent last-only queries whose time range ends at or after the entry
+      was made, for "ttl" seconds. Within the TTL, the entry is kept updated with newer values
+      from the mesh "current_data" stream, if the channel is published there.
+    """
+    
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self.entries = {}   # channel -> [ schema_key, t, x, checked_until, expires ]
+
+        
+    def lookup(self, schema_key, channel, start, stop):
+        """returns a tuple of (is_known, point), where point is (t, x) or None if no data in [start, stop)
+        """
+        entry = self.entries.get(channel, None)
+        if entry is None or entry[0] != schema_key:
+            return False, None
+        if time.time() > entry[4]:
+            del self.entries[channel]
+            return False, None
+        if stop < entry[3]:
+            return False, None
+        
+        return True, ((entry[1], entry[2]) if entry[1] >= start else None)
+
+    
+    def update_from_query(self, schema_key, channel, t, x, stop):
+        now = time.time()
+        if stop < now - 1:
+            return  # not the current value
+        self.entries[channel] = [ schema_key, t, x, stop, now + self.ttl ]
+
+        
+    def update_from_stream(self, channel, t, x):
+        entry = self.entries.get(channel, None)
+        if entry is not None and t > entry[1]:
+            entry[1], entry[2] = t, x
+
+
+            
 class DataSource_TableStore(DataSource):
+    # set True if _execute_query() with lastonly=True returns the last row of each tag value, not only the last row
+    has_latest_per_tag_query = False
+
+    
     def __init__(self, app, project, params):
         super().__init__(app, project, params)
         self.timeseries_table = None
+        self.max_concurrent_queries = int(params.get('max_concurrent_queries', 8))
+
+        self.query_cache = None
+        cache_params = params.get('cache', None)
+        if cache_params is not None:
+            if type(cache_params) is not dict:
+                cache_params = {}
+            self.query_cache = TimeSeriesCache(
+                retention = int(cache_params.get('retention', 86400)),
+                max_points = int(cache_params.get('max_points', 10000000)),
+                overlap = int(cache_params.get('overlap', 10)),
+            )
+
+        self.last_value_index = None
+        index_params = params.get('last_value_index', None)
+        if index_params is not None and index_params is not False:
+            if type(index_params) is not dict:
+                index_params = {}
+            self.last_value_index = LastValueIndex(ttl = float(index_params.get('ttl', 10)))
         
         self._configure(params)        
         self.channels_scanned = False
@@ -42,6 +179,13 @@ class DataSource_TableStore(DataSource):
         columns, table = [], []
         return columns, table
 
+    
+    # override this
+    def _uses_server_resampling(self, time_type, resampling, reducer, use_server_resampling):
+        """returns True if _execute_query() returns data resampled by the DB server (then the result is not cached)
+        """
+        return False
+
         
     async def aio_get_channels(self, force_rescan=False):
         await self._scan_channels(force_rescan=force_rescan)
@@ -65,13 +209,16 @@ class DataSource_TableStore(DataSource):
         use_prior_on_empty = (prior_data == 1)
         always_include_prior_data = (prior_data == 2)
             
-        result = {}
-        for schema in self.ts_schemata:
-            record = await self._get_query_result(
+        records = await self._gather_queries(
+            self._get_query_result(
                 schema, channels, length, to,
                 resampling=resampling, reducer=reducer, use_server_resampling=(envelope==0),
                 lastonly=False, 
             )
+            for schema in self.ts_schemata
+        )
+        result = {}
+        for record in records:
             result.update(record)
             
         if use_prior_on_empty or always_include_prior_data:
@@ -81,20 +228,21 @@ class DataSource_TableStore(DataSource):
                 
             end = to - length
             unlimited_length = end
-            for ch, data in result.items():
-                if always_include_prior_data or (len(data['x']) == 0):
-                    for schema in self.ts_schemata:
-                        # this will make a query of "order by time desc limit 1" 
-                        prior_point_record = await self._get_query_result(
-                            schema, [ch], unlimited_length, end,
-                            resampling=None, reducer=None, use_server_resampling=False, 
-                            lastonly=True
-                        )
-                        prior_point_data = prior_point_record.get(ch)
-                        if prior_point_data is not None and (len(prior_point_data.get('x', [])) > 0):
-                            data['t'].insert(0, prior_point_data['t'][-1] + prior_point_data['start'] - data['start'])
-                            data['x'].insert(0, prior_point_data['x'][-1])
-                            break  # from the schemata loop
+            remaining_channels = [ ch for ch, data in result.items() if always_include_prior_data or (len(data['x']) == 0) ]
+            for schema in self.ts_schemata:
+                if len(remaining_channels) == 0:
+                    break
+                # this will make a query of "order by time desc limit 1" 
+                prior_point_record = await self._get_last_points(schema, remaining_channels, unlimited_length, end)
+                for ch, prior_point_data in prior_point_record.items():
+                    if ch not in remaining_channels or len(prior_point_data.get('x', [])) == 0:
+                        continue
+                    data = result[ch]
+                    prior_t = float(prior_point_data['t'][-1]) + prior_point_data['start'] - data['start']
+                    t = data['t']
+                    data['t'] = [ prior_t ] + (t.tolist() if hasattr(t, 'tolist') else t)
+                    data['x'].insert(0, prior_point_data['x'][-1])
+                    remaining_channels.remove(ch)
                     
             result = { ch:data for ch,data in result.items() if len(data['x']) > 0 }
                         
@@ -105,35 +253,111 @@ class DataSource_TableStore(DataSource):
 
     
     async def aio_get_object(self, channels, length, to):
+        records = await self._gather_queries(
+            self._get_last_points(schema, channels, length, to)
+            for schema in self.obj_schemata + self.objts_schemata
+        )
+        # retry if the value is null?
+
         result = {}
-        for schema in self.obj_schemata + self.objts_schemata:
-            if schema.tag is None:
-                result.update(await self._get_query_result(
-                    schema, channels, length, to,
+        for record in records:
+            result.update(record)
+            
+        return result
+
+
+    @slowlette.post('/api/consume/current_data')
+    async def consume_current_data(self, doc:slowlette.DictJSON):
+        """keeps the last-value index up to date with the data published to the mesh
+        """
+        if self.last_value_index is None:
+            return None
+        
+        for name, entry in doc.items():
+            try:
+                t, x = entry['t'], entry['x']
+                if type(t) is list:
+                    t, x = t[-1], x[-1]
+                t = float(t) + float(entry.get('start', 0))
+            except:
+                continue
+            self.last_value_index.update_from_stream(name, t, x)
+            
+        return None
+
+    
+    async def _get_last_points(self, schema, channels, length, to):
+        """returns the last data point in the time range for each channel, in the same format as _get_query_result()
+        Note:
+          - the last-value index is looked up first, if enabled
+          - if the store can query the last row of each tag at once, a single query is made; otherwise one query per channel
+        """
+        stop = int(to)
+        start = int(stop - float(length))
+        schema_key = str(schema)
+        
+        result = {}
+        if self.last_value_index is not None:
+            remaining_channels = []
+            for ch in channels:
+                is_known, point = self.last_value_index.lookup(schema_key, ch, start, stop)
+                if not is_known:
+                    remaining_channels.append(ch)
+                elif point is not None:
+                    result[ch] = { 'start': start, 'length': int(length), 't': [ int(1000*(point[0]-start))/1000.0 ], 'x': [ point[1] ] }
+            channels = remaining_channels
+            if len(channels) == 0:
+                return result
+
+        if schema.tag is None or self.has_latest_per_tag_query:
+            records = [ await self._get_query_result(
+                schema, channels, length, to,
+                resampling=None, reducer=None, use_server_resampling=False, 
+                lastonly=True, 
+            ) ]
+        else:
+            # to make use of "limit 1"
+            records = await self._gather_queries(
+                self._get_query_result(
+                    schema, [ch], length, to,
                     resampling=None, reducer=None, use_server_resampling=False, 
                     lastonly=True, 
-                ))
-            else:
-                # to make use of "limit 1"
-                for ch in channels:  
-                    result.update(await self._get_query_result(
-                        schema, [ch], length, to,
-                        resampling=None, reducer=None, use_server_resampling=False,
-                        lastonly=True, 
-                    ))
-            # retry if the value is null?
+                )
+                for ch in channels
+            )
+            
+        for record in records:
+            for ch, data in record.items():
+                if len(data.get('x', [])) == 0:
+                    continue
+                result[ch] = data
+                if self.last_value_index is not None:
+                    self.last_value_index.update_from_query(schema_key, ch, data['start'] + data['t'][-1], data['x'][-1], stop)
             
         return result
 
     
+    async def _gather_queries(self, coroutines):
+        """runs the queries concurrently, with at most max_concurrent_queries at a time
+        Returns:
+          - list of the query results, in the order of the input coroutines
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrent_queries))
+        async def run(coroutine):
+            async with semaphore:
+                return await coroutine
+            
+        return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+    
+    
     def public_config(self):
-        return {
-            'schemata': {
-                'time_series': [ str(s) for s in self.ts_schemata ],
-                'object': [ str(s) for s in self.obj_schemata ],
-                'object_time_series': [ str(s) for s in self.objts_schemata ],
-            },
+        config = super().public_config()
+        config['schemata'] = {
+            'time_series': [ str(s) for s in self.ts_schemata ],
+            'object': [ str(s) for s in self.obj_schemata ],
+            'object_time_series': [ str(s) for s in self.objts_schemata ],
         }
+        return config
         
     def _configure(self, params):
         def load_schema(params, entrytype):
@@ -315,13 +539,73 @@ class DataSource_TableStore(DataSource):
         if schema.time_type is None and not schema.is_for_obj:
             logging.error(f'Schema: time-type not specified: {schema}')
             return result
+
+        use_cache = (
+            (self.query_cache is not None) and (not lastonly) and (schema.time is not None) and
+            (stop - start <= self.query_cache.retention) and
+            not self._uses_server_resampling(schema.time_type, resampling, reducer, use_server_resampling)
+        )
+        
+        if not use_cache:
+            records = await self._query_records(
+                schema, target_channels, start, stop,
+                resampling=resampling, reducer=reducer, use_server_resampling=use_server_resampling, lastonly=lastonly
+            )
+        else:
+            # group the channels by the time range to be fetched: full range or tail
+            cache_key = lambda channel: (str(schema), channel)
+            missing_ranges = {}
+            for channel in target_channels:
+                missing = self.query_cache.get_missing_range(cache_key(channel), start, stop)
+                if missing is not None:
+                    missing_ranges[channel] = missing
+            full_channels = [ ch for ch, (begin, end) in missing_ranges.items() if begin <= start ]
+            tail_channels = [ ch for ch, (begin, end) in missing_ranges.items() if begin > start ]
+            query_ranges = []
+            if len(full_channels) > 0:
+                query_ranges.append((full_channels, start))
+            if len(tail_channels) > 0:
+                query_ranges.append((tail_channels, min(missing_ranges[ch][0] for ch in tail_channels)))
+                
+            for query_channels, begin in query_ranges:
+                query_records = await self._query_records(
+                    schema, query_channels, begin, stop,
+                    resampling=resampling, reducer=reducer, use_server_resampling=use_server_resampling, lastonly=False
+                )
+                for channel in query_channels:
+                    t, x = query_records.get(channel+schema.suffix, ([], []))
+                    self.query_cache.update(cache_key(channel), begin, stop, t, x)
+
+            records = {}
+            for channel in target_channels:
+                records[channel+schema.suffix] = self.query_cache.get(cache_key(channel), start, stop)
+
+        for channel, (timestamps, values) in records.items():
+            if len(timestamps) == 0:
+                continue
+            result[channel] = {
+                'start': start, 'length': int(length),
+                't': DataSource.time_offsets(timestamps, start),
+                'x': [ DataSource.decode_if_json(value) for value in values ],
+            }
+            
+        return result
+
+    
+    async def _query_records(self, schema, target_channels, start, stop, resampling=None, reducer=None, use_server_resampling=True, lastonly=False):
+        """makes a DB query and decodes the result
+        Returns:
+          - dict of channel: (list of UNIX timestamps, list of values)
+        """
+        records = {}
+        
         time_col, time_from, time_to = schema.get_query_times(start, stop, self.time_sep)
         if time_from is None or time_to is None:
-            return result
+            return records
 
         tag_values, fields, name_mapping = schema.get_query_tagvalues_fields(target_channels)
         if len(fields) < 1:
-            return result
+            return records
         
         query_result_columns, query_result_table = await self._execute_query(
             schema.table, 
@@ -332,13 +616,11 @@ class DataSource_TableStore(DataSource):
             use_server_resampling = use_server_resampling
         )
 
-        def add_result(channel, timestamp, value):
-            if channel not in result:
-                result[channel] = {
-                    'start': start, 'length': int(length), 't': [], 'x': []
-                }
-            result[channel]['t'].append(int(1000*(timestamp-start))/1000.0)
-            result[channel]['x'].append(DataSource.decode_if_json(value))
+        def add_record(channel, timestamp, value):
+            if channel not in records:
+                records[channel] = ([], [])
+            records[channel][0].append(timestamp)
+            records[channel][1].append(value)
             
         remaining_channels = set(target_channels)
         for row in query_result_table:
@@ -371,7 +653,7 @@ class DataSource_TableStore(DataSource):
                     if channel in remaining_channels:
                         if lastonly:
                             remaining_channels.remove(channel)
-                        add_result(channel+schema.suffix, timestamp, row[1+k])
+                        add_record(channel+schema.suffix, timestamp, row[1+k])
             else:
                 # tag and fields
                 for k in range(len(fields)):
@@ -380,6 +662,6 @@ class DataSource_TableStore(DataSource):
                     if channel in remaining_channels:
                         if lastonly:
                             remaining_channels.remove(channel)
-                        add_result(channel+schema.suffix, timestamp, row[2+k])
+                        add_record(channel+schema.suffix, timestamp, row[2+k])
                             
-        return result
+        return records
@@ -0,0 +1,212 @@
+# Created on 18 October 2026 #
+
+import time, math, json, asyncio, traceback, logging
+
+import slowlette
+from sd_component import Component
+
+
+class DataSubscription:
+    """Channel subscription of a WebSocket client
+    - The client sends a subscription request as JSON:
+      { "channels": [ CH0, CH1, ... ], "length": 3600, "interval": 1, "poll": 5 }
+      - length: time window of the initial data sent on subscription; 0 for no initial data
+      - interval: minimum time between two messages to the client; updates within this period are coalesced
+      - poll: period of the server-side query for data not published to "current_data"; 0 to disable
+    - Messages to the client have the same format as the /api/data reply, containing only the new data points
+      since the last message (the client appends them).
+    - While the client is slow, up to max_pending_points per channel are kept (the oldest ones are dropped).
+    """
+
+    max_pending_points = 10000
+
+    def __init__(self, app, websocket):
+        self.app = app
+        self.websocket = websocket
+
+        self.channels = []
+        self.interval = 1.0
+        self.poll = 5.0
+        self.length = 0
+        self.cursors = {}    # channel -> time of the last data point delivered
+        self.pending = {}    # channel -> ([t], [x]), data points to be sent
+        self.has_pending = asyncio.Event()
+        self.tasks = []
+
+
+    async def configure(self, doc):
+        await self.close()
+
+        channels = doc.get('channels', [])
+        self.channels = channels.split(',') if type(channels) is str else [ str(ch) for ch in channels ]
+        self.interval = max(0.1, float(doc.get('interval', 1.0)))
+        self.poll = max(0, float(doc.get('poll', 5.0)))
+        self.length = max(0, float(doc.get('length', 0)))
+        length = self.length
+
+        self.cursors = {}
+        self.pending = {}
+        self.has_pending.clear()
+        if len(self.channels) == 0:
+            return
+
+        if length > 0:
+            self.feed(await self.app.request_data(self.channels, length=length))
+
+        self.tasks.append(asyncio.create_task(self._send_loop()))
+        if self.poll > 0:
+            self.tasks.append(asyncio.create_task(self._poll_loop()))
+
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+
+
+    def feed(self, doc):
+        """takes new data points from a dict in the /api/data format
+        """
+        if type(doc) is not dict:
+            return
+
+        for ch in self.channels:
+            data = doc.get(ch, None)
+            if type(data) is not dict:
+                continue
+            t, x = data.get('t', None), data.get('x', None)
+            if t is None:
+                continue
+            start = data.get('start', 0)
+            if hasattr(t, 'tolist'):
+                # NumPy arrays from a data source
+                t, x = t.tolist(), (x.tolist() if hasattr(x, 'tolist') else x)
+            if type(t) is not list:
+                t, x = [ t ], [ x ]
+            cursor = self.cursors.get(ch, None)
+            pending_t, pending_x = self.pending.get(ch, ([], []))
+            for tk, xk in zip(t, x):
+                try:
+                    tk = float(tk) + float(start)
+                except:
+                    continue
+                if cursor is not None and tk <= cursor:
+                    continue
+                pending_t.append(tk)
+                pending_x.append(xk)
+                cursor = tk
+            if len(pending_t) > self.max_pending_points:
+                del pending_t[:-self.max_pending_points]
+                del pending_x[:-self.max_pending_points]
+            if len(pending_t) > 0:
+                self.pending[ch] = (pending_t, pending_x)
+                self.cursors[ch] = cursor
+                self.has_pending.set()
+
+
+    async def _send_loop(self):
+        while True:
+            await self.has_pending.wait()
+            self.has_pending.clear()
+            pending, self.pending = self.pending, {}
+
+            message = {}
+            for ch, (t, x) in pending.items():
+                start = int(t[0])
+                message[ch] = {
+                    'start': start, 'length': t[-1] - start,
+                    't': [ tk - start for tk in t ], 'x': x
+                }
+            try:
+                await self.websocket.send(slowlette.Response.json_serializer.dumps(message).decode())
+            except Exception as e:
+                logging.info(f'Data stream WebSocket error: {e}')
+                return
+
+            # rate limit: the data arriving in the meantime will be sent together in the next message
+            await asyncio.sleep(self.interval)
+
+
+    async def _poll_loop(self):
+        # a quiet channel must not widen the query of the others: the query window is taken for each channel,
+        # capped by the subscription length (or two poll periods), and channels with similar windows are queried together
+        max_window = self.length if self.length > 0 else 2 * self.poll
+        while True:
+            await asyncio.sleep(self.poll)
+            now = time.time()
+            groups = {}   # window length rounded up to poll periods -> channels
+            for ch in self.channels:
+                since = self.cursors.get(ch, now - self.poll)
+                window = min(max(1, now - since + 1), max_window)
+                groups.setdefault(self.poll * math.ceil(window / self.poll), []).append(ch)
+            for window, channels in groups.items():
+                try:
+                    self.feed(await self.app.request_data(channels, length=min(window, max_window)))
+                except Exception as e:
+                    logging.error(f'Data stream query error: {e}')
+                    logging.error(traceback.format_exc())
+
+
+
+class DataStreamComponent(Component):
+    def __init__(self, app, project):
+        super().__init__(app, project)
+
+        self.enabled = app.is_async
+        self.subscriptions = set()
+
+
+    def public_config(self):
+        return { 'data_stream': {
+            'enabled': self.enabled,
+            'clients': len(self.subscriptions),
+        }}
+
+
+    @slowlette.websocket('/ws/data')
+    async def connect(self, websocket:slowlette.WebSocket):
+        try:
+            await websocket.accept()
+        except Exception as e:
+            logging.warning(f'Unable to accept data stream websocket: {e}')
+            return None
+
+        subscription = DataSubscription(self.app, websocket)
+        self.subscriptions.add(subscription)
+
+        try:
+            while True:
+                message = await websocket.receive()
+                if message is None or len(message) == 0:
+                    continue
+                try:
+                    doc = json.loads(message)
+                    if type(doc) is not dict:
+                        raise ValueError('dict is expected')
+                    await subscription.configure(doc)
+                except Exception as e:
+                    logging.warning(f'Bad data stream subscription: {repr(message)}: {e}')
+                    continue
+        except slowlette.ConnectionClosed:
+            logging.info('Data stream WebSocket Closed')
+        except Exception as e:
+            logging.info(f'Data stream WebSocket Closed by error: {e}')
+        finally:
+            self.subscriptions.discard(subscription)
+            await subscription.close()
+
+
+    @slowlette.post('/api/consume/current_data')
+    async def consume_current_data(self, doc:slowlette.DictJSON):
+        if len(self.subscriptions) == 0:
+            return None
+
+        for subscription in self.subscriptions:
+            subscription.feed(doc.value())
+
+        return None
@@ -1,7 +1,6 @@
 # Created by Sanshiro Enomoto on 14 February 2024 #
 
-import sys, time, copy, asyncio, traceback, logging
-from urllib.parse import urlencode
+import sys, time, copy, json, asyncio, traceback, logging
 
 import slowlette
 from sd_component import Component
@@ -14,7 +13,7 @@ class MeshComponent(Component):
         super().__init__(app, project)
         
         self.enabled = app.is_async
-        self.websockets = {}
+        self.websockets = {}     # topic -> dict[websocket -> slowlette.WebSocketSender]
         self.current_data_cache = {}
         
 
@@ -22,6 +21,10 @@ class MeshComponent(Component):
         return { 'mesh': {
             'enabled': self.enabled,
             'attached': { topic:len(self.websockets.get(topic,[])) for topic in self.topics },
+            'clients': {
+                topic: [ sender.stats() for sender in self.websockets.get(topic, {}).values() ]
+                for topic in self.topics
+            },
         }}
 
     
@@ -37,9 +40,17 @@ class MeshComponent(Component):
             logging.warning(f"WebSocket Accept Failed: {topic}: {e}")
             return None
 
+        # messages to the client are sent from its own queue, so that a slow client does not block the others
+        system = self.project.config.get('system', {})
+        sender = slowlette.WebSocketSender(
+            websocket,
+            maxsize = int(system.get('websocket_queue_size', 1024)),
+            overflow = system.get('websocket_overflow', 'drop_oldest'),
+        )
+        sender.start()
         if topic not in self.websockets:
-            self.websockets[topic] = set()
-        self.websockets[topic].add(websocket)
+            self.websockets[topic] = {}
+        self.websockets[topic][websocket] = sender
             
         try:
             while True:
@@ -55,28 +66,57 @@ class MeshComponent(Component):
         except Exception as e:
             logging.info(f"WebSocket Closed by error: {e}")
         finally:
-            self.websockets.get(topic, set()).discard(websocket)
+            self.websockets.get(topic, {}).pop(websocket, None)
+            await sender.close()
 
             
     @slowlette.post('/api/emit/{topic}')
-    async def emit(self, topic:str, data:bytes, sender:str=None):
+    async def emit(self, topic:str, request:slowlette.Request, sender:str=None):
+        # internal calls (app.request_emit()) pass the message in a Python type; it is passed to
+        # the consumers as is, and JSON-encoded only if there are WebSocket clients
+        data = request.body
+        if type(data) is str:
+            data = data.encode()
+        elif data is None:
+            data = b''
+            
         try:
-            if sender is None:
-                await self.app.request(f'/consume/{topic}', data)
-            else:
-                await self.app.request(f'/consume/{topic}?' + urlencode({'sender':sender}), data)
+            await self.app.request_consume(topic, data, sender=sender)
         except Exception as e:
             logging.error(f'Error on consuming a message in topic "{topic}": {e}')
             logging.error(traceback.format_exc())
-            
-        try:
-            await asyncio.gather(*(ws.send(data.decode()) for ws in self.websockets.get(topic, [])))
-        except Exception as e:
-            logging.info(f"WebSocket Error: {e}")
+
+        senders = self.websockets.get(topic, {})
+        if len(senders) > 0:
+            if type(data) is bytes:
+                text = data.decode()
+            else:
+                text = slowlette.Response.json_serializer.dumps(data).decode()
+            key = self._conflation_key(topic, data)
+            for sender in list(senders.values()):
+                if key is not None:
+                    sender.put(text, key=key, conflate=True)
+                else:
+                    sender.put(text, key=topic)
 
         return True
 
 
+    def _conflation_key(self, topic, data):
+        """a current_data message replaces the queued one of the same channels, as only the latest values are used
+        """
+        if topic != 'current_data':
+            return None
+        if type(data) is bytes:
+            try:
+                data = json.loads(data)
+            except Exception:
+                return None
+        if not isinstance(data, dict):
+            return None
+        return topic + ':' + ','.join(sorted(data.keys()))
+
+
     @slowlette.post('/api/consume/current_data')
     async def cache_current_data(self, doc:slowlette.DictJSON):
         """caches the emitted data for future data queries
@@ -209,6 +249,10 @@ class MeshComponent(Component):
                 data = response.content[ch]
                 t0 = data.get('start', 0)
                 t = data.get('t', None)
+                if hasattr(t, 'tolist'):
+                    # NumPy arrays from a data source
+                    t = data['t'] = t.tolist()
+                    data['x'] = data['x'].tolist() if hasattr(data.get('x', None), 'tolist') else data.get('x', None)
                 if type(t) is list:
                     if len(t) == 0 or t0 + t[-1] < my_t - 0.001:
                         data['t'].append(my_t - t0)
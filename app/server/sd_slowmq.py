@@ -1,26 +1,102 @@
 # Created by Sanshiro Enomoto on 17 March 2026 #
 
-import asyncio, json, logging, traceback
+import time, asyncio, json, collections, logging, traceback
 
 import slowlette
 from sd_component import Component
 
 
+class RetainedMessages:
+    """Last message for each (literal) topic, delivered to new subscribers
+    - Like the MeshComponent current_data_cache, each entry is (time, message).
+    - The number of topics and the total size are bounded; the least recently published ones are removed first.
+    - Entries older than "ttl" seconds are not delivered (and removed).
+    """
+    
+    def __init__(self, max_topics=1024, max_bytes=16*1024*1024, ttl=3600):
+        self.max_topics = max_topics
+        self.max_bytes = max_bytes
+        self.ttl = ttl if (ttl is not None and ttl > 0) else None
+        
+        self.cache = collections.OrderedDict()    # topic -> (time, message)
+        self.total_bytes = 0
+
+        
+    def put(self, topic:str, message) -> None:
+        self.remove(topic)
+        size = len(message)
+        if size > self.max_bytes:
+            return
+        self.cache[topic] = (time.time(), message)
+        self.total_bytes += size
+        while len(self.cache) > self.max_topics or self.total_bytes > self.max_bytes:
+            oldest_topic, (t, oldest_message) = self.cache.popitem(last=False)
+            self.total_bytes -= len(oldest_message)
+
+            
+    def remove(self, topic:str) -> None:
+        entry = self.cache.pop(topic, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[1])
+
+            
+    def find(self, pattern:str) -> list:
+        """returns a list of (topic, message) of the topics matching the pattern
+        """
+        if self.ttl is not None:
+            expired = time.time() - self.ttl
+            while len(self.cache) > 0:
+                topic, (t, message) = next(iter(self.cache.items()))
+                if t >= expired:
+                    break
+                self.remove(topic)
+                
+        return [ (topic, message) for topic, (t, message) in self.cache.items() if slowlette.topic_match(pattern, topic) ]
+
+
+    def stats(self) -> dict:
+        return { 'topics': len(self.cache), 'bytes': self.total_bytes }
+
+    
+
 class SlowMQComponent(Component):
     def __init__(self, app, project):
         super().__init__(app, project)
         
         self.enabled = app.is_async
         
-        self.websockets = {}     # client_id:int -> websocket
+        self.senders = {}        # client_id:int -> slowlette.WebSocketSender
         self.clients = {}        # client_id:int -> dict[name:NAME]
-        self.subscribers = {}    # topic_pattern:str -> set[client_id:int]
+        self.next_client_id = 0
+        self.subscribers = slowlette.TopicTrie()    # topic_pattern:str -> set[client_id:int]
+
+        # retained messages: published with the "retain" header, or to the topics matching the configured patterns
+        retain = self.project.config.get('system', {}).get('slowmq_retain', {})
+        if type(retain) is not dict:
+            retain = {}
+        self.retained = RetainedMessages(
+            max_topics = int(retain.get('max_topics', 1024)),
+            max_bytes = int(retain.get('max_bytes', 16*1024*1024)),
+            ttl = retain.get('ttl', 3600),
+        )
+        self.retain_patterns = slowlette.TopicTrie()
+        patterns = retain.get('topics', [])
+        for pattern in (patterns if type(patterns) is list else [ patterns ]):
+            try:
+                self.retain_patterns.add(pattern, pattern)
+            except Exception as e:
+                logging.error(f'SlowMQ: retained topics: {e}')
         
 
     def public_config(self):
         return { 'slowmq': {
             'enabled': self.enabled,
             'attached': { topic:len(clients) for topic,clients in self.subscribers.items() },
+            'clients': {
+                client_id: { 'name': self.clients.get(client_id, {}).get('name'), **sender.stats() }
+                for client_id, sender in self.senders.items()
+            },
+            'retained': self.retained.stats(),
         }}
 
     
@@ -58,33 +134,45 @@ class SlowMQComponent(Component):
 
         
     async def add_client(self, name:str, websocket)->int:
-        client_id = len(self.clients)
+        client_id = self.next_client_id
+        self.next_client_id += 1
         if name is None:
             name = f'AnonymousClient{client_id:02d}'
         self.clients[client_id] = { 'name': name }
 
-        self.websockets[client_id] = websocket
+        # messages to the client are sent from its own queue, so that a slow client does not block the others;
+        # the overflow policy applies to the published messages, not to the replies (sent with control=True)
+        system = self.project.config.get('system', {})
+        sender = slowlette.WebSocketSender(
+            websocket,
+            maxsize = int(system.get('websocket_queue_size', 1024)),
+            overflow = system.get('websocket_overflow', 'drop_oldest'),
+        )
+        sender.start()
+        self.senders[client_id] = sender
         logging.info(f'SlowMQ WebSocket Connected: {name} (id:{client_id})')
 
         return client_id
         
         
     async def remove_client(self, client_id:int):
-        self.websockets.pop(client_id, None)
+        sender = self.senders.pop(client_id, None)
+        if sender is not None:
+            await sender.close()
         for topic in list(self.subscribers):
             await self.unsubscribe(client_id, topic)
         self.clients.pop(client_id, None)
             
         
     async def reply_error(self, client_id:int, headers, message):
-        websocket = self.websockets.get(client_id)
-        if websocket is None:
+        sender = self.senders.get(client_id)
+        if sender is None:
             return
         reply_to = headers.get('message_id', None)
         if reply_to is None:
             return
 
-        await websocket.send(json.dumps({
+        sender.put(json.dumps({
             'headers': {
                 'action': 'error',
                 'reply_to': reply_to,
@@ -92,7 +180,7 @@ class SlowMQComponent(Component):
             'data':{
                 'message': message
             }
-        }))
+        }), control=True)
             
         
     async def handle_message(self, client_id:int, headers, message):
@@ -119,23 +207,24 @@ class SlowMQComponent(Component):
             await self.reply_error(client_id, headers, str(e))
             return False
         
-        if topic not in self.subscribers:
-            self.subscribers[topic] = set()
-            
-        self.subscribers[topic].add(client_id)
+        self.subscribers.add(topic, client_id)
         logging.info(f'SlowMQ Subscription: {topic} <- {self.clients[client_id]["name"]}')
 
-        websocket = self.websockets.get(client_id)
+        sender = self.senders.get(client_id)
         reply_to = headers.get('message_id')
-        if websocket is not None and reply_to is not None:
-            await websocket.send(json.dumps({
+        if sender is not None and reply_to is not None:
+            sender.put(json.dumps({
                 'headers': {
                     'action': 'reply',
                     'reply_to': reply_to,
                 },
                 'data': None
-            }))
-                                 
+            }), control=True)
+
+        # the last messages of the matching topics are delivered right away, without waiting for the next publish
+        if sender is not None:
+            for retained_topic, message in self.retained.find(topic):
+                sender.put(self.mark_retained(message), key=retained_topic)
         
         return True
         
@@ -145,82 +234,39 @@ class SlowMQComponent(Component):
             await self.reply_error(client_id, headers or {}, f'unknown topic "{topic}"')
             return False
 
-        if client_id not in self.subscribers[topic]:
+        if not self.subscribers.remove(topic, client_id):
             await self.reply_error(client_id, headers or {}, f'not registered to the topic "{topic}"')
             return False
 
-        self.subscribers[topic].discard(client_id)
         logging.info(f'SlowMQ Cancel Subscription: {topic} <- {self.clients[client_id]["name"]}')
         
         return True
 
     
     async def publish(self, topic:str, message, headers):
-        receivers = []
-        for topic_pattern, subscribers in self.subscribers.items():
-            if self.topic_match(topic_pattern, topic):
-                for client_id in subscribers:
-                    websocket = self.websockets.get(client_id)
-                    if websocket is not None:
-                        receivers.append(websocket)
-
-        await asyncio.gather(*(ws.send(message) for ws in receivers))
+        if headers.get('retain', False) or len(self.retain_patterns.match(topic)) > 0:
+            self.retained.put(topic, message)
+            
+        for client_id in self.subscribers.match(topic):
+            sender = self.senders.get(client_id)
+            if sender is not None:
+                sender.put(message, key=topic)
                     
         
+    def mark_retained(self, message):
+        try:
+            doc = json.loads(message)
+            doc['headers']['retained'] = True
+            return json.dumps(doc)
+        except Exception:
+            return message
+
+        
     def validate_topic_pattern(self, pattern:str):
+        """NATS-like topic wildcard pattern; see slowlette.validate_topic_pattern()
         """
-        NATS-like topic wildcard pattern
-        Rules:
-          - tokens are separated by '.'
-          - '*' matches exactly one token
-          - '>' matches zero or more trailing tokens
-          - '>' must appear only as the last token
-          - no partial-token wildcard is allowed
-        Examples:
-          - topic_match("foo.*.baz", "foo.bar.baz") == True
-          - topic_match("foo.>", "foo") == True
-          - topic_match("foo.>", "foo.bar.baz") == True
-          - topic_match("foo.*", "foo") == False
-        """
-        
-        tokens = pattern.split(".") if pattern else []
-        for i, token in enumerate(tokens):
-            if token == ">":
-                if i != len(tokens) - 1:
-                    raise ValueError("Invalid topic pattern: '>' must be the last token")
-            elif ("*" in token) or (">" in token):
-                if token != "*":
-                    raise ValueError("Invalid topic  pattern: wildcards must occupy an entire token")
+        slowlette.validate_topic_pattern(pattern)
 
         
     def topic_match(self, pattern:str, topic:str)->bool:
-        pattern_tokens = pattern.split(".") if pattern else []
-        topic_tokens = topic.split(".") if topic else []
-
-        k_pattern = 0  # index for pattern
-        k_topic = 0  # index for topic
-
-        while k_pattern < len(pattern_tokens):
-            ptoken = pattern_tokens[k_pattern]
-
-            if ptoken == ">":
-                # Matches the rest, including zero tokens
-                return True
-
-            if k_topic >= len(topic_tokens):
-                # Topic ended before pattern did
-                return False
-
-            if ptoken == "*":
-                k_pattern += 1
-                k_topic += 1
-                continue
-
-            if ptoken != topic_tokens[k_topic]:
-                return False
-
-            k_pattern += 1
-            k_topic += 1
-
-        # Pattern consumed; topic must also be fully consumed
-        return k_topic == len(topic_tokens)
+        return slowlette.topic_match(pattern, topic)
@@ -4,7 +4,7 @@ import sys, os, time, glob, json, asyncio, concurrent, threading, inspect, loggi
 
 import slowlette
 from sd_usermodule import UserModule
-from sd_component import Component
+from sd_component import Component, RevisionNotifier
 
 
 class TaskFunctionThread(threading.Thread):
@@ -395,7 +395,7 @@ class TaskModuleComponent(Component):
 
         self.taskmodule_list = []
         self.known_task_list = []
-        self.status_revision = 1
+        self.status_notifier = RevisionNotifier()
         
         if not hasattr(app, 'control_system'):
             app.control_system = None
@@ -440,6 +440,7 @@ class TaskModuleComponent(Component):
                 logging.error('Unable to load slowtask module: %s' % filepath)
             else:
                 module.auto_load = params.get('auto_load', False)
+                module.status_notifier = self.status_notifier
                 self.taskmodule_list.append(module)
 
                 
@@ -500,6 +501,10 @@ class TaskModuleComponent(Component):
                 data, my_data = response.content[ch], self.record[ch]
                 t0, my_t0 = data.get('start', 0), my_data['start']
                 t, my_t = data.get('t', None), my_data['t']
+                if hasattr(t, 'tolist'):
+                    # NumPy arrays from a data source
+                    t = data['t'] = t.tolist()
+                    data['x'] = data['x'].tolist() if hasattr(data.get('x', None), 'tolist') else data.get('x', None)
                 if type(t) is list:
                     if len(t) == 0 or t0 + t[-1] < my_t0 + my_t:
                         data['t'].append(my_t + my_t0 - t0)
@@ -557,6 +562,7 @@ class TaskModuleComponent(Component):
                 logging.error('Unable to load control module: %s' % filepath)
             else:
                 module.auto_load = False
+                module.status_notifier = self.status_notifier
                 self.taskmodule_list.append(module)
 
         return {'status': 'ok'}
@@ -564,19 +570,15 @@ class TaskModuleComponent(Component):
     
     @slowlette.get('/api/control/task')
     async def task_status(self, since:int=0):
-        while self.app.is_async and self.status_revision <= since:
-            has_update = False
-            for module in self.taskmodule_list:
-                if module.was_running != module.is_running():
-                    module.touch_status()
-                if module.status_revision > self.status_revision:
-                    self.status_revision = module.status_revision
-                    has_update = True
-            if not has_update:
-                await asyncio.sleep(0.2)
+        for module in self.taskmodule_list:
+            if module.was_running != module.is_running():
+                module.touch_status()
+        if self.app.is_async:
+            # woken up by UserModule.touch_status() on a status change
+            await self.status_notifier.wait(since)
             
         result = {
-            'revision': self.status_revision,
+            'revision': self.status_notifier.revision,
             'tasks': []
         }
         for module in self.taskmodule_list:
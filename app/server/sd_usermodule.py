@@ -59,6 +59,7 @@ class UserModuleThread(threading.Thread):
         finally:
             # no "catch": propagate the error to make it visible for the user
             self.eventloop = None
+            self.usermodule.touch_status()   # the thread is ending: "is_running" changes
 
             
     def load_module(self):
@@ -186,6 +187,7 @@ class UserModule:
         self.is_waiting = False
         
         self.status_revision = int(time.time())
+        self.status_notifier = None   # RevisionNotifier to wake up the status long-polls, set by the component
         self.was_running = False
 
         
@@ -396,7 +398,10 @@ class UserModule:
 
 
     def touch_status(self):
+        # this might be called in the user thread
         self.status_revision = int(time.time())
+        if self.status_notifier is not None:
+            self.status_notifier.notify()
     
 
     def get_func(self, name):
@@ -3,7 +3,6 @@
 
 
 import sys, os, asyncio, logging
-from urllib.parse import urlencode
 
 import slowlette
 
@@ -15,6 +14,7 @@ from sd_console import ConsoleComponent
 from sd_datasource import DataSourceComponent
 from sd_export import ExportComponent
 from sd_mesh import MeshComponent
+from sd_datastream import DataStreamComponent
 from sd_slowmq import SlowMQComponent
 from sd_usermodule import UserModuleComponent
 from sd_taskmodule import TaskModuleComponent
@@ -68,6 +68,7 @@ class App(slowlette.App):
         
         self.slowlette.include(ConsoleComponent(self, self.project))     # this must be the first to capture stdout
         self.slowlette.include(MeshComponent(self, self.project))        # mesh-cache override datasoruce replies
+        self.slowlette.include(DataStreamComponent(self, self.project))  # pushes data to subscribed clients
         self.slowlette.include(UserModuleComponent(self, self.project))  # user module might want to capture API
         self.slowlette.include(TaskModuleComponent(self, self.project))
         self.slowlette.include(ConfigComponent(self, self.project))
@@ -103,7 +104,7 @@ class App(slowlette.App):
         Returns:
           - config as a dict
         """
-        return (await self.slowlette('/api/config')).content
+        return await self._request_parsed(['api', 'config'])
 
         
     async def request_channels(self):
@@ -112,7 +113,7 @@ class App(slowlette.App):
           - channels as a list of dicts, e.g., [ {"name": name, "type": type, "current": is_current}, ... ].
             - "type" and "current" are optional, with defaults "numeric" and False.
         """
-        return (await self.slowlette('/api/channels')).content
+        return await self._request_parsed(['api', 'channels'])
 
         
     async def request_data(self, channels, length:float=None, to:float=None, resample:float=None, reducer:str=None, envelope:int=None):
@@ -128,9 +129,7 @@ class App(slowlette.App):
           - data as a dict
         """
         if type(channels) is list:
-            url = f"/api/data/{','.join(channels)}"
-        else:
-            url = f"/api/data/{channels}"
+            channels = ','.join(channels)
             
         opts = {}
         if length is not None:
@@ -143,23 +142,31 @@ class App(slowlette.App):
             opts['reducer'] = reducer
         if envelope is not None:
             opts['envelope'] = envelope
-        if len(opts) > 0:
-            url += '?' + urlencode(opts)
         
-        return (await self.slowlette(url)).content
+        return await self._request_parsed(['api', 'data', channels], opts)
 
 
     async def request_emit(self, topic:str, message, sender:str=None):
         """shortcut for "/api/emit"
         Parameters:
           - topic: subscription topic
-          - message: bytes, or data to JSONize.
+          - message: bytes, or data to JSONize. Data in a Python type is passed to the consumers without JSON encoding.
         """
-        if sender is None:
-            return (await self.slowlette(f'/api/emit/{topic}', message)).content
-        else:
-            opts = {'sender': sender}
-            return (await self.slowlette(f'/api/emit/{topic}?{urlencode(opts)}', message)).content
+        opts = {} if sender is None else {'sender': sender}
+        return await self._request_parsed(['api', 'emit', topic], opts, message)
+
+    
+    async def request_consume(self, topic:str, message, sender:str=None):
+        """shortcut for "/api/consume", which is called by "/api/emit" (to deliver messages to the consumers within the App)
+        """
+        opts = {} if sender is None else {'sender': sender}
+        return await self._request_parsed(['api', 'consume', topic], opts, message)
+
+    
+    async def _request_parsed(self, path:list, query:dict={}, doc=None):
+        # same as request(), but skips composing and parsing the URL
+        request = slowlette.Request(None, method='GET' if doc is None else 'POST', path=path, query=query, body=doc)
+        return (await self.slowlette(request)).content
 
         
         
@@ -249,6 +256,9 @@ if __name__ == '__main__':
     )    
     if (args.port > 0) and (app.project.auth_list is not None):
         app.slowlette.add_middleware(slowlette.BasicAuthentication(auth_list=app.project.auth_list))
+    if args.port > 0:
+        # compression and ETag/304 for the responses of the FileServer and all the API components
+        app.slowlette.add_middleware(slowlette.ResponseEncoder())
     app.slowlette.add_middleware(slowlette.FileServer(
         filedir = os.path.join(app.project.sys_dir, 'app', 'site'),
         index_file = 'slowhome.html' if app.project.config is not None else 'welcome.html',
@@ -264,10 +274,10 @@ if __name__ == '__main__':
             if response.content_type is None:
                 pass
             elif response.content_type == 'application/json' or response.content_type.startswith('text/'):
-                sys.stdout.write(response.get_content(json_opts).decode())
+                sys.stdout.write((await response.aio_get_content(json_opts)).decode())
                 sys.stdout.write('\n')
             else:
-                sys.stdout.buffer.write(response.content)
+                sys.stdout.buffer.write(await response.aio_get_content())
             await app.slowlette.dispatch_event('shutdown')
         asyncio.run(main())
         
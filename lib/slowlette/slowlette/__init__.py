@@ -1,9 +1,10 @@
 
 from .model import JSON, DictJSON
 from .request import Request
-from .response import Response, FileResponse
+from .response import Response, FileResponse, JSONSerializer, select_json_serializer
 from .router import Router, get, post, delete, route, on_event, websocket
-from .websocket import WebSocket, ConnectionClosed
-from .middleware import BasicAuthentication, FileServer
+from .websocket import WebSocket, WebSocketSender, ConnectionClosed
+from .middleware import BasicAuthentication, FileServer, ResponseEncoder
+from .topics import TopicTrie, topic_match, validate_topic_pattern
 from .server import serve_asgi, serve_wsgi, serve_wsgi_ref, WSGI
 from .app import App, Slowlette
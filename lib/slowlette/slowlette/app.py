@@ -70,7 +70,7 @@ class Slowlette(App):
         def wrapper(func):
             adapter = self.FunctionAdapter(func)
             adapter.slowlette_path_rule = PathRule(path_rule, 'GET', func, status_code=status_code)
-            self.slowlette.handlers.append(adapter)
+            self.slowlette.add_handler(adapter)
             return func
         return wrapper
 
@@ -84,7 +84,7 @@ class Slowlette(App):
         def wrapper(func):
             adapter = self.FunctionAdapter(func)
             adapter.slowlette_path_rule = PathRule(path_rule, 'POST', func, status_code=status_code)
-            self.slowlette.handlers.append(adapter)
+            self.slowlette.add_handler(adapter)
             return func
         return wrapper
 
@@ -98,7 +98,7 @@ class Slowlette(App):
         def wrapper(func):
             adapter = self.FunctionAdapter(func)
             adapter.slowlette_path_rule = PathRule(path_rule, 'DELETE', func, status_code=status_code)
-            self.slowlette.handlers.append(adapter)
+            self.slowlette.add_handler(adapter)
             return func
         return wrapper
 
@@ -112,6 +112,6 @@ class Slowlette(App):
         def wrapper(func):
             adapter = self.FunctionAdapter(func)
             adapter.slowlette_path_rule = PathRule(path_rule, '*', func, status_code=status_code)
-            self.slowlette.handlers.append(adapter)
+            self.slowlette.add_handler(adapter)
             return func
         return wrapper
@@ -1,7 +1,7 @@
 # Created by Sanshiro Enomoto on 18 January 2025 #
 
 
-import sys, os, base64, logging
+import sys, os, time, zlib, gzip, base64, hmac, hashlib, itertools, threading, asyncio, collections, http.cookies, email.utils, logging
 
 from .request import Request
 from .response import Response, FileResponse
@@ -9,8 +9,31 @@ from .router import route
 
 
 class BasicAuthentication():
-    def __init__(self, realm='Slowlette', auth_list=[]):
+    def __init__(self, realm='Slowlette', auth_list=[], *, cache_ttl=600, cache_size=1024, session_cookie=None, session_ttl=86400):
+        """HTTP Basic Authentication (Middleware)
+        Args:
+          - realm (str): realm in the WWW-Authenticate header
+          - auth_list (list[str]): list of "USER:BCRYPT_KEY" entries; see generate_key()
+          - cache_ttl (float): seconds to keep a verified Authorization header; 0 to disable the cache
+          - cache_size (int): maximum number of verified Authorization headers cached
+          - session_cookie (str): name of a signed session cookie issued on successful authentication, or None not to use it
+          - session_ttl (float): lifetime of the session cookie in seconds
+        Note:
+          - bcrypt is slow by design (~250 ms for rounds=12); it is run in a thread, once for each new credential.
+          - The cache is keyed by an HMAC of the Authorization header with a per-process random key,
+            so the credentials are not kept in memory in plain text.
+          - Sessions are signed with the per-process key; they expire when the server is restarted.
+        """
         self.realm = realm
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.session_cookie = session_cookie
+        self.session_ttl = session_ttl
+
+        self.secret = os.urandom(32)
+        self.cache = collections.OrderedDict()   # hmac(Authorization)[:16] -> (hmac, user, expiry)
+        self.pending = {}                        # (loop, hmac(Authorization)) -> bcrypt verification in progress
+        self.lock = threading.Lock()
 
         self.auth_list = {}
         for auth in auth_list:
@@ -37,34 +60,117 @@ class BasicAuthentication():
         response.headers['WWW-Authenticate'] = f'Basic realm="{self.realm}"'
         return response
     
-        
+
+    class SessionResponse(Response):
+        def __init__(self, cookie):
+            super().__init__()
+            self.cookie = cookie
+
+            
+        def merge_response(self, response) -> None:
+            # the responses from the handlers after this are merged into one, and it comes here
+            super().merge_response(response)
+            if self.status_code < 400:
+                self.headers['Set-Cookie'] = self.cookie
+
+                
     @route('/{*}')
-    def dispatch(self, request:Request, body:bytes=None) -> Response:
+    async def dispatch(self, request:Request) -> Response:
         if len(self.auth_list) == 0:
             return Response()
 
+        if self.session_cookie is not None:
+            user = self._verify_session(request.headers.get('cookie', request.headers.get('Cookie', None)))
+            if user is not None:
+                request.user = user
+                return Response()
+            
         auth = request.headers.get('authorization', request.headers.get('Authorization', None))
         if auth == '' or auth is None:
             return self.require_auth(request)
 
         try:
-            user, word = tuple(base64.b64decode(auth.split(' ')[1]).decode().split(':'))
-            true_key = self.auth_list.get(user, None)
-            if word is None or true_key is None:
-                return self.require_auth(request)
-
-            # key is hashed and this is safe against timing attack; but this is very slow...
-            key = bcrypt.hashpw(word.encode("utf-8"), true_key.encode()).decode("utf-8")
-            if key == true_key:    
-                request.user = user
-                return Response()
-                
+            user = await self._verify(auth)
         except Exception as e:
             logging.warning(f'Slowlette_BasicAuthentication: Authentication Error: {str(e)}')
-            
-        return self.require_auth(request)
+            user = None
+        if user is None:
+            return self.require_auth(request)
+
+        request.user = user
+        if self.session_cookie is not None:
+            return self.SessionResponse(self._make_session(user))
+        return Response()
+
+    
+    async def _verify(self, auth:str):
+        """returns the user name if the Authorization header is valid, otherwise None
+        """
+        digest = hmac.new(self.secret, auth.encode(), hashlib.sha256).digest()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(digest[:16], None)
+            if entry is not None:
+                if hmac.compare_digest(entry[0], digest) and entry[2] > now:
+                    self.cache.move_to_end(digest[:16])
+                    return entry[1]
+                del self.cache[digest[:16]]
+
+        # concurrent requests with the same new credential (e.g., a dashboard loading) share one bcrypt run
+        # (keyed also by the event loop, as WSGI runs an event loop for each request)
+        key = (id(asyncio.get_running_loop()), digest)
+        future = self.pending.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self._check_password, auth))
+            self.pending[key] = future
+            future.add_done_callback(lambda f: self.pending.pop(key, None))
+        user = await asyncio.shield(future)
+        
+        if user is not None and self.cache_ttl > 0 and self.cache_size > 0:
+            with self.lock:
+                self.cache[digest[:16]] = (digest, user, now + self.cache_ttl)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return user
+
+    
+    def _check_password(self, auth:str):
+        user, word = tuple(base64.b64decode(auth.split(' ')[1]).decode().split(':'))
+        true_key = self.auth_list.get(user, None)
+        if word is None or true_key is None:
+            return None
+        
+        # key is hashed and this is safe against timing attack; but this is very slow...
+        key = bcrypt.hashpw(word.encode("utf-8"), true_key.encode()).decode("utf-8")
+        return user if hmac.compare_digest(key, true_key) else None
 
 
+    def _make_session(self, user:str) -> str:
+        value = f'{user}:{int(time.time() + self.session_ttl)}'
+        signature = hmac.new(self.secret, value.encode(), hashlib.sha256).hexdigest()
+        token = base64.urlsafe_b64encode(f'{value}:{signature}'.encode()).decode()
+        return f'{self.session_cookie}={token}; Path=/; Max-Age={int(self.session_ttl)}; HttpOnly; SameSite=Strict'
+
+    
+    def _verify_session(self, cookie_header:str):
+        if not cookie_header:
+            return None
+        try:
+            morsel = http.cookies.SimpleCookie(cookie_header).get(self.session_cookie, None)
+            if morsel is None:
+                return None
+            user, expiry, signature = base64.urlsafe_b64decode(morsel.value.encode()).decode().rsplit(':', 2)
+            expected = hmac.new(self.secret, f'{user}:{expiry}'.encode(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(signature, expected):
+                return None
+            if float(expiry) < time.time() or user not in self.auth_list:
+                return None
+        except Exception as e:
+            logging.warning(f'Slowlette_BasicAuthentication: Bad session cookie: {str(e)}')
+            return None
+        return user
+
+    
     @staticmethod
     def generate_key(username:str, password:str) -> str:
         import bcrypt
@@ -110,7 +216,7 @@ class FileServer():
 
 
     @route('/{*}')
-    async def dispatch(self, request:Request, body:bytes=None) -> Response:
+    async def dispatch(self, request:Request) -> Response:
         # sanity check
         path = []
         is_dirty = False
@@ -195,3 +301,268 @@ class FileServer():
 
         return await FileResponse().load(filepath)
 
+
+
+
+class ResponseEncoder():
+    def __init__(self, *, min_size=1024, levels=None, encodings=['br', 'gzip', 'deflate'], etag_paths=['/api/config'], cache_size=256, typed_arrays=True):
+        """Response Compression, Conditional GET and Binary Encoding of Numeric Arrays (Middleware)
+        Args:
+          - min_size (int): responses smaller than this (in bytes) are not compressed
+          - levels (dict): compression level (1-9) for each content type; a key ending with "/" matches all the subtypes.
+            Content types not listed here are not compressed (e.g., images).
+          - encodings (list[str]): encodings to use, in the order of preference; "br" requires the brotli package
+          - etag_paths (list[str]): URL paths (and the subpaths) for which a strong ETag is computed from the content.
+            File responses (FileServer) always have an ETag and Last-Modified.
+          - cache_size (int): number of compressed contents cached, keyed by ETag
+          - typed_arrays (bool): if True, JSON responses are encoded with Response.get_typed_array_content()
+            for the requests with the "Accept: application/x-slowlette-typed-arrays" header
+        Note:
+          - This must be added before the middlewares and apps producing the responses to encode (e.g., FileServer),
+            as it processes the responses merged after it.
+          - Requests without Accept-Encoding, If-None-Match, If-Modified-Since and the typed-array Accept headers
+            (e.g., internal calls) are not touched.
+        """
+        if levels is None:
+            levels = {
+                'text/html': 9, 'text/css': 9, 'text/javascript': 9, 'application/javascript': 9,  # static, cached
+                'text/': 6, 'image/svg+xml': 6, 'application/yaml': 6,
+                'application/json': 4, Response.typed_array_content_type: 4,   # dynamic and possibly large
+            }
+        self.min_size = min_size
+        self.levels = levels
+        self.etag_paths = [ [ p for p in path.split('/') if len(p) > 0 ] for path in (etag_paths or []) ]
+        self.cache_size = cache_size
+        self.typed_arrays = typed_arrays
+        self.cache = collections.OrderedDict()   # (etag, encoding) -> compressed content
+        self.lock = threading.Lock()
+
+        self.encodings = []
+        for encoding in encodings:
+            if encoding == 'br':
+                try:
+                    global brotli
+                    import brotli
+                except:
+                    logging.info('Slowlette_ResponseEncoder: brotli not available: python module "brotli" not installed')
+                    continue
+            elif encoding not in [ 'gzip', 'deflate' ]:
+                logging.error(f'Slowlette_ResponseEncoder: unknown encoding: {encoding}')
+                continue
+            self.encodings.append(encoding)
+
+            
+    class EncodingResponse(Response):
+        def __init__(self, encoder, request):
+            super().__init__()
+            self.encoder = encoder
+            self.request = request
+
+            
+        def merge_response(self, response) -> None:
+            # the responses from the handlers after this are merged into one, and it comes here
+            super().merge_response(response)
+            self.encoder.process(self.request, self)
+
+            
+    @route('/{*}')
+    def dispatch(self, request:Request) -> Response:
+        headers = request.headers
+        if not any(headers.get(key) for key in ('accept-encoding', 'if-none-match', 'if-modified-since')):
+            if not (self.typed_arrays and self._accepts_typed_arrays(headers.get('accept', None))):
+                return Response()
+        return self.EncodingResponse(self, request)
+
+    
+    def process(self, request:Request, response:Response) -> None:
+        if response.status_code != 200:
+            return
+
+        vary = []
+        content = None
+        if self.typed_arrays and response.content_type == 'application/json':
+            vary.append('Accept')
+            if self._accepts_typed_arrays(request.headers.get('accept', None)):
+                content = response.get_typed_array_content()
+                if content is not None:
+                    response.content_type = Response.typed_array_content_type
+        if content is None and response.is_streaming():
+            return self._process_stream(request, response, vary)
+        if content is None and type(response.content) is dict and 'ETag' not in response.headers:
+            if not (request.method == 'GET' and self._is_etag_path(request.path)):
+                # large JSON is compressed as it is serialized, without making the entire JSON text in memory
+                chunks = response.iter_content()
+                content, next_chunk = next(chunks), next(chunks, None)
+                if next_chunk is not None:
+                    response.content = itertools.chain([ content, next_chunk ], chunks)
+                    return self._process_stream(request, response, vary)
+        if content is None:
+            content = response.get_content()
+            
+        etag = response.headers.get('ETag', None)
+        if etag is None and request.method == 'GET' and self._is_etag_path(request.path):
+            etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            response.headers['ETag'] = etag
+
+        if request.method == 'GET' and self._is_not_modified(request.headers, etag, response.headers.get('Last-Modified', None)):
+            response.status_code = 304
+            response.content_type = None
+            response.content = None
+            return
+
+        response.content = content
+        content_type = (response.content_type or '').split(';')[0].strip()
+        level = self.levels.get(content_type, self.levels.get(content_type.split('/')[0] + '/', None))
+        compressible = (level is not None) and (len(content) >= self.min_size)
+        if compressible:
+            vary.append('Accept-Encoding')
+        if len(vary) > 0:
+            response.headers['Vary'] = ', '.join(vary)
+        if not compressible:
+            return
+        
+        encoding = self._negotiate(request.headers.get('accept-encoding', None))
+        if encoding is None:
+            return
+
+        key = (etag, encoding)
+        compressed = None
+        if etag is not None:
+            with self.lock:
+                compressed = self.cache.get(key, None)
+                if compressed is not None:
+                    self.cache.move_to_end(key)
+        if compressed is None:
+            compressed = self._compress(content, encoding, level)
+            if etag is not None and self.cache_size > 0:
+                with self.lock:
+                    self.cache[key] = compressed
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+        if len(compressed) >= len(content):
+            return
+
+        response.content = compressed
+        response.headers['Content-Encoding'] = encoding
+        if etag is not None:
+            # the encoded content is a different representation; the original ETag is also accepted by _is_not_modified()
+            response.headers['ETag'] = etag[:-1] + f'-{encoding}"'
+
+        
+    def _process_stream(self, request:Request, response:Response, vary:list) -> None:
+        # no ETag and no min_size for streams, as the content is not known until it is sent
+        content_type = (response.content_type or '').split(';')[0].strip()
+        level = self.levels.get(content_type, self.levels.get(content_type.split('/')[0] + '/', None))
+        if level is not None:
+            vary.append('Accept-Encoding')
+        if len(vary) > 0:
+            response.headers['Vary'] = ', '.join(vary)
+        if level is None:
+            return
+        
+        encoding = self._negotiate(request.headers.get('accept-encoding', None))
+        if encoding is None:
+            return
+        
+        response.content = self._compress_stream(response.aio_iter_content(), encoding, level)
+        response.headers['Content-Encoding'] = encoding
+
+        
+    async def _compress_stream(self, chunks, encoding:str, level:int):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=min(11, level))
+            compress, flush = compressor.process, compressor.finish
+        else:
+            # wbits: 31 for the gzip container, 15 for zlib (HTTP "deflate")
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+            compress, flush = compressor.compress, compressor.flush
+        try:
+            async for chunk in chunks:
+                compressed = compress(chunk)
+                if len(compressed) > 0:
+                    yield compressed
+            yield flush()
+        finally:
+            await chunks.aclose()
+
+        
+    def _is_etag_path(self, path:list) -> bool:
+        for prefix in self.etag_paths:
+            if path[:len(prefix)] == prefix:
+                return True
+        return False
+    
+
+    def _is_not_modified(self, headers:dict, etag:str, last_modified:str) -> bool:
+        if_none_match = headers.get('if-none-match', None)
+        if if_none_match:
+            if etag is None:
+                return False
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag.startswith('W/'):
+                    tag = tag[2:]
+                if tag == '*' or tag == etag:
+                    return True
+                if tag.startswith(etag[:-1] + '-') and tag[len(etag)-1:-1] in [ f'-{e}' for e in self.encodings ]:
+                    return True
+            return False
+        
+        if_modified_since = headers.get('if-modified-since', None)
+        if if_modified_since and last_modified is not None:
+            try:
+                return email.utils.parsedate_to_datetime(if_modified_since) >= email.utils.parsedate_to_datetime(last_modified)
+            except Exception:
+                return False
+            
+        return False
+
+    
+    def _accepts_typed_arrays(self, accept:str) -> bool:
+        if not accept:
+            return False
+        for item in accept.split(','):
+            name, *params = [ p.strip() for p in item.split(';') ]
+            if name.lower() != Response.typed_array_content_type:
+                continue
+            for param in params:
+                if param.startswith('q='):
+                    try:
+                        return float(param[2:]) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+    
+    def _negotiate(self, accept_encoding:str):
+        if not accept_encoding:
+            return None
+        
+        qvalues = {}
+        for item in accept_encoding.split(','):
+            name, *params = [ p.strip() for p in item.split(';') ]
+            q = 1.0
+            for param in params:
+                if param.startswith('q='):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0
+            qvalues[name.lower()] = q
+            
+        best, best_q = None, 0
+        for encoding in self.encodings:
+            q = qvalues.get(encoding, qvalues.get('*', 0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    
+    def _compress(self, content:bytes, encoding:str, level:int) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(content, quality=min(11, level))
+        elif encoding == 'gzip':
+            return gzip.compress(content, compresslevel=level, mtime=0)
+        else:
+            return zlib.compress(content, level)
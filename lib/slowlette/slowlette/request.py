@@ -1,19 +1,30 @@
 # Created by Sanshiro Enomoto on 11 January 2025 #
 
-import copy, logging
+import copy, json, logging
 from urllib.parse import urlparse, parse_qsl, unquote
 
 
 class Request:
     is_async = True  # True for ASGI; WSGI will change this directly
     
-    def __init__(self, url, method="GET", *, headers={}, body=None):
+    def __init__(self, url, method="GET", *, headers={}, body=None, path=None, query=None):
+        """
+        Args:
+          - url: URL string to be parsed into path and query, or None if path and query are given
+          - path, query: already parsed (unquoted) URL path elements and query parameters (for in-process calls)
+        """
         self.method = method.upper()
-        self.headers = copy.deepcopy(headers)
+        self.headers = copy.deepcopy(headers) if len(headers) > 0 else {}
         self.body = body
+        self._body_bytes = None   # cache of body encoded to bytes
         
         self.aborted = False
 
+        if url is None:
+            self.path = [ p for p in (path or []) if p != '' ]
+            self.query = { key: str(value) for key, value in (query or {}).items() }
+            return
+        
         u = urlparse(url)
         self.path = [ unquote(p) for p in u.path.split('/') ]
         self.query = { unquote(key): unquote(value) for key, value in parse_qsl(u.query) }
@@ -21,6 +32,19 @@ class Request:
             self.path.remove('')
 
 
+    def get_body_bytes(self) -> bytes:
+        """returns the body in bytes; direct calling of the Slowlette dispatcher might pass the body in a Python type
+        """
+        if type(self.body) is bytes:
+            return self.body
+        if self._body_bytes is None:
+            if type(self.body) is str:
+                self._body_bytes = self.body.encode()
+            else:
+                self._body_bytes = json.dumps(self.body).encode()
+        return self._body_bytes
+
+    
     def abort(self):
         self.aborted = True
 
@@ -1,7 +1,7 @@
 # Created by Sanshiro Enomoto on 10 January 2025 #
 
 
-import sys, os, copy, json, asyncio, logging
+import sys, os, copy, json, math, array, struct, hashlib, threading, asyncio, email.utils, logging
 from decimal import Decimal
 
 
@@ -17,13 +17,97 @@ def deep_update(target, update):
     return target
 
 
+def _is_number_list(values):
+    return all((type(v) is float or type(v) is int or v is None) for v in values)
+
+
+
+class JSONSerializer:
+    """Serializes the Response content into JSON, with the standard json module
+    - To use another serializer, make a subclass with dumps() overridden, and set it to Response.json_serializer.
+    """
+    name = 'json'
+    
+    def dumps(self, content) -> bytes:
+        return json.dumps(content, default=Response.json_defaults).encode()
+
+
+
+class OrjsonSerializer(JSONSerializer):
+    """JSON serializer using orjson; NumPy arrays are serialized natively, without conversion to lists
+    - NaN and Infinity become null (instead of the non-standard NaN / Infinity by the json module).
+    - Contents that orjson does not handle (e.g., integers larger than 64 bits) are passed to the json module.
+    """
+    name = 'orjson'
+    
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+        
+    def dumps(self, content) -> bytes:
+        try:
+            return self.orjson.dumps(content, default=Response.json_defaults, option=self.option)
+        except (TypeError, self.orjson.JSONEncodeError):
+            return super().dumps(content)
+
+
+        
+class UjsonSerializer(JSONSerializer):
+    """JSON serializer using ujson (5.4 or later, for the "default" function); NumPy arrays are converted to lists
+    """
+    name = 'ujson'
+    
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+        
+    def dumps(self, content) -> bytes:
+        try:
+            return self.ujson.dumps(content, default=Response.json_defaults, ensure_ascii=False).encode()
+        except (TypeError, OverflowError):
+            return super().dumps(content)
+
+
+        
+def select_json_serializer(backend='auto') -> JSONSerializer:
+    """Creates a JSON serializer for Response.json_serializer
+    Args:
+      - backend: "orjson", "ujson", "json", or "auto" for the first one available in this order
+    """
+    candidates = {
+        'orjson': OrjsonSerializer, 'ujson': UjsonSerializer, 'json': JSONSerializer
+    }
+    if backend == 'auto':
+        names = list(candidates.keys())
+    elif backend in candidates:
+        names = [ backend ]
+    else:
+        logging.error(f'Slowlette: unknown JSON backend: {backend}')
+        names = [ 'json' ]
+        
+    for name in names:
+        try:
+            return candidates[name]()
+        except ImportError:
+            if backend != 'auto':
+                logging.error(f'Slowlette: JSON backend not available: python module "{name}" not installed')
+    return JSONSerializer()
+
+
+
 class Response:
     status = {
-        200: 'OK', 201: 'Created', 202: 'Accepted', 
+        200: 'OK', 201: 'Created', 202: 'Accepted', 304: 'Not Modified',
         400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found',
         500: 'Internal Server Error', 503: 'Service Unavailable', 507: 'Insufficient Storage'
     }
 
+    # used by get_content() for JSON contents; replace it to change the backend, e.g., select_json_serializer('json')
+    json_serializer = select_json_serializer('auto')
+
     
     @staticmethod
     def json_defaults(obj):
@@ -31,6 +115,9 @@ class Response:
         """
         if isinstance(obj, Decimal):
             return int(obj) if float(obj).is_integer() else float(obj)
+        if hasattr(obj, 'tolist'):
+            # NumPy arrays and scalars, without importing NumPy here
+            return obj.tolist()
 
         
     def __init__(self, status_code=0, *, content_type=None, content=None):
@@ -143,9 +230,30 @@ class Response:
         return headers
             
         
+    def is_streaming(self) -> bool:
+        """True if the content is a generator (or an iterator / async iterator) of chunks, to be sent as they are produced
+        Note:
+          - A handler can return a streaming response by Response(content_type=CONTENT_TYPE, content=GENERATOR),
+            where the generator (either sync or async) yields chunks of bytes or str.
+          - The content is consumed on reading; after get_content() / aio_get_content(), the content becomes bytes.
+        """
+        return hasattr(self.content, '__aiter__') or hasattr(self.content, '__next__')
+
+    
     def get_content(self, json_kwargs={}) -> bytes:
         if self.content is None:
             return b''
+
+        if self.is_streaming():
+            if hasattr(self.content, '__aiter__'):
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    return asyncio.run(self.aio_get_content())
+                logging.error('Slowlette: get_content() called for an async stream in an event loop; use aio_get_content()')
+                return b''
+            self.content = b''.join(self.iter_content())
+            return self.content
         
         if type(self.content) is bytes:
             return self.content
@@ -153,7 +261,14 @@ class Response:
         elif type(self.content) is str:
             return self.content.encode()
             
+        elif len(json_kwargs) == 0:
+            try:
+                return self.json_serializer.dumps(self.content)
+            except:
+                return str(self.content).encode()
+            
         else:
+            # formatting options (e.g., indent) are for the standard json module
             kwargs = { 'default': self.json_defaults }
             kwargs.update(json_kwargs)
             try:
@@ -162,9 +277,139 @@ class Response:
                 return str(self.content).encode()
 
 
+    async def aio_get_content(self, json_kwargs={}) -> bytes:
+        """same as get_content(), but async streams can also be read (in an event loop)
+        """
+        if hasattr(self.content, '__aiter__'):
+            self.content = b''.join([ chunk async for chunk in self.aio_iter_content() ])
+        return self.get_content(json_kwargs)
+
+    
+    def iter_content(self, chunk_size=65536):
+        """generates the content in chunks, for sending without making the entire content in memory
+        Note:
+          - JSON dict contents are serialized one top-level entry at a time (e.g., one channel of a data query),
+            and the entries are combined into chunks of about chunk_size bytes.
+          - For async streams, use aio_iter_content().
+          - The content is taken when this is called; self.content can be replaced while iterating.
+        """
+        if hasattr(self.content, '__next__'):
+            return ( self._chunk_to_bytes(chunk) for chunk in self.content )
+        elif type(self.content) is dict and len(self.content) > 1:
+            return self._iter_json_dict(self.content, chunk_size)
+        else:
+            return iter([ self.get_content() ])
+
+            
+    def aio_iter_content(self, chunk_size=65536):
+        """async version of iter_content(), for both sync and async streams
+        """
+        if hasattr(self.content, '__aiter__'):
+            return self._aio_iter_chunks(self.content, convert=True)
+        else:
+            return self._aio_iter_chunks(self.iter_content(chunk_size))
+
+        
+    def _iter_json_dict(self, content:dict, chunk_size:int):
+        chunk, separator = [ b'{' ], b''
+        size = 1
+        for key, value in content.items():
+            try:
+                # "key":value, without the braces
+                item = self.json_serializer.dumps({ key: value })[1:-1]
+            except:
+                item = json.dumps({ str(key): str(value) }).encode()[1:-1]
+            chunk += [ separator, item ]
+            size += len(item) + 1
+            separator = b','
+            if size >= chunk_size:
+                yield b''.join(chunk)
+                chunk, size = [], 0
+        chunk.append(b'}')
+        yield b''.join(chunk)
+
+        
+    async def _aio_iter_chunks(self, chunks, convert=False):
+        if convert:
+            try:
+                async for chunk in chunks:
+                    yield self._chunk_to_bytes(chunk)
+            finally:
+                if hasattr(chunks, 'aclose'):
+                    await chunks.aclose()
+        else:
+            for chunk in chunks:
+                yield chunk
+
+                
+    def _chunk_to_bytes(self, chunk) -> bytes:
+        if type(chunk) is bytes:
+            return chunk
+        elif type(chunk) is str:
+            return chunk.encode()
+        elif chunk is None:
+            return b''
+        else:
+            return self.json_serializer.dumps(chunk)
+                
+        
+    typed_array_content_type = 'application/x-slowlette-typed-arrays'
+    
+    def get_typed_array_content(self, min_length=16) -> bytes:
+        """Encodes the JSON content with the numeric arrays in a binary form (typed arrays)
+        Returns:
+          - bytes in the format below, or None if the content is not a JSON object/array
+        Format:
+          - 4 bytes: length of the header (N), unsigned 32-bit little endian
+          - N bytes: header, the content in JSON, with each numeric array replaced with
+            { "$typed_array": "float64", "offset": OFFSET, "length": LENGTH }; padded with spaces so that 4+N is a multiple of 8
+          - array data, as 64-bit little-endian floats; OFFSET is the byte offset from the beginning of the array data
+            (in JavaScript, "new Float64Array(buffer, 4+N+OFFSET, LENGTH)")
+        Note:
+          - NumPy arrays of numbers (of any length), and lists of numbers of at least min_length, are encoded.
+            None in a list of numbers becomes NaN.
+        """
+        if type(self.content) not in [ dict, list ]:
+            return None
+        
+        buffers, offset = [], 0
+        def encode(obj):
+            nonlocal offset
+            data = None
+            if hasattr(obj, 'dtype') and hasattr(obj, 'tobytes'):
+                if obj.dtype.kind in 'biuf' and len(obj.shape) == 1:
+                    data = obj.astype('<f8').tobytes()
+                else:
+                    obj = obj.tolist()
+            elif type(obj) is list and len(obj) >= min_length and _is_number_list(obj):
+                values = array.array('d', [ math.nan if v is None else v for v in obj ])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                data = values.tobytes()
+            if data is not None:
+                buffers.append(data)
+                entry = { '$typed_array': 'float64', 'offset': offset, 'length': len(data) // 8 }
+                offset += len(data)
+                return entry
+                
+            if type(obj) is dict:
+                return { key: encode(value) for key, value in obj.items() }
+            elif type(obj) in [ list, tuple ]:
+                return [ encode(value) for value in obj ]
+            else:
+                return obj
+            
+        header = json.dumps(encode(self.content), default=self.json_defaults).encode()
+        header += b' ' * (-(4 + len(header)) % 8)   # to align the array data to 8 bytes
+        
+        return b''.join([ struct.pack('<I', len(header)), header ] + buffers)
+
+
     def __str__(self):
         if self.get_status_code() >= 400:
             return self.get_status()
+        elif self.is_streaming():
+            return f'[Stream ({self.get_headers()})]'
         else:
             try:
                 return self.get_content().decode()
@@ -184,24 +429,94 @@ class FileResponse(Response):
         Note: for async load, use await FileResponse().load(filepath)
         """
         if filepath is not None:
+            requested_content_type = content_type
             content_type, content = read_file(filepath, content_type)
-            if content is None:
-                super().__init__(400)
-            else:
-                super().__init__(200, content_type=content_type, content=content)
+            self._set(content_type, content, file_cache.lookup(filepath, requested_content_type))
 
 
     async def load(self, filepath:str, *, content_type=None):
-        content_type, content = await asyncio.to_thread(read_file, filepath, content_type)
-        if content is None:
-            super().__init__(400)
+        entry = file_cache.lookup(filepath, content_type)
+        if entry is not None:
+            self._set(entry.content_type, entry.content, entry)
         else:
-            super().__init__(200, content_type=content_type, content=content)
+            requested_content_type = content_type
+            content_type, content = await asyncio.to_thread(read_file, filepath, content_type)
+            self._set(content_type, content, file_cache.lookup(filepath, requested_content_type))
 
         return self
 
+    
+    def _set(self, content_type, content, cache_entry):
+        if content is None:
+            super().__init__(400)
+            return
+        
+        super().__init__(200, content_type=content_type, content=content)
+        if cache_entry is not None and cache_entry.content is content:
+            self.headers['ETag'] = cache_entry.etag
+            self.headers['Last-Modified'] = cache_entry.last_modified
+
+            
+
+class FileCache:
+    """In-memory cache of small files, validated by the modification time and size on every lookup
+    - An entry also holds a strong ETag (content hash) and the Last-Modified time, for conditional GET.
+    """
+    
+    class Entry:
+        def __init__(self, stat, content_type, content):
+            self.mtime_ns = stat.st_mtime_ns
+            self.size = stat.st_size
+            self.content_type = content_type
+            self.content = content
+            self.etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+            
+    def __init__(self, max_file_size=4*1024*1024, max_total_size=64*1024*1024):
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.entries = {}   # (filepath, requested content_type) -> Entry, in the order of insertion
+        self.total_size = 0
+        self.lock = threading.Lock()
+
+        
+    def lookup(self, filepath, content_type):
+        try:
+            stat = os.stat(filepath)
+        except Exception:
+            return None
+        with self.lock:
+            entry = self.entries.get((filepath, content_type), None)
+        if entry is None or entry.mtime_ns != stat.st_mtime_ns or entry.size != stat.st_size:
+            return None
+        return entry
+
+    
+    def store(self, filepath, requested_content_type, content_type, content, stat):
+        if len(content) > self.max_file_size or stat.st_size != len(content):
+            return
+        entry = FileCache.Entry(stat, content_type, content)
+        with self.lock:
+            old = self.entries.pop((filepath, requested_content_type), None)
+            if old is not None:
+                self.total_size -= len(old.content)
+            while len(self.entries) > 0 and self.total_size + len(content) > self.max_total_size:
+                key = next(iter(self.entries))
+                self.total_size -= len(self.entries.pop(key).content)
+            self.entries[(filepath, requested_content_type)] = entry
+            self.total_size += len(content)
+
+
+file_cache = FileCache()
+
 
 def read_file(filepath, content_type):
+    entry = file_cache.lookup(filepath, content_type)
+    if entry is not None:
+        return (entry.content_type, entry.content)
+    
+    requested_content_type = content_type
     if not os.path.exists(filepath):
         logging.warning(f'Slowlette_FileResponse: file not found: {filepath}')
         return None, None
@@ -215,6 +530,7 @@ def read_file(filepath, content_type):
     content = None
     try:
         with open(filepath, 'rb') as f:
+            stat = os.fstat(f.fileno())
             content = f.read()
     except Exception as e:
         logging.warning(f'Slowlette_FileResponse: system error: {filepath}: {e}')
@@ -245,5 +561,7 @@ def read_file(filepath, content_type):
         else:
             content_type = 'application/octet-stream'
 
+    file_cache.store(filepath, requested_content_type, content_type, content, stat)
+            
     return (content_type, content)
 
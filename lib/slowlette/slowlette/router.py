@@ -130,13 +130,7 @@ class PathRule:
         if self.request_param is not None:
             kwargs[self.request_param] = request
         if self.bytes_body_param is not None:
-            # direct calling of the Slowlette dispatcher might pass the body in a Python type
-            if type(request.body) is bytes:
-                kwargs[self.bytes_body_param] = request.body
-            elif type(request.body) is str:
-                kwargs[self.bytes_body_param] = request.body.encode()
-            else:
-                kwargs[self.bytes_body_param] = json.dumps(request.body).encode()
+            kwargs[self.bytes_body_param] = request.get_body_bytes()
         if self.json_body_param is not None:
             doc = JSON(request.body)
             if doc.value() is None:
@@ -162,6 +156,75 @@ class PathRule:
 
     
 
+class RouteIndex:
+    """Candidate lookup of handlers by method and literal path segments
+    - A trie per method; path parameters ({name}) go to a wildcard child, and "{*}" rules match any deeper path.
+    - This only narrows down the handlers: PathRule.match() still decides the match (parameter types, defaults, etc.).
+    - The handlers found are in the original order, so that the responses are merged in the same order.
+    """
+    
+    class Node:
+        __slots__ = ('literals', 'param', 'terminal', 'extra')
+        def __init__(self):
+            self.literals = {}     # path element -> Node
+            self.param = None      # Node for a path parameter
+            self.terminal = []     # [ (order, handler) ] for requests ending here
+            self.extra = []        # [ (order, handler) ] for requests longer than here ({*})
+
+            
+    def __init__(self, handlers):
+        self.size = len(handlers)
+        self.roots = {}  # method -> Node
+        
+        for order, handler in enumerate(handlers):
+            rule = handler.slowlette_path_rule
+            entry = (order, handler)
+            node = self.roots.setdefault(rule.method, RouteIndex.Node())
+            
+            # a shorter path can match if the rest are all parameters (default values)
+            optional_from = len(rule.path)
+            while optional_from > 0 and rule.path[optional_from-1] is None:
+                optional_from -= 1
+                
+            for depth, elem in enumerate(rule.path):
+                if depth >= optional_from:
+                    node.terminal.append(entry)
+                if elem is None:
+                    if node.param is None:
+                        node.param = RouteIndex.Node()
+                    node = node.param
+                else:
+                    node = node.literals.setdefault(elem, RouteIndex.Node())
+            node.terminal.append(entry)
+            if rule.take_extra_path:
+                node.extra.append(entry)
+
+                
+    def find(self, method:str, path:list) -> list:
+        entries = []
+        for m in ((method,) if method in ('WEBSOCKET', '*') else (method, '*')):
+            root = self.roots.get(m, None)
+            if root is not None:
+                self._collect(root, path, 0, entries)
+                
+        if len(entries) > 1:
+            entries.sort(key=lambda entry: entry[0])
+        return [ handler for order, handler in entries ]
+
+    
+    def _collect(self, node, path, depth, entries):
+        while depth < len(path):
+            entries.extend(node.extra)
+            if node.param is not None:
+                self._collect(node.param, path, depth+1, entries)
+            node = node.literals.get(path[depth], None)
+            if node is None:
+                return
+            depth += 1
+        entries.extend(node.terminal)
+        
+
+        
 def get(path_rule:str, status_code:int=200):
     """decorator to make a GET-request handler (method of a subclass of App)
     Args:
@@ -246,19 +309,26 @@ class Router:
         self.subapps = []
         self.middlewares = []
 
+        # If True, the sub-apps are dispatched concurrently (the handlers of each sub-app are still sequential).
+        # The order of the responses is preserved, but a sub-app aborting a request does not stop the others.
+        self.concurrent_subapps = False
+
+        # handler lookup table, (re)built on the next lookup after the handler list is changed
+        self.route_index = None
+
         # Binding URL handlers to the PathRule attached by decorators (@get(PATH) etc).
         # Note that __init__() is called after all the decorators.
         for name, method in inspect.getmembers(type(self.app), predicate=inspect.isfunction):
             if hasattr(method, 'slowlette_path_rule'):
                 logging.debug(f'Slowlette Binding: {method.slowlette_path_rule.method} {method.slowlette_path_rule.rule_str} -> {self.app.__class__.__name__}.{name}{inspect.signature(method)}')
-                self.handlers.append(method)
+                self.add_handler(method)
 
         
     async def dispatch_event(self, name:str):
         for subapp in self.middlewares:
             await subapp.slowlette.dispatch_event(name)
             
-        for handler in self.handlers:
+        for handler in self.find_handlers(Request(url=name, method="on_event")):
             request = Request(url=name, method="on_event")
             args = handler.slowlette_path_rule.match(request)
             if args is not None:
@@ -293,7 +363,7 @@ class Router:
         for subapp in self.middlewares:
             await subapp.slowlette._dispatch_branch(request, response_list)
             
-        for handler in self.handlers:
+        for handler in self.find_handlers(request):
             args = handler.slowlette_path_rule.match(request)
             if args is None:
                 continue
@@ -306,17 +376,27 @@ class Router:
             if not isinstance(response, Response):
                 status_code = handler.slowlette_path_rule.status_code
                 response = Response(status_code, content=response)
-            if response.status_code > 0:
+            if response.status_code > 0 and logging.getLogger().isEnabledFor(logging.DEBUG):
+                # formatting the content (JSON encoding) is costly; do it only if it is displayed
                 orig = self.app.__class__.__name__
                 req = str(request)[:48] + (' ...' if len(str(request)) > 48 else '')
                 stat = response.get_status_code()
-                cont = str(response.get_content())
+                cont = str(response) if response.is_streaming() else str(response.get_content())
                 resp = cont[:48] + (' ...' if len(str(cont)) > 48 else '')
                 logging.debug(f'{orig}: {req} -> Status {stat}: {resp}')
             response_list.append(response)
-            
-        for subapp in self.subapps:
-            await subapp.slowlette._dispatch_branch(request, response_list)
+
+        if self.concurrent_subapps and len(self.subapps) > 1:
+            branch_response_lists = [ [] for subapp in self.subapps ]
+            await asyncio.gather(*(
+                subapp.slowlette._dispatch_branch(request, branch_response_list)
+                for subapp, branch_response_list in zip(self.subapps, branch_response_lists)
+            ))
+            for branch_response_list in branch_response_lists:
+                response_list.extend(branch_response_list)
+        else:
+            for subapp in self.subapps:
+                await subapp.slowlette._dispatch_branch(request, response_list)
             
             
     def merge_responses(self, response_list):
@@ -333,6 +413,28 @@ class Router:
         return response_list[0]
 
 
+    def find_handlers(self, request:Request) -> list:
+        """returns the handlers that might match the request, in the registration order
+        """
+        # the length check is for handlers appended to the list directly (not by add_handler())
+        if self.route_index is None or self.route_index.size != len(self.handlers):
+            self.route_index = RouteIndex(self.handlers)
+        return self.route_index.find(request.method, request.path)
+
+    
+    def add_handler(self, handler):
+        """adds a handler function, which must have the slowlette_path_rule attribute
+        """
+        self.handlers.append(handler)
+        self.route_index = None
+
+        
+    def invalidate_index(self):
+        """to be called after the handler list is modified directly (i.e., not by add_handler())
+        """
+        self.route_index = None
+
+        
     def include(self, app):
         if not hasattr(app, 'slowlette'):
             # in case the __init__() method is not called by user subclass
@@ -363,7 +465,7 @@ class Router:
                 return inspect.iscoroutinefunction(obj.__call__)
             return False
 
-        for handler in self.handlers:
+        for handler in self.find_handlers(request):
             args = handler.slowlette_path_rule.match(request)
             if args is None:
                 continue
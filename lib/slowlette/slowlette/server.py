@@ -79,7 +79,7 @@ async def dispatch_asgi(app, scope, receive, send):
                     break
                 
     response = await app.slowlette(Request(url, method=method, headers=headers, body=body))
-    if response.status_code < 300:
+    if response.status_code < 300 or response.status_code == 304:   # 304: cache validation (Not Modified), not an error
         logging.debug(f'{method}: {url} -> {response.status_code}')
     else:
         logging.warning(f'{method}: {url} -> {response.status_code}')
@@ -89,10 +89,21 @@ async def dispatch_asgi(app, scope, receive, send):
         'status': response.get_status_code(),
         'headers': [ (k.encode(),v.encode()) for k,v in response.get_headers() ]
     })
-    await send({
-        'type': 'http.response.body',
-        'body': response.get_content()
-    })
+
+    # streams and large JSON are sent in chunks ("more_body"); one chunk is held to mark the last one
+    chunks = response.aio_iter_content()
+    try:
+        last_chunk = None
+        async for chunk in chunks:
+            if last_chunk is not None:
+                await send({'type': 'http.response.body', 'body': last_chunk, 'more_body': True})
+            last_chunk = chunk
+        await send({
+            'type': 'http.response.body',
+            'body': last_chunk or b''
+        })
+    finally:
+        await chunks.aclose()
 
     
 
@@ -122,6 +133,8 @@ def dispatch_wsgi(app, environ, start_response):
         'cookie': environ.get('HTTP_COOKIE', None),
         'cache-control': environ.get('HTTP_CACHE_CONTROL', None),
         'if-modified-since': environ.get('HTTP_IF_MODIFIED_SINCE', None),
+        'if-none-match': environ.get('HTTP_IF_NONE_MATCH', None),
+        'accept-encoding': environ.get('HTTP_ACCEPT_ENCODING', None),
     }
         
     body = None
@@ -143,11 +156,46 @@ def dispatch_wsgi(app, environ, start_response):
         else:
             body = b''
 
-    response = asyncio.run(app.slowlette(Request(url, method=method, headers=headers, body=body)))
+    # the event loop is kept until the response content is sent, for async streams
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(app.slowlette(Request(url, method=method, headers=headers, body=body)))
+    except:
+        close_event_loop(loop)
+        raise
     logging.debug(f'{method}: {url} -> {response.status_code}')
     
     start_response(response.get_status(), response.get_headers())
-    return [ response.get_content() ]
+    return iterate_content_wsgi(loop, response)
+
+
+
+def iterate_content_wsgi(loop, response):
+    chunks = response.aio_iter_content()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(chunks.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(chunks.aclose())
+        close_event_loop(loop)
+
+
+        
+def close_event_loop(loop):
+    # same clean-up as asyncio.run()
+    try:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if len(tasks) > 0:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(loop.shutdown_default_executor())
+    finally:
+        loop.close()
 
 
 
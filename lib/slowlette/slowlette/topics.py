@@ -0,0 +1,210 @@
+# Created on 18 October 2026 #
+
+# lib/slowpy/slowpy/control/control_AsyncLocalPubsub.py has a twin of this (split_topic, TopicPattern and TopicTrie),
+# as slowpy does not depend on slowlette; keep the two in sync.
+
+import functools
+
+
+
+@functools.lru_cache(maxsize=4096)
+def split_topic(topic:str) -> tuple:
+    """tokenizes a topic or pattern; the results are cached as the same topics are published repeatedly
+    """
+    return tuple(topic.split(".")) if topic else ()
+
+
+
+def validate_topic_pattern(pattern:str) -> None:
+    """
+    NATS-like topic wildcard pattern; raises ValueError if the pattern is not valid
+    Rules:
+      - tokens are separated by '.'
+      - '*' matches exactly one token
+      - '>' matches zero or more trailing tokens
+      - '>' must appear only as the last token
+      - no partial-token wildcard is allowed
+    Examples:
+      - topic_match("foo.*.baz", "foo.bar.baz") == True
+      - topic_match("foo.>", "foo") == True
+      - topic_match("foo.>", "foo.bar.baz") == True
+      - topic_match("foo.*", "foo") == False
+    """
+    tokens = split_topic(pattern)
+    for i, token in enumerate(tokens):
+        if token == ">":
+            if i != len(tokens) - 1:
+                raise ValueError("Invalid topic pattern: '>' must be the last token")
+        elif ("*" in token) or (">" in token):
+            if token != "*":
+                raise ValueError("Invalid topic  pattern: wildcards must occupy an entire token")
+
+
+
+def topic_match(pattern:str, topic:str) -> bool:
+    """matches one pattern to a topic; use TopicTrie to match many patterns
+    """
+    pattern_tokens = split_topic(pattern)
+    topic_tokens = split_topic(topic)
+
+    k_pattern = 0  # index for pattern
+    k_topic = 0  # index for topic
+
+    while k_pattern < len(pattern_tokens):
+        ptoken = pattern_tokens[k_pattern]
+
+        if ptoken == ">":
+            # Matches the rest, including zero tokens
+            return True
+
+        if k_topic >= len(topic_tokens):
+            # Topic ended before pattern did
+            return False
+
+        if ptoken == "*":
+            k_pattern += 1
+            k_topic += 1
+            continue
+
+        if ptoken != topic_tokens[k_topic]:
+            return False
+
+        k_pattern += 1
+        k_topic += 1
+
+    # Pattern consumed; topic must also be fully consumed
+    return k_topic == len(topic_tokens)
+
+
+
+class TopicTrie:
+    """Subscription index for topic patterns, matching a topic in O(topic depth) instead of O(number of patterns)
+    Usage:
+      - trie.add(pattern, subscriber): subscriber can be any hashable object (client ID, queue, etc.)
+      - trie.remove(pattern, subscriber)
+      - trie.match(topic): returns a set of the subscribers of all the patterns matching the topic
+    """
+
+    class Node:
+        __slots__ = ('children', 'star', 'subscribers', 'trailing')
+
+        def __init__(self):
+            self.children = {}        # token -> Node
+            self.star = None          # Node for '*'
+            self.subscribers = set()  # subscribers of the pattern ending here
+            self.trailing = set()     # subscribers of the pattern ending here with '>'
+
+
+        def is_empty(self):
+            return not (self.children or self.star or self.subscribers or self.trailing)
+
+
+    def __init__(self):
+        self.root = self.Node()
+        self.patterns = {}   # pattern -> set of subscribers
+
+
+    def add(self, pattern:str, subscriber) -> None:
+        """raises ValueError if the pattern is not valid
+        """
+        validate_topic_pattern(pattern)
+
+        node = self.root
+        tokens = split_topic(pattern)
+        for token in tokens:
+            if token == '>':
+                node.trailing.add(subscriber)
+                break
+            if token == '*':
+                if node.star is None:
+                    node.star = self.Node()
+                node = node.star
+            else:
+                child = node.children.get(token)
+                if child is None:
+                    child = node.children[token] = self.Node()
+                node = child
+        else:
+            node.subscribers.add(subscriber)
+
+        self.patterns.setdefault(pattern, set()).add(subscriber)
+
+
+    def remove(self, pattern:str, subscriber) -> bool:
+        """returns False if the subscriber is not registered to the pattern
+        """
+        if subscriber not in self.patterns.get(pattern, set()):
+            return False
+
+        self.patterns[pattern].discard(subscriber)
+        if len(self.patterns[pattern]) == 0:
+            del self.patterns[pattern]
+
+        self._remove(self.root, split_topic(pattern), subscriber)
+        return True
+
+
+    def _remove(self, node, tokens, subscriber) -> None:
+        # removes the subscriber along the path, and prunes the nodes becoming empty
+        if len(tokens) == 0:
+            node.subscribers.discard(subscriber)
+            return
+        token = tokens[0]
+        if token == '>':
+            node.trailing.discard(subscriber)
+            return
+
+        child = node.star if token == '*' else node.children.get(token)
+        if child is None:
+            return
+        self._remove(child, tokens[1:], subscriber)
+        if child.is_empty():
+            if token == '*':
+                node.star = None
+            else:
+                del node.children[token]
+
+
+    def match(self, topic:str) -> set:
+        result = set()
+        nodes = [ self.root ]
+        for token in split_topic(topic):
+            next_nodes = []
+            for node in nodes:
+                result.update(node.trailing)
+                child = node.children.get(token)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.star is not None:
+                    next_nodes.append(node.star)
+            nodes = next_nodes
+            if len(nodes) == 0:
+                return result
+
+        for node in nodes:
+            result.update(node.subscribers)
+            result.update(node.trailing)   # '>' also matches zero tokens
+
+        return result
+
+
+    def get(self, pattern:str, default=None):
+        """returns the set of subscribers of the pattern
+        """
+        return self.patterns.get(pattern, default)
+
+
+    def items(self):
+        return self.patterns.items()
+
+
+    def __contains__(self, pattern:str):
+        return pattern in self.patterns
+
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+
+    def __len__(self):
+        return len(self.patterns)
@@ -1,5 +1,7 @@
 # Created by Sanshiro Enomoto on 27 January 2025 #
 
+import time, asyncio, collections, logging
+
 
 class WebSocket:
     def __init__(self, receive_func, send_func):
@@ -39,3 +41,151 @@ class WebSocket:
 class ConnectionClosed(Exception):
     pass
 
+
+
+
+class WebSocketSender:
+    overflow_policies = [ 'drop_oldest', 'drop_newest', 'disconnect', 'conflate' ]
+    
+    def __init__(self, websocket, *, maxsize=1024, overflow='drop_oldest'):
+        """Bounded outbound queue with a dedicated sender task for a WebSocket
+        Args:
+          - websocket: WebSocket to send the messages to
+          - maxsize (int): maximum number of messages queued
+          - overflow (str): what to do when a message comes to a full queue:
+            - "drop_oldest": the oldest queued message is dropped
+            - "drop_newest": the new message is dropped
+            - "disconnect": the queue is discarded and the WebSocket is closed
+            - "conflate": the new message replaces the queued one with the same key (e.g., topic),
+              or the oldest one if there is none
+        Note:
+          - put() does not block; a slow client does not stall the publisher or the other clients.
+          - the overflow policy applies only to data messages; control messages (put(..., control=True),
+            such as replies and acknowledgements) are never dropped, even if the queue is full, and neither are
+            the messages put with conflate=True (at most one per key is queued).
+          - start() must be called in an event loop.
+        """
+        if overflow not in self.overflow_policies:
+            raise ValueError(f'unknown overflow policy: {overflow}')
+        self.websocket = websocket
+        self.maxsize = max(1, maxsize)
+        self.overflow = overflow
+
+        self.queue = collections.deque()   # entries of [key, message, time_queued, exempt from overflow policy]
+        self.keys = {}                     # key -> entry, for conflation
+        self.has_message = asyncio.Event()
+        self.task = None
+        self.closed = False
+
+        self.sent, self.dropped, self.max_queued, self.lag = 0, 0, 0, 0
+
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._send_loop())
+
+            
+    async def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.keys.clear()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+            
+    def put(self, message, key=None, *, conflate=False, control=False) -> bool:
+        """queues a message; returns False if the message is dropped
+        Args:
+          - key: key for conflation (e.g., topic)
+          - conflate: if True, the message replaces the queued one with the same key, regardless of the overflow policy
+          - control: if True, the message is not subject to the overflow policy (never dropped)
+        """
+        exempt = control or (conflate and key is not None)
+        if self.closed:
+            return False
+
+        if conflate and key is not None and key in self.keys:
+            self.keys[key][1] = message
+            self.dropped += 1
+            return True
+        
+        if not exempt and len(self.queue) >= self.maxsize:
+            if self.overflow == 'drop_newest':
+                self.dropped += 1
+                return False
+            elif self.overflow == 'disconnect':
+                logging.warning('WebSocket send queue overflow: disconnecting the client')
+                self.dropped += len(self.queue) + 1
+                self.closed = True
+                self.queue.clear()
+                self.keys.clear()
+                asyncio.ensure_future(self._disconnect())
+                return False
+            elif self.overflow == 'conflate' and key is not None and key in self.keys:
+                self.keys[key][1] = message
+                self.dropped += 1
+                return True
+            else:
+                self._drop_oldest()
+
+        entry = [ key, message, time.monotonic(), exempt ]
+        self.queue.append(entry)
+        if key is not None:
+            self.keys[key] = entry
+        self.max_queued = max(self.max_queued, len(self.queue))
+        self.has_message.set()
+        
+        return True
+
+
+    def _drop_oldest(self):
+        # the oldest message subject to the overflow policy is dropped
+        for k, dropped_entry in enumerate(self.queue):
+            if not dropped_entry[3]:
+                break
+        else:
+            return
+        del self.queue[k]
+        if self.keys.get(dropped_entry[0]) is dropped_entry:
+            del self.keys[dropped_entry[0]]
+        self.dropped += 1
+
+        
+    def stats(self) -> dict:
+        return {
+            'queued': len(self.queue), 'max_queued': self.max_queued,
+            'sent': self.sent, 'dropped': self.dropped,
+            'lag': round(self.lag, 3),   # queueing time of the last message sent, in sec
+        }
+
+    
+    async def _send_loop(self):
+        while not self.closed:
+            await self.has_message.wait()
+            while len(self.queue) > 0:
+                key, message, time_queued, exempt = entry = self.queue.popleft()
+                if self.keys.get(key) is entry:
+                    del self.keys[key]
+                try:
+                    await self.websocket.send(message)
+                except Exception as e:
+                    logging.info(f'WebSocket send error: {e}')
+                    self.closed = True
+                    self.queue.clear()
+                    self.keys.clear()
+                    return
+                self.sent += 1
+                self.lag = time.monotonic() - time_queued
+            self.has_message.clear()
+
+            
+    async def _disconnect(self):
+        try:
+            await self.websocket.close(code=1008)
+        except Exception as e:
+            logging.info(f'WebSocket close error: {e}')
@@ -0,0 +1,61 @@
+# benchmark_topics.py
+# compares TopicTrie to the linear matching (topic_match() for every pattern)
+
+import time, random
+from slowlette import TopicTrie, topic_match
+
+
+def make_patterns(n_rpc=500, n_devices=100):
+    patterns = [ f'rpc_reply.mesh{k:04d}' for k in range(n_rpc) ]
+    for k in range(n_devices):
+        patterns += [ f'device{k:03d}.status', f'device{k:03d}.*.value', f'device{k:03d}.>' ]
+    patterns += [ 'rpc_request.*', 'current_data', '>' ]
+    return patterns
+
+
+def make_topics(n=10000):
+    topics = []
+    for k in range(n):
+        r = random.random()
+        if r < 0.5:
+            topics.append(f'rpc_reply.mesh{random.randrange(600):04d}')
+        elif r < 0.9:
+            topics.append(f'device{random.randrange(120):03d}.ch{random.randrange(8)}.value')
+        else:
+            topics.append('current_data')
+    return topics
+
+
+def linear_match(patterns, topic):
+    return { p for p in patterns if topic_match(p, topic) }
+
+
+def trie_match(trie, topic):
+    return trie.match(topic)
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    patterns = make_patterns()
+    topics = make_topics()
+
+    trie = TopicTrie()
+    for pattern in patterns:
+        trie.add(pattern, pattern)   # the pattern itself as the subscriber, to compare the results
+
+    for topic in topics[:1000]:
+        assert trie_match(trie, topic) == linear_match(patterns, topic), topic
+    print(f'{len(patterns)} patterns, {len(topics)} topics: results identical')
+
+    start = time.perf_counter()
+    for topic in topics:
+        linear_match(patterns, topic)
+    t_linear = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for topic in topics:
+        trie_match(trie, topic)
+    t_trie = time.perf_counter() - start
+
+    print(f'linear: {1e6*t_linear/len(topics):8.2f} us/message')
+    print(f'trie:   {1e6*t_trie/len(topics):8.2f} us/message  (x{t_linear/t_trie:.0f})')
@@ -0,0 +1,64 @@
+# test_websocket_sender.py
+# WebSocketSender with a slow client: overflow policies, control messages and conflation
+
+import asyncio
+import slowlette
+
+
+class SlowWebSocket:
+    """stands for a WebSocket of a client that receives slower than the messages are put
+    """
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.received = []
+        self.closed = False
+
+    async def send(self, message):
+        await asyncio.sleep(self.delay)
+        self.received.append(message)
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+
+async def run(overflow):
+    websocket = SlowWebSocket()
+    sender = slowlette.WebSocketSender(websocket, maxsize=10, overflow=overflow)
+    sender.start()
+
+    for i in range(100):
+        sender.put(f'data{i}', key=f'topic{i%5}')
+        if i % 20 == 0:
+            sender.put(f'reply{i}', control=True)
+        sender.put(f'current_data{i}', key='current_data:ch0,ch1', conflate=True)
+        await asyncio.sleep(0.001)
+
+    while len(sender.queue) > 0 and not sender.closed:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(2 * websocket.delay)   # for the last message being sent
+    await sender.close()
+
+    return websocket, sender.stats()
+
+
+
+async def main():
+    for overflow in slowlette.WebSocketSender.overflow_policies:
+        websocket, stats = await run(overflow)
+        received = websocket.received
+        replies = [ message for message in received if message.startswith('reply') ]
+        current_data = [ message for message in received if message.startswith('current_data') ]
+        print(f'{overflow}: {stats}')
+        print(f'  replies: {replies}')
+        print(f'  current_data: {len(current_data)} received, last: {current_data[-1] if current_data else None}')
+        print(f'  disconnected: {websocket.closed}')
+
+        if overflow != 'disconnect':
+            assert replies == [ f'reply{i}' for i in range(0, 100, 20) ], 'a control message is dropped'
+            assert current_data[-1] == 'current_data99', 'the last current_data is not delivered'
+        else:
+            assert websocket.closed
+
+
+asyncio.run(main())
@@ -2,6 +2,7 @@
 
 
 import time, json
+import numpy as np
 
 
 class DataElement:
@@ -62,14 +63,51 @@ class DataElement:
 
 
 class TimeSeries:
-    def __init__(self, *, fields:list[str]|None=None, start:float=0, length:float|None=None):
+    '''
+    Columnar time-series: time-stamps and the values of each field are stored in NumPy arrays, grown on demand.
+    A field column is int64 or float64 while all the values are numbers, otherwise a Python object array
+    (for strings, data-elements and None for missing values).
+    The t and values properties are read-only views: to replace the data, assign new arrays to them (with fields
+    for values) instead of modifying them in place; e.g., ts.values.append(column) has no effect.
+    '''
+    def __init__(self, *, fields:list[str]|None=None, start:float=0, length:float|None=None, capacity:int=64):
         self.start = start
         self.length = length
         self.fields = fields if fields is not None and len(fields) > 0 else ['x']
-        self.t = []
-        self.values = [ [] for _ in self.fields ]   # self.values[field] is a time-series (array) for the field
+        self.size = 0
+        self._t = np.empty(max(capacity, 1), dtype=np.float64)
+        self._columns = [ np.empty(len(self._t), dtype=np.int64) for _ in self.fields ]
 
 
+    @property
+    def t(self):
+        '''time-stamps relative to start (a view of the buffer)'''
+        return self._t[:self.size]
+
+    @t.setter
+    def t(self, t):
+        self._t = np.array(t, dtype=np.float64)
+        self.size = len(self._t)
+        for k in range(len(self._columns)):
+            self._reserve_column(k, self.size)
+
+
+    @property
+    def values(self):
+        '''list of the field columns (views of the buffers); self.values[field_index] is an array for the field'''
+        return [ column[:self.size] for column in self._columns ]
+
+    @values.setter
+    def values(self, values):
+        self._columns = [ self._to_column(v) for v in values ]
+        for k in range(len(self._columns)):
+            self._reserve_column(k, self.size)
+
+
+    def __len__(self):
+        return self.size
+
+        
     def write(self, values, t=None):
         '''
         # add one point to the time-series #
@@ -79,6 +117,7 @@ class TimeSeries:
         '''
         if t is None:
             t = time.time()
+        self._check_columns()
         
         record = [None] * len(self.fields)
         if isinstance(values, dict):
@@ -90,29 +129,151 @@ class TimeSeries:
         else:
             record[0] = values
 
-        self.t.append(t - self.start)
+        self._reserve(1)
+        self._t[self.size] = t - self.start
         for k in range(len(self.fields)):
-            self.values[k].append(record[k])
+            self._put_value(k, self.size, record[k])
+        self.size += 1
 
 
-    def to_json(self):
+    def extend(self, t, values):
+        '''
+        # add points from arrays #
+        - t: array of UNIX time-stamps
+        - values: dict of field name and array, or list of arrays for the fields, or an array for the first field
+        '''
+        self._check_columns()
+        t = np.asarray(t, dtype=np.float64).ravel()
+        n = len(t)
+        if isinstance(values, dict):
+            columns = [ values.get(field, None) for field in self.fields ]
+        elif isinstance(values, (list, tuple)):
+            columns = list(values[:len(self.fields)]) + [None] * max(len(self.fields) - len(values), 0)
+        else:
+            columns = [ values ] + [None] * (len(self.fields) - 1)
+
+        self._reserve(n)
+        self._t[self.size:self.size+n] = t - self.start
+        for k, column in enumerate(columns):
+            column = self._to_column(column if column is not None else [None] * n)
+            if len(column) != n:
+                raise ValueError(f'TimeSeries.extend(): length mismatch for field "{self.fields[k]}"')
+            self._promote(k, column.dtype)
+            self._columns[k][self.size:self.size+n] = column
+        self.size += n
+
+
+    def slice(self, t_from=None, t_to=None):
+        '''
+        returns a new TimeSeries with the points in [t_from, t_to) (UNIX time-stamps); the time-stamps must be sorted
+        '''
+        self._check_columns()
+        t = self.t
+        begin = 0 if t_from is None else int(np.searchsorted(t, t_from - self.start, side='left'))
+        end = self.size if t_to is None else int(np.searchsorted(t, t_to - self.start, side='left'))
+        end = max(begin, end)
+        
+        ts = TimeSeries(fields=list(self.fields), start=self.start, length=self.length, capacity=end-begin)
+        ts._t = t[begin:end].copy()
+        ts._columns = [ column[begin:end].copy() for column in self.values ]
+        ts.size = end - begin
+        return ts
+        
+
+    def to_json(self, as_numpy=False):
+        '''
+        - as_numpy: if True, the arrays are returned as NumPy array views without copying, for NumPy-aware serializers
+        '''
+        self._check_columns()
         length = self.length
         if length is None:
-            if len(self.t) < 1:
+            if self.size < 1:
                 length = 1
             else:
-                length = self.t[-1] + 1
+                length = float(self._t[self.size-1]) + 1
             
         data = {
             'start': self.start,
             'length': length,
-            't': self.t,
+            't': self.t if as_numpy else self.t.tolist(),
         }
-        for k in range(len(self.fields)):
-            data[self.fields[k]] = self.values[k]
+        for k, column in enumerate(self.values):
+            data[self.fields[k]] = column if as_numpy else column.tolist()
         
         return data
 
     
     def __str__(self):
         return json.dumps(self.to_json())
+
+
+    def _check_columns(self):
+        if len(self._columns) != len(self.fields):
+            raise ValueError(
+                f'TimeSeries: {len(self.fields)} fields but {len(self._columns)} value columns; '
+                'assign fields and values together (values is a read-only view, appending to it has no effect)'
+            )
+
+        
+    def _reserve(self, n):
+        # amortized growth: the capacity is doubled when full
+        if self.size + n <= len(self._t):
+            return
+        capacity = max(2 * len(self._t), self.size + n)
+        t = np.empty(capacity, dtype=np.float64)
+        t[:self.size] = self._t[:self.size]
+        self._t = t
+        for k in range(len(self._columns)):
+            self._reserve_column(k, capacity)
+
+
+    def _reserve_column(self, k, capacity):
+        column = self._columns[k]
+        if len(column) < capacity:
+            new_column = np.empty(capacity, dtype=column.dtype)
+            if column.dtype == object:
+                new_column[:] = None
+            new_column[:min(self.size, len(column))] = column[:self.size]
+            self._columns[k] = new_column
+
+    
+    def _promote(self, k, dtype):
+        # int64 -> float64 -> object; an empty column takes the type of the first values
+        column = self._columns[k]
+        if column.dtype == dtype or (column.dtype == object and self.size > 0):
+            return
+        if self.size == 0:
+            new_column = np.empty(len(column), dtype=dtype)
+            if dtype == object:
+                new_column[:] = None
+        elif dtype == object:
+            new_column = np.full(len(column), None, dtype=object)
+            new_column[:self.size] = column[:self.size].tolist()
+        elif np.result_type(column.dtype, dtype) == column.dtype:
+            return
+        else:
+            new_column = column.astype(np.result_type(column.dtype, dtype))
+        self._columns[k] = new_column
+        
+
+    def _put_value(self, k, index, value):
+        if type(value) is int or isinstance(value, np.integer):
+            dtype = np.int64
+        elif type(value) is float or isinstance(value, np.floating):
+            dtype = np.float64
+        else:
+            dtype = object
+        self._promote(k, np.dtype(dtype))
+        self._columns[k][index] = value
+
+
+    @staticmethod
+    def _to_column(values):
+        column = np.asarray(values)
+        if column.dtype.kind in 'iub':
+            return column.astype(np.int64) if column.dtype.kind != 'b' else column.astype(object)
+        if column.dtype.kind == 'f':
+            return column.astype(np.float64)
+        if column.dtype == object:
+            return column
+        return np.array(column.tolist() if column.ndim > 0 else [column.item()], dtype=object)
@@ -2,11 +2,12 @@
 
 import asyncio
 import logging
+import functools
 
 
 class LocalPubsubNode:
     def __init__(self):
-        self.subscribers = {}    # TopicPattern -> set[asyncio.Queue]
+        self.subscribers = TopicTrie()    # TopicPattern -> set[asyncio.Queue]
 
     def aio_open(self):
         pass
@@ -28,17 +29,12 @@ class LocalPubsubNode:
 
 
     def _subscribe(self, topic_filter:str, queue):
-        pattern = TopicPattern(topic_filter)
-        if pattern not in self.subscribers:
-            self.subscribers[pattern] = set()
-        self.subscribers[pattern].add(queue)
+        self.subscribers.add(TopicPattern(topic_filter), queue)
 
     
     async def _publish(self, topic:str, data):
-        for pattern, queues in self.subscribers.items():
-            if pattern.match(topic):
-                for queue in queues:
-                    await queue.put(data)
+        for queue in self.subscribers.match(topic):
+            await queue.put(data)
 
         
         
@@ -140,6 +136,17 @@ class LocalSubscriberJsonNode:
 
 
 
+# The topic matching below (split_topic, TopicPattern, TopicTrie) is a twin of lib/slowlette/slowlette/topics.py,
+# kept separate as slowpy does not depend on slowlette; keep the two in sync.
+
+@functools.lru_cache(maxsize=4096)
+def split_topic(topic:str) -> tuple:
+    """tokenizes a topic or pattern; the results are cached as the same topics are published repeatedly
+    """
+    return tuple(topic.split(".")) if topic else ()
+
+
+
 class TopicPattern:
     def __init__(self, pattern):
         self.pattern = pattern
@@ -166,7 +173,7 @@ class TopicPattern:
           - topic_match("foo.*", "foo") == False
         """
         
-        tokens = self.pattern.split(".") if self.pattern else []
+        tokens = split_topic(self.pattern)
         for i, token in enumerate(tokens):
             if token == ">":
                 if i != len(tokens) - 1:
@@ -180,8 +187,8 @@ class TopicPattern:
         if self.pattern is None:
             return False
         
-        pattern_tokens = self.pattern.split(".") if self.pattern else []
-        topic_tokens = topic.split(".") if topic else []
+        pattern_tokens = split_topic(self.pattern)
+        topic_tokens = split_topic(topic)
 
         k_pattern = 0  # index for pattern
         k_topic = 0  # index for topic
@@ -211,3 +218,58 @@ class TopicPattern:
         # Pattern consumed; topic must also be fully consumed
         return k_topic == len(topic_tokens)
         
+
+    
+class TopicTrie:
+    """Subscription index of TopicPatterns, matching a topic in O(topic depth) instead of O(number of patterns)
+    (twin of slowlette.TopicTrie, see above)
+    """
+    class Node:
+        __slots__ = ('children', 'star', 'subscribers', 'trailing')
+        def __init__(self):
+            self.children = {}        # token -> Node
+            self.star = None          # Node for '*'
+            self.subscribers = set()  # subscribers of the pattern ending here
+            self.trailing = set()     # subscribers of the pattern ending here with '>'
+
+            
+    def __init__(self):
+        self.root = self.Node()
+
+        
+    def add(self, pattern:TopicPattern, subscriber):
+        if pattern.pattern is None:
+            return   # invalid pattern, matching nothing
+        
+        node = self.root
+        for token in split_topic(pattern.pattern):
+            if token == '>':
+                node.trailing.add(subscriber)
+                return
+            if token == '*':
+                if node.star is None:
+                    node.star = self.Node()
+                node = node.star
+            else:
+                node = node.children.setdefault(token, self.Node())
+        node.subscribers.add(subscriber)
+
+        
+    def match(self, topic:str) -> set:
+        result = set()
+        nodes = [ self.root ]
+        for token in split_topic(topic):
+            next_nodes = []
+            for node in nodes:
+                result.update(node.trailing)
+                if token in node.children:
+                    next_nodes.append(node.children[token])
+                if node.star is not None:
+                    next_nodes.append(node.star)
+            nodes = next_nodes
+            
+        for node in nodes:
+            result.update(node.subscribers)
+            result.update(node.trailing)   # '>' also matches zero tokens
+            
+        return result
@@ -5,6 +5,30 @@ import numpy as np
 from .basetypes import DataElement
 
 
+
+def bin_overlap_matrix(old_edges, new_edges):
+    """proportional re-distribution of bin contents from one binning to another, assuming uniform density within a bin
+    Returns:
+      - matrix[new_bin][old_bin]: fraction of the old bin falling in the new bin (new_counts = matrix @ old_counts)
+      - below[old_bin]: fraction of the old bin below the new range
+      - above[old_bin]: fraction of the old bin above the new range
+    """
+    old_edges = np.asarray(old_edges, dtype=float)
+    new_edges = np.asarray(new_edges, dtype=float)
+    old_left, old_right = old_edges[:-1], old_edges[1:]
+    old_width = old_right - old_left
+
+    def fraction(lower, upper):
+        overlap = np.clip(np.minimum(upper, old_right) - np.maximum(lower, old_left), 0, None)
+        return np.divide(overlap, old_width, out=np.zeros(np.broadcast(overlap, old_width).shape), where=(old_width > 0))
+
+    matrix = fraction(new_edges[:-1, np.newaxis], new_edges[1:, np.newaxis])
+    below = fraction(-np.inf, new_edges[0])
+    above = fraction(new_edges[-1], np.inf)
+    return matrix, below, above
+
+
+
 class HistogramScale:
     def __init__(self, nbins, range_min, range_max):
         self.nbins = max(nbins, 0)
@@ -22,6 +46,35 @@ class HistogramScale:
         return int((value - self.min) / self.bin_width)
 
     
+    def get_bins_of(self, values):
+        """vectorized get_bin_of(): returns an array of bin indices, with -1 for out-of-range (and NaN) values
+        """
+        values = np.asarray(values, dtype=float)
+        if self.nbins <= 0:
+            return np.full(values.shape, -1, dtype=np.intp)
+        in_range = (values >= self.min) & (values < self.max)
+        bins = ((np.where(in_range, values, self.min) - self.min) / self.bin_width).astype(np.intp)
+        np.minimum(bins, self.nbins - 1, out=bins)   # rounding for values just below max
+        bins[~in_range] = -1
+        return bins
+
+    
+    def get_bin_centers(self):
+        if self.nbins <= 0:
+            return np.zeros(0)
+        return self.min + (np.arange(self.nbins) + 0.5) * self.bin_width
+
+    
+    def get_edges(self):
+        if self.nbins <= 0:
+            return np.array([self.min, self.max], dtype=float)
+        return np.linspace(self.min, self.max, self.nbins+1, endpoint=True)
+
+    
+    def is_same_binning(self, other):
+        return self.nbins == other.nbins and self.min == other.min and self.max == other.max
+
+    
     def get_bin_range_of(self, bin_index):
         if self.nbins <= 0:
             return (None, None)
@@ -35,25 +88,36 @@ class Histogram(DataElement):
     def __init__(self, nbins, range_min, range_max):
         super().__init__()
         self.scale = HistogramScale(nbins, range_min, range_max)
-        if self.scale.nbins > 0:
-            self.counts = [0] * self.scale.nbins
-        else:
-            self.counts = []
+        self.counts = np.zeros(self.scale.nbins)
         self.overflow, self.underflow = 0, 0
 
+
+    # counts are stored in a NumPy array (float64); lists assigned by the users are converted
+    @property
+    def counts(self):
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts):
+        self._counts = np.asarray(counts, dtype=float)
+        
         
     def clear(self):
         super().clear()
-        self.counts[:] = [0] * len(self.counts)
+        self.counts[:] = 0
         self.overflow, self.underflow = 0, 0
 
         
     def fill(self, value, weight=1):
-        if isinstance(value, (list, np.ndarray)):
-            if not isinstance(weight, (list, np.ndarray)):
-                weight = [weight] * len(value)
-            for k in range(len(value)):
-                self.fill(value[k], weight[k])
+        if isinstance(value, (list, tuple, np.ndarray)):
+            values = np.asarray(value, dtype=float).ravel()
+            weights = np.broadcast_to(np.asarray(weight, dtype=float).ravel() if np.ndim(weight) > 0 else float(weight), values.shape)
+            bins = self.scale.get_bins_of(values)
+            in_range = (bins >= 0)
+            if self.scale.nbins > 0:
+                self.counts += np.bincount(bins[in_range], weights=weights[in_range], minlength=self.scale.nbins)
+            self.underflow += float(np.sum(weights[values < self.scale.min]))
+            self.overflow += float(np.sum(weights[values >= self.scale.max]))
             return
                 
         bin = self.scale.get_bin_of(value)
@@ -67,25 +131,49 @@ class Histogram(DataElement):
 
                 
     def rebin(self, nbins, range_min, range_max):
-        if nbins <= 0:
-            return
+        """bin contents are re-distributed in proportion to the bin overlaps; contents falling outside the new range go to under/overflow
+        """
         new_scale = HistogramScale(nbins, range_min, range_max)
-        new_counts = [0] * new_scale.nbins
-        for bin in range(self.scale.nbins):
-            (left, right) = self.scale.get_bin_range_of(bin)
-            for k in range(int(self.counts[bin])):
-                value = np.random.uniform(left, right)
-                new_bin = new_scale.get_bin_of(value)
-                if new_bin is not None:
-                    new_counts[new_bin] += 1
+        if new_scale.nbins <= 0:
+            return
+        counts, underflow, overflow = self._counts_in(new_scale)
         self.scale = new_scale
-        self.counts = new_counts
+        self.counts = counts
+        self.underflow += underflow
+        self.overflow += overflow
+
+
+    def merge(self, other):
+        """adds the contents of another Histogram; if the binning differs, the other histogram is rebinned to this binning
+        """
+        if self.scale.is_same_binning(other.scale):
+            self.counts += other.counts
+        else:
+            counts, underflow, overflow = other._counts_in(self.scale)
+            self.counts += counts
+            self.underflow += underflow
+            self.overflow += overflow
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    
+    def _counts_in(self, scale):
+        # returns (counts, underflow, overflow) of the contents re-distributed to the scale
+        if self.scale.nbins <= 0 or scale.nbins <= 0:
+            return np.zeros(scale.nbins), 0, 0
+        matrix, below, above = bin_overlap_matrix(self.scale.get_edges(), scale.get_edges())
+        return matrix @ self.counts, float(below @ self.counts), float(above @ self.counts)
 
         
     def to_json(self):
         return { **super().to_json(),  **{
             'bins': { 'min': self.scale.min, 'max': self.scale.max },
-            'counts': self.counts
+            'counts': self.counts.tolist()
         }}
 
     
@@ -98,23 +186,25 @@ class Histogram(DataElement):
 
     
     def to_numpy(self):
-        obj = self.to_json()
-        counts = obj['counts']
         edges = np.linspace(
-            start = obj['bins']['min'],
-            stop = obj['bins']['max'],
-            num = len(counts)+1,
+            start = self.scale.min,
+            stop = self.scale.max,
+            num = len(self.counts)+1,
             endpoint = True
         )
-        return (counts, edges)
+        return (self.counts.copy(), edges)
 
     
     @staticmethod
     def from_numpy(obj):
-        # BUG: this assumes edges are equidistant
+        # non-equidistant bins are re-distributed to equidistant bins over the same range, as the JSON schema has only min and max
         counts, edges, *_ = obj
+        counts, edges = np.asarray(counts, dtype=float), np.asarray(edges, dtype=float)
         hist = Histogram(len(counts), edges[0], edges[-1])
-        hist.counts = counts.tolist()
+        if np.allclose(edges, hist.scale.get_edges()):
+            hist.counts = counts.copy()
+        else:
+            hist.counts = bin_overlap_matrix(edges, hist.scale.get_edges())[0] @ counts
         return hist
 
     
@@ -124,28 +214,47 @@ class Histogram2d(DataElement):
         self.xscale = HistogramScale(xnbins, xrange_min, xrange_max)
         self.yscale = HistogramScale(ynbins, yrange_min, yrange_max)
         if self.xscale.nbins > 0 and self.yscale.nbins > 0:
-            self.counts = [ [0]*self.xscale.nbins for yslice in range(self.yscale.nbins) ]
+            self.counts = np.zeros((self.yscale.nbins, self.xscale.nbins))   # counts[y][x]
         else:
             self.counts = None
         self.outliers = 0
 
+
+    # counts are stored in a 2-dim NumPy array (float64), indexed as [y][x]; lists assigned by the users are converted
+    @property
+    def counts(self):
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts):
+        self._counts = None if counts is None else np.asarray(counts, dtype=float)
+        
         
     def clear(self):
         super().clear()
-        for yslice in self.counts:
-            yslice[:] = [0] * len(yslice)
+        if self.counts is not None:
+            self.counts[:] = 0
         self.outliers = 0
 
         
     def fill(self, x, y, weight=1):
-        if isinstance(x, (list, np.ndarray)):
-            if not isinstance(y, (list, np.ndarray)) or len(x) != len(y):
+        if isinstance(x, (list, tuple, np.ndarray)):
+            if not isinstance(y, (list, tuple, np.ndarray)) or len(x) != len(y):
                 # ERROR: ...
                 return
-            if not isinstance(weight, (list, np.ndarray)):
-                weight = [weight] * len(x)
-            for k in range(len(x)):
-                self.fill(x[k], y[k], weight[k])
+            x = np.asarray(x, dtype=float).ravel()
+            y = np.asarray(y, dtype=float).ravel()
+            weights = np.broadcast_to(np.asarray(weight, dtype=float).ravel() if np.ndim(weight) > 0 else float(weight), x.shape)
+            xbins = self.xscale.get_bins_of(x)
+            ybins = self.yscale.get_bins_of(y)
+            in_range = (xbins >= 0) & (ybins >= 0)
+            if self.counts is not None:
+                nx, ny = self.xscale.nbins, self.yscale.nbins
+                flat_bins = ybins[in_range] * nx + xbins[in_range]
+                self.counts += np.bincount(flat_bins, weights=weights[in_range], minlength=nx*ny).reshape(ny, nx)
+                self.outliers += float(np.sum(weights[~in_range]))
+            else:
+                self.outliers += float(np.sum(weights))
             return
             
             
@@ -156,12 +265,55 @@ class Histogram2d(DataElement):
         else:
             self.counts[ybin][xbin] += float(weight)
 
+
+    def rebin(self, xnbins, xrange_min, xrange_max, ynbins, yrange_min, yrange_max):
+        """bin contents are re-distributed in proportion to the bin overlaps; contents falling outside the new range go to outliers
+        """
+        new_xscale = HistogramScale(xnbins, xrange_min, xrange_max)
+        new_yscale = HistogramScale(ynbins, yrange_min, yrange_max)
+        if new_xscale.nbins <= 0 or new_yscale.nbins <= 0:
+            return
+        counts, outliers = self._counts_in(new_xscale, new_yscale)
+        self.xscale, self.yscale = new_xscale, new_yscale
+        self.counts = counts
+        self.outliers += outliers
+
+
+    def merge(self, other):
+        """adds the contents of another Histogram2d; if the binning differs, the other histogram is rebinned to this binning
+        """
+        if self.counts is None:
+            self.outliers += other.outliers + (float(np.sum(other.counts)) if other.counts is not None else 0)
+            return self
+        if self.xscale.is_same_binning(other.xscale) and self.yscale.is_same_binning(other.yscale):
+            self.counts += other.counts
+        else:
+            counts, outliers = other._counts_in(self.xscale, self.yscale)
+            self.counts += counts
+            self.outliers += outliers
+        self.outliers += other.outliers
+        return self
+
+    
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    
+    def _counts_in(self, xscale, yscale):
+        # returns (counts, outliers) of the contents re-distributed to the scales
+        if self.counts is None:
+            return np.zeros((yscale.nbins, xscale.nbins)), 0
+        xmatrix = bin_overlap_matrix(self.xscale.get_edges(), xscale.get_edges())[0]
+        ymatrix = bin_overlap_matrix(self.yscale.get_edges(), yscale.get_edges())[0]
+        counts = ymatrix @ self.counts @ xmatrix.T
+        return counts, float(np.sum(self.counts) - np.sum(counts))
+
                 
     def to_json(self):
         return { **super().to_json(),  **{
             'xbins': { 'min': self.xscale.min, 'max': self.xscale.max },
             'ybins': { 'min': self.yscale.min, 'max': self.yscale.max },
-            'counts': self.counts
+            'counts': self.counts.tolist() if self.counts is not None else None
         }}
 
     
@@ -174,18 +326,17 @@ class Histogram2d(DataElement):
 
 
     def to_numpy(self):
-        obj = self.to_json()
-        counts = np.array(obj['counts']).T
+        counts = self.counts.T.copy()   # slowpy counts[y][x] -> numpy counts[x][y]
         xedges = np.linspace(
-            start = obj['xbins']['min'],
-            stop = obj['xbins']['max'],
-            num = len(counts[0])+1,
+            start = self.xscale.min,
+            stop = self.xscale.max,
+            num = len(counts)+1,
             endpoint = True
         )
         yedges = np.linspace(
-            start = obj['ybins']['min'],
-            stop = obj['ybins']['max'],
-            num = len(counts)+1,
+            start = self.yscale.min,
+            stop = self.yscale.max,
+            num = len(counts[0])+1,
             endpoint = True
         )
         return (counts, xedges, yedges)
@@ -193,12 +344,17 @@ class Histogram2d(DataElement):
     
     @staticmethod
     def from_numpy(obj):
-        # BUG: this assumes edges are equidistant
+        # non-equidistant bins are re-distributed to equidistant bins over the same range, as the JSON schema has only min and max
         counts, xedges, yedges, *_ = obj
-        counts = counts.T  # numpy counts[x][y] -> slowpy counts[y][x]
+        counts = np.asarray(counts, dtype=float).T  # numpy counts[x][y] -> slowpy counts[y][x]
+        xedges, yedges = np.asarray(xedges, dtype=float), np.asarray(yedges, dtype=float)
         hist2d = Histogram2d(len(xedges)-1, xedges[0], xedges[-1], len(yedges)-1, yedges[0], yedges[-1])
-        for yk in range(len(yedges)-1):
-            hist2d.counts[yk][:] = counts[yk][:].tolist()
+        if np.allclose(xedges, hist2d.xscale.get_edges()) and np.allclose(yedges, hist2d.yscale.get_edges()):
+            hist2d.counts = counts.copy()
+        else:
+            xmatrix = bin_overlap_matrix(xedges, hist2d.xscale.get_edges())[0]
+            ymatrix = bin_overlap_matrix(yedges, hist2d.yscale.get_edges())[0]
+            hist2d.counts = ymatrix @ counts @ xmatrix.T
         return hist2d
             
 
@@ -210,16 +366,12 @@ class HistogramBasicStat:
 
         
     def __call__(self, hist):
-        n, sum, sum2 = 0, 0, 0
-        for k in range(hist.scale.nbins):
-            xk0, xk1 = hist.scale.get_bin_range_of(k)
-            xk = (xk0 + xk1) / 2.0
-            yk = hist.counts[k]
-            n += yk
-            sum += xk * yk
-            sum2 += xk*xk * yk
+        xk, yk = hist.scale.get_bin_centers(), hist.counts
+        n = float(np.sum(yk))
+        sum = float(np.dot(xk, yk))
+        sum2 = float(np.dot(xk*xk, yk))
         mean = None if n < 1 else sum/n
-        std = None if n < 1 else np.sqrt(abs(sum2/n - mean*mean))
+        std = None if n < 1 else float(np.sqrt(abs(sum2/n - mean*mean)))
         result = {}
         for key in self.fields:
             if key.lower() in ['n', 'counts', 'entries']:
@@ -267,9 +419,8 @@ class HistogramCountStat:
         (upper_bin, upper_frac) = self.find_bin(hist, self.upper)
         value += hist.counts[lower_bin] * (1-lower_frac)
         value += hist.counts[upper_bin] * upper_frac
-        for k in range(lower_bin+1, upper_bin):
-            value += hist.counts[k]
-        return { self.label: round(10*value)/10.0 }
+        value += np.sum(hist.counts[lower_bin+1:upper_bin])
+        return { self.label: round(10*float(value))/10.0 }
 
     
 
@@ -281,22 +432,17 @@ class Histogram2dBasicStat:
         
     def __call__(self, hist2d):
         n, xsum, xsum2, ysum, ysum2 = 0, 0, 0, 0, 0
-        for ky in range(hist2d.yscale.nbins):
-            yk0, yk1 = hist2d.yscale.get_bin_range_of(ky)
-            yk = (yk0 + yk1) / 2.0
-            for kx in range(hist2d.xscale.nbins):
-                xk0, xk1 = hist2d.xscale.get_bin_range_of(kx)
-                xk = (xk0 + xk1) / 2.0
-                zk = hist2d.counts[ky][kx]
-                n += zk
-                xsum += xk * zk
-                ysum += yk * zk
-                xsum2 += xk*xk * zk
-                ysum2 += yk*yk * zk
+        if hist2d.counts is not None:
+            # projections to x and y
+            xk, xproj = hist2d.xscale.get_bin_centers(), np.sum(hist2d.counts, axis=0)
+            yk, yproj = hist2d.yscale.get_bin_centers(), np.sum(hist2d.counts, axis=1)
+            n = float(np.sum(xproj))
+            xsum, xsum2 = float(np.dot(xk, xproj)), float(np.dot(xk*xk, xproj))
+            ysum, ysum2 = float(np.dot(yk, yproj)), float(np.dot(yk*yk, yproj))
         xmean = None if n < 1 else xsum/n
         ymean = None if n < 1 else ysum/n
-        xstd = None if n < 1 else np.sqrt(xsum2/n - xmean*xmean)
-        ystd = None if n < 1 else np.sqrt(ysum2/n - ymean*ymean)
+        xstd = None if n < 1 else float(np.sqrt(abs(xsum2/n - xmean*xmean)))
+        ystd = None if n < 1 else float(np.sqrt(abs(ysum2/n - ymean*ymean)))
             
         result = {}
         for key in self.fields:
@@ -133,7 +133,7 @@ class Axes:
         else:
             counts, edges = np.histogram(values, bins)
         hist = Histogram(len(edges)-1, edges[0], edges[-1])
-        hist.counts = counts.tolist()
+        hist.counts = counts
         
         name = slowplot.create_name(kwargs.get('label', None), 'hist')
         
@@ -152,8 +152,7 @@ class Axes:
         else:
             counts, xedges, yedges = np.histogram2d(x, y, bins, weights=weights)
         hist2d = Histogram2d(len(xedges)-1, xedges[0], xedges[-1], len(yedges)-1, yedges[0], yedges[-1])
-        for yk in range(len(yedges)-1):
-            hist2d.counts[yk][:] = counts[yk][:].tolist()
+        hist2d.counts = counts.T   # numpy counts[x][y] -> slowpy counts[y][x]
         
         name = slowplot.create_name(kwargs.get('label', None), 'hist2d')
         
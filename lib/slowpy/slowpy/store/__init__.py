@@ -7,3 +7,4 @@ from .store_InfluxDB2 import DataStore_InfluxDB2
 from .store_Redis import DataStore_Redis
 from .store_HDF5 import DataStore_HDF5
 from .store_CSV import DataStore_CSV, DataStore_TextDump
+from .store_Background import DataStore_Background
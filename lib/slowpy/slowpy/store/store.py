@@ -61,53 +61,86 @@ class DataStore:
         
         self._write(values, tag, timestamp, update=True)
 
+
+    def append_columns(self, t, values, tag=None):
+        '''
+        Bulk version of append(), writing many time points at once
+        - t: array of UNIX time-stamps
+        - values: dict of field name and array of values (each with the same length as t), or an array of values
+        - tag: tag for channels, as in append()
+        '''
+        if isinstance(values, dict):
+            channels = self._channels(tag, list(values.keys()))
+            values = list(values.values())
+        else:
+            channels = self._channels(tag, [''])
+        
+        ts = TimeSeries(fields=channels, capacity=len(t))
+        ts.extend(t, values)
+        return self._write(ts)
+
         
     def _write(self, values, tag=None, timestamp=None, update=False):
+        '''
+        returns False if the data could not be written (e.g., the backend is not available)
+        '''
         if isinstance(values, TimeSeries):
-            ts = values
-            records = []
-            for i in range(len(ts.t)):
-                fields, values = [], []
-                for k in range(len(ts.fields)):
-                    if ts.values[k][i] is not None:
-                        fields.append(ts.fields[k])
-                        values.append(ts.values[k][i])
-                if len(fields) > 0:
-                    records.append((ts.start+ts.t[i], fields, values))
-                
-            if len(records) > 0:
-                handle = self._open_transaction()
-                if handle is not None:
-                    try:
-                        for row in records:
-                            #self._write_one(handle, timestamp=row[0], tag=tag, fields=row[1], values=row[2], update=update)
-                            # TODO: currently using "tag:field"-formatted values in the tag field of a long format confuses sd_datasource, as sd_datasource assumes "tag:field" channel data would be stored in a wide format
-                            self._write_one(handle, timestamp=row[0], tag=tag, fields=None, values=[row[2][0]], update=update)
-                    except Exception as e:
-                        logging.warning(f'DataStore: error on writing a time-series value: {e}')
-                    finally:
-                        self._close_transaction(handle)
-                
+            return self._write_columns(*self._make_columns(values, tag), update)
+        return self._write_records(self._make_records(values, tag, timestamp), update)
+
+        
+    def _make_columns(self, ts, tag=None):
+        '''
+        returns (timestamps, channels, columns) of a TimeSeries, to be passed to _write_columns()
+        Channel names: the first field is written to the tag channel and the others to "{tag}_{field}",
+        or to the field names if tag is None.
+        '''
+        # "tag:field" is not used here, as sd_datasource assumes "tag:field" channel data would be stored in a wide format
+        if tag is None:
+            channels = list(ts.fields)
         else:
-            t = timestamp if timestamp is not None else time.time()
-            if type(t) in [ int, float ] and t <= 0:
-                t += time.time()
+            channels = [ tag ] + [ f'{tag}_{field}' for field in ts.fields[1:] ]
+        return ts.start + ts.t, channels, ts.values
+
+    
+    def _make_records(self, values, tag=None, timestamp=None):
+        '''
+        returns a list of (timestamp, tag, fields, values) to be passed to _write_one()
+        '''
+        t = timestamp if timestamp is not None else time.time()
+        if type(t) in [ int, float ] and t <= 0:
+            t += time.time()
             
-            if type(values) is dict:
-                fields = [ k for k in values.keys() ]
-                values = [ v for v in values.values() ]
-            else:
-                fields = None
-                values = [ values ]
-                
-            handle = self._open_transaction()
-            if handle is not None:
-                try:
-                    self._write_one(handle, timestamp=t, tag=tag, fields=fields, values=values, update=update)
-                except Exception as e:
-                    logging.warning(f'DataStore: error on writing a value: {e}')
-                finally:
-                    self._close_transaction(handle)
+        if type(values) is dict:
+            fields = [ k for k in values.keys() ]
+            values = [ v for v in values.values() ]
+        else:
+            fields = None
+            values = [ values ]
+            
+        return [ (t, tag, fields, values) ]
+
+    
+    def _write_records(self, records, update=False):
+        if len(records) == 0:
+            return True
+        
+        handle = self._open_transaction()
+        if handle is None:
+            return False
+        
+        ok = True
+        try:
+            for timestamp, tag, fields, values in records:
+                self._write_one(handle, timestamp=timestamp, tag=tag, fields=fields, values=values, update=update)
+        except Exception as e:
+            logging.warning(f'DataStore: error on writing a value: {e}')
+            ok = False
+        finally:
+            if self._close_transaction(handle) is False:
+                ok = False
+
+        return ok
                 
 
     # override in child classes
@@ -116,10 +149,47 @@ class DataStore:
         return None
 
     
-    # override in child classes
+    # override in child classes; return False on failure (e.g., commit error)
     def _close_transaction(self, handle):
         pass
 
+
+    # override in child classes
+    def _reconnect(self):
+        '''
+        called after a failed write (by DataStore_Background) before retrying;
+        returns False if the backend is still not available
+        '''
+        return True
+
+    
+    # override in child classes for native bulk writing
+    def _write_columns(self, timestamps, channels, columns, update):
+        '''
+        - timestamps: array of UNIX time-stamps
+        - channels: list of channel names
+        - columns: list of value arrays for the channels, where None in an object array is a missing value
+        Returns False if the data could not be written. This default implementation writes row by row.
+        '''
+        return self._write_records(self._columns_to_records(timestamps, channels, columns), update)
+
+    
+    # use this in child classes
+    @staticmethod
+    def _columns_to_records(timestamps, channels, columns):
+        # tolist() converts NumPy scalars to Python int/float, as the backends check the value types with type()
+        columns = [ column.tolist() for column in columns ]
+        records = []
+        for i, timestamp in enumerate(timestamps.tolist()):
+            fields, values = [], []
+            for k in range(len(channels)):
+                if columns[k][i] is not None:
+                    fields.append(channels[k])
+                    values.append(columns[k][i])
+            if len(fields) > 0:
+                records.append((timestamp, None, fields, values))
+        return records
+
     
     # override in child classes
     def _write_one(self, handle, timestamp, tag, fields, values, update):
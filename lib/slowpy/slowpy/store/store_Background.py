@@ -0,0 +1,324 @@
+# Created on 18 October 2026 #
+
+import os, time, copy, pickle, threading, collections, logging
+from .store import DataStore
+
+
+class DataStore_Background(DataStore):
+    '''
+    Writes data of another DataStore in a background thread, so that append() / update() do not wait for the backend.
+
+    Usage:
+      datastore = DataStore_Background(DataStore_PostgreSQL(...), queue_size=10000, when_full='drop_oldest')
+      datastore.append(...)   # returns immediately
+
+    - queue_size: maximum number of append()/update() calls waiting to be written
+    - when_full: what append()/update() does when the queue is full
+      - 'drop_oldest': the oldest entry in the queue is discarded (default)
+      - 'drop_newest': the new entry is discarded
+      - 'block': waits until the queue has space, for up to block_timeout [sec] (None for no limit); then 'drop_newest'
+    - retry_interval: when a write fails, the backend is reconnected and retried after this period [sec]
+      (if the backend is available but the data cannot be written, e.g., a bad value, the entry is discarded and logged)
+    - spill_file: if given, data are stored in this file while the backend is not available, and written to the backend
+      when it becomes available again (also on the next start, if the program is terminated in the meantime)
+
+    The values are copied on append(), so mutable objects (dict, Histogram, etc.) can be reused by the caller.
+    The timestamp is taken on append(), not when the data is written.
+    '''
+
+    def __init__(self, datastore, queue_size=10000, when_full='drop_oldest', block_timeout=None, retry_interval=10, spill_file=None):
+        super().__init__()
+
+        if when_full not in [ 'drop_oldest', 'drop_newest', 'block' ]:
+            logging.error(f'DataStore_Background: unknown when_full policy: {when_full}')
+            when_full = 'drop_oldest'
+
+        self.datastore = datastore
+        self.queue_size = max(1, queue_size)
+        self.when_full = when_full
+        self.block_timeout = block_timeout
+        self.retry_interval = retry_interval
+        self.spill_file = spill_file
+
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.stopping = False
+        self.is_writing = False
+        self.available = True
+        self.spilled = (spill_file is not None) and os.path.exists(spill_file) and os.path.getsize(spill_file) > 0
+
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self.rejected = 0
+
+        self.thread = threading.Thread(target=self._run, name='DataStore_Background', daemon=True)
+        self.thread.start()
+
+
+    def another(self, *args, **kwargs):
+        '''
+        creates another DataStore_Background for datastore.another(*args, **kwargs), with the same settings except for spill_file
+        '''
+        return DataStore_Background(
+            self.datastore.another(*args, **kwargs),
+            queue_size = self.queue_size,
+            when_full = self.when_full,
+            block_timeout = self.block_timeout,
+            retry_interval = self.retry_interval,
+        )
+
+
+    def close(self):
+        '''
+        waits for the queued data to be written, and closes the backend
+        - if the backend is not available, the data in the queue are stored to the spill file, or discarded
+        '''
+        if self.thread is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+
+    def flush(self, timeout=None):
+        '''
+        waits until all the queued data are written (or stored to the spill file); returns False on timeout
+        - without spill_file, this waits while the backend is not available
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while (len(self.queue) > 0 or self.is_writing) and (self.thread is not None):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+    def stats(self):
+        with self.condition:
+            return {
+                'queued': len(self.queue),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'available': self.available,
+                'spilled': self.spilled,
+            }
+
+
+    def _write(self, values, tag=None, timestamp=None, update=False):
+        if timestamp is None:
+            timestamp = time.time()
+        if type(values) not in [ int, float, str, bool ]:
+            values = copy.deepcopy(values)
+        entry = (values, tag, timestamp, update)
+
+        with self.condition:
+            if self.stopping:
+                logging.warning('DataStore_Background: write after close(): data discarded')
+                return False
+
+            if len(self.queue) >= self.queue_size:
+                if self.when_full == 'block':
+                    self.condition.wait_for(lambda: len(self.queue) < self.queue_size or self.stopping, self.block_timeout)
+                if self.when_full == 'drop_oldest':
+                    self.queue.popleft()
+                    self._report_drop()
+                elif len(self.queue) >= self.queue_size or self.stopping:
+                    self._report_drop()
+                    return False
+
+            self.queue.append(entry)
+            self.condition.notify_all()
+
+        return True
+
+
+    def _report_drop(self):
+        # called with the lock held
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logging.warning(f'DataStore_Background: queue full, {self.dropped} entries dropped so far')
+
+
+    def _run(self):
+        if self.spilled:
+            self._recover()
+
+        while True:
+            with self.condition:
+                if len(self.queue) == 0 and not self.stopping:
+                    # if the backend is not available, wake up to retry even if there is no new data
+                    self.condition.wait(None if self._is_healthy() else self.retry_interval)
+                if len(self.queue) == 0 and self.stopping:
+                    break
+                entries = [ self.queue.popleft() for i in range(min(len(self.queue), 1000)) ]
+                self.is_writing = len(entries) > 0
+                self.condition.notify_all()   # for writers blocked by the full queue
+
+            if self._is_healthy():
+                entries = self._write_entries(entries)
+            if len(entries) > 0:
+                if self.spill_file is not None:
+                    self._spill(entries)
+                else:
+                    self._requeue(entries)
+                    
+            with self.condition:
+                self.is_writing = False
+                self.condition.notify_all()
+
+            if not self._is_healthy():
+                if self.stopping:
+                    break
+                if len(entries) > 0:
+                    self.stop_event.wait(self.retry_interval)
+                self._recover()
+
+        with self.condition:
+            if len(self.queue) > 0:
+                if self.spill_file is not None:
+                    self._spill(list(self.queue))
+                else:
+                    logging.error(f'DataStore_Background: backend not available, {len(self.queue)} entries discarded')
+                self.queue.clear()
+            self.condition.notify_all()
+
+        # the backend is closed in this thread, as some backends (e.g., SQLite) must be used by the same thread
+        try:
+            self.datastore.close()
+        except Exception as e:
+            logging.warning(f'DataStore_Background: error on closing datastore: {e}')
+
+
+    def _is_healthy(self):
+        # data written before (in the spill file) must be written first
+        return self.available and not self.spilled
+
+
+    def _requeue(self, entries):
+        with self.condition:
+            self.queue.extendleft(reversed(entries))
+            while len(self.queue) > self.queue_size:
+                # no space for the entries to be retried
+                if self.when_full == 'drop_newest':
+                    self.queue.pop()
+                else:
+                    self.queue.popleft()
+                self._report_drop()
+
+
+    def _write_entries(self, entries):
+        '''
+        writes the entries to the backend, and returns the entries not written
+        '''
+        for k, entry in enumerate(entries):
+            if self._write_entry(entry):
+                with self.condition:
+                    self.written += 1
+            elif self._probe():
+                # the backend is available but this entry cannot be written: discarded, not to block the others
+                logging.error(f'DataStore_Background: entry not writable, discarded: tag={entry[1]}, values={entry[0]}')
+                with self.condition:
+                    self.rejected += 1
+            else:
+                with self.condition:
+                    self.available = False
+                    self.failures += 1
+                logging.warning('DataStore_Background: backend not available, retrying in %s sec' % self.retry_interval)
+                return entries[k:]
+
+        return []
+
+
+    def _write_entry(self, entry):
+        values, tag, timestamp, update = entry
+        try:
+            return self.datastore._write(values, tag, timestamp, update) is not False
+        except Exception as e:
+            logging.warning(f'DataStore_Background: error on writing: {e}')
+            return False
+
+
+    def _probe(self):
+        '''
+        after a write failure, tells whether the backend is still available, by an empty transaction
+        '''
+        try:
+            handle = self.datastore._open_transaction()
+            if handle is None:
+                return False
+            return self.datastore._close_transaction(handle) is not False
+        except Exception as e:
+            logging.warning(f'DataStore_Background: error on checking backend: {e}')
+            return False
+
+
+    def _recover(self):
+        try:
+            available = self.datastore._reconnect()
+        except Exception as e:
+            logging.warning(f'DataStore_Background: error on reconnecting: {e}')
+            available = False
+        if available is False:
+            return
+
+        if self.spilled:
+            entries = self._load_spill()
+            remaining = self._write_entries(entries)
+            if len(remaining) > 0:
+                self._save_spill(remaining)
+                return
+            try:
+                os.remove(self.spill_file)
+            except Exception as e:
+                logging.error(f'DataStore_Background: unable to remove spill file: {self.spill_file}: {e}')
+                return
+            self.spilled = False
+            logging.info(f'DataStore_Background: {len(entries)} entries recovered from spill file')
+
+        with self.condition:
+            self.available = True
+
+
+    def _spill(self, entries):
+        try:
+            with open(self.spill_file, 'ab') as f:
+                for entry in entries:
+                    pickle.dump(entry, f)
+            self.spilled = True
+        except Exception as e:
+            logging.error(f'DataStore_Background: unable to write spill file: {self.spill_file}: {e}')
+            with self.condition:
+                self.dropped += len(entries)
+
+
+    def _load_spill(self):
+        entries = []
+        try:
+            with open(self.spill_file, 'rb') as f:
+                while True:
+                    entries.append(pickle.load(f))
+        except EOFError:
+            pass
+        except Exception as e:
+            # a broken entry at the end, e.g., by a crash while writing
+            logging.warning(f'DataStore_Background: error on reading spill file: {self.spill_file}: {e}')
+        return entries
+
+
+    def _save_spill(self, entries):
+        try:
+            with open(self.spill_file + '.tmp', 'wb') as f:
+                for entry in entries:
+                    pickle.dump(entry, f)
+            os.replace(self.spill_file + '.tmp', self.spill_file)
+        except Exception as e:
+            logging.error(f'DataStore_Background: unable to write spill file: {self.spill_file}: {e}')
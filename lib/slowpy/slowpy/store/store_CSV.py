@@ -2,6 +2,7 @@
 
 
 import os, sys, time, logging
+import numpy as np
 from .store import DataStore
 
 
@@ -77,6 +78,34 @@ class DataStore_CSV(DataStore):
             self.csv_file.write("%d,%s,%s\n" % (int(timestamp), ch, value))
         self.csv_file.flush()
 
+
+    def _write_columns(self, timestamps, channels, columns, update):
+        if self.csv_file is None:
+            return False
+        if update is True:
+            return super()._write_columns(timestamps, channels, columns, update)
+
+        try:
+            # lines are formatted column-wise, and ordered by time (then by channel) as in _write_one()
+            time_text = timestamps.astype(np.int64).astype(str).astype(object)
+            lines = np.empty((len(timestamps), len(channels)), dtype=object)
+            filled = np.ones(lines.shape, dtype=bool)
+            for k, column in enumerate(columns):
+                if column.dtype == object:
+                    filled[:, k] = [ value is not None for value in column ]
+                    value_text = np.array([ self._escape(str(value)) for value in column ], dtype=object)
+                else:
+                    value_text = column.astype(str).astype(object)
+                lines[:, k] = time_text + (',' + self._escape(channels[k]) + ',') + value_text + '\n'
+            
+            self.csv_file.write(''.join(lines[filled]))
+            self.csv_file.flush()
+        except Exception as e:
+            logging.warning(f'CSV: error on writing time-series: {e}')
+            return False
+        
+        return True
+
         
     def _escape(self, text):
         # TODO: do not replace "\," with "\\,"
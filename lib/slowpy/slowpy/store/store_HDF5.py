@@ -167,6 +167,44 @@ class DataStore_HDF5(DataStore):
             self._flush()
 
 
+    def _write_columns(self, timestamps, channels, columns, update):
+        if update is True and 'update' not in self.shown_errors:
+            logging.error('HDF5: "update()" is not available for HDF5: switched to append()')
+            self.shown_errors.append('update')
+        if len(timestamps) == 0:
+            return True
+        
+        try:
+            if self.dataset is None:
+                self._build_dataset({ ch: column[:1].tolist()[0] for ch, column in zip(channels, columns) })
+                if self.dataset is None:
+                    return False
+
+            # the buffered rows are written before, to keep the order
+            self._flush()
+
+            column_of = dict(zip(channels, columns))
+            block = np.empty(len(timestamps), dtype=np.dtype(self.fields))
+            for name, _dt in self.fields:
+                if name == 'timestamp':
+                    block[name] = timestamps
+                    continue
+                column = column_of.get(name, None)
+                if column is None:
+                    block[name] = self.defaults[name]
+                elif column.dtype == object:
+                    block[name] = [ self.defaults[name] if value is None else value for value in column ]
+                else:
+                    block[name] = column
+                
+            self._append_block(block)
+        except Exception as e:
+            logging.warning(f'HDF5: error on writing time-series: {e}')
+            return False
+        
+        return True
+
+        
     def _build_dataset(self, first_record, defaults={}):
         if self.file_holder.hdf5_file is None:
             return
@@ -220,13 +258,19 @@ class DataStore_HDF5(DataStore):
         if not self.buf:
             return
 
-        chunk_size = len(self.buf)
-        block = np.empty(chunk_size, dtype=np.dtype(self.fields))
+        block = np.empty(len(self.buf), dtype=np.dtype(self.fields))
         for name, _dt in self.fields:
             block[name] = [ row[name] for row in self.buf ]
+
+        try:
+            self._append_block(block)
+        finally:
+            self.buf.clear()
+
             
+    def _append_block(self, block):
         old_size = int(self.dataset.shape[0])
-        new_size = old_size + chunk_size
+        new_size = old_size + len(block)
         self.dataset.resize((new_size,))
         
         self.dataset[old_size:new_size] = block
@@ -235,5 +279,3 @@ class DataStore_HDF5(DataStore):
             self.file_holder.hdf5_file.flush()
         except Exception as e:
             logging.warning(f'HDF5: Error on flushing data to disk: {e}')
-        finally:
-            self.buf.clear()
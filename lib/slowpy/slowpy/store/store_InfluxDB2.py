@@ -121,7 +121,37 @@ class DataStore_InfluxDB2(DataStore):
             self._write_point(measurement, timestamp, tag, fields=['__value']*len(values), values=values)
             
             
+    def _write_columns(self, timestamps, channels, columns, update):
+        if self.client is None or self.measurement is None or self.write_api is None:
+            return False
+        if update is True and self.update_error_shown is False:
+            logging.warning('SlowPy.InfluxDB2: "update()" is not available for InfluxDB: switched to append()')
+            self.update_error_shown = True
+
+        # all the points are sent by one write request
+        points = []
+        for timestamp, tag, fields, values in self._columns_to_records(timestamps, channels, columns):
+            if self.field is not None:  # long format
+                for channel, value in zip(fields, values):
+                    points.append(self._make_point(self.measurement, timestamp, channel, [self.field], [value]))
+            else:                       # wide format, fields from channels
+                points.append(self._make_point(self.measurement, timestamp, None, fields, values))
+
+        try:
+            if len(points) > 0:
+                self.write_api.write(self.bucket, self.org, points)
+        except Exception as e:
+            logging.warning(f'SlowPy.InfluxDB2: error on writing: {e}')
+            return False
+            
+        return True
+        
+            
     def _write_point(self, measurement, timestamp, tag, fields, values):
+        self.write_api.write(self.bucket, self.org, self._make_point(measurement, timestamp, tag, fields, values))
+
+        
+    def _make_point(self, measurement, timestamp, tag, fields, values):
         point = self.Point(measurement)
             
         if timestamp is not None:
@@ -138,6 +168,5 @@ class DataStore_InfluxDB2(DataStore):
             else:
                 point = point.field(fields[i], str(values[i]))
             
-        #print(point)
-        self.write_api.write(self.bucket, self.org, point)
+        return point
 
@@ -1,31 +1,47 @@
 # Created by Sanshiro Enomoto on 3 June 2023 #
 
 
-import sys, os, time, json, logging
+import sys, os, time, json, itertools, logging
+import numpy as np
 from .store import DataStore
 
 objts_prefix = '__sd_objts'
 
 
 class DataStore_Redis(DataStore):
-    def __init__(self, db_url='redis://localhost/1', retention_length=None, objts_retention_length=3600, objts_timebin=1):
+    '''
+    - pipelined: if True (default), the commands of one append()/update() call are sent in one Redis pipeline,
+      with the numeric samples of all the channels in one TS.MADD. Errors are reported when the pipeline is executed.
+    '''
+
+    madd_chunk_size = 10000   # maximum number of samples in one TS.MADD command
+
+
+    class Transaction:
+        def __init__(self, client, ts):
+            self.client = client    # Redis client or pipeline, for the core commands
+            self.ts = ts            # TimeSeries commands, on the same client
+            self.samples = []       # (key, msec, value) to be written by TS.MADD
+            self.creations = {}     # pipeline position -> key, for TS.CREATE
+
+
+    def __init__(self, db_url='redis://localhost/1', retention_length=None, objts_retention_length=3600, objts_timebin=1, *, pipelined=True):
         super().__init__()
         
         self.db_url = db_url
         self.retention_length = retention_length
         self.objts_retention_length = objts_retention_length
         self.objts_timebin = objts_timebin
+        self.pipelined = pipelined
 
         # retries up to 60 sec, for docker-compose etc.
         import redis
         self.redis = None
-        self.ts_set = set()
+        self.ts_set = set()   # keys known to be time-series
         for i in range(12):
             try:
                 self.redis = redis.from_url(self.db_url, decode_responses=True)
-                for key in self.redis.keys():
-                    if self.redis.type(key) == 'TSDB-TYPE':
-                        self.ts_set.add(key)
+                self.ts_set = set(key for key, key_type in self._scan_types() if key_type == 'TSDB-TYPE')
                 break
             except Exception as e:
                 logging.info(e)
@@ -56,73 +72,195 @@ class DataStore_Redis(DataStore):
         if objts_timebin == 0:
             objts_timebin = self.objts_timebin
 
-        return DataStore_Redis(db_url, retention_length, objts_retention_length, objts_timebin)
+        return DataStore_Redis(db_url, retention_length, objts_retention_length, objts_timebin, pipelined=self.pipelined)
 
     
     def _open_transaction(self):
-        return self.redis
+        if self.redis is None:
+            return None
+        if self.pipelined:
+            pipeline = self.redis.ts().pipeline(transaction=False)
+            return self.Transaction(pipeline, pipeline)
+        else:
+            return self.Transaction(self.redis, self.redis.ts())
 
     
-    def _close_transaction(self, redis):
-        pass
+    def _close_transaction(self, transaction):
+        ok = True
+        for k in range(0, len(transaction.samples), self.madd_chunk_size):
+            try:
+                transaction.ts.madd(transaction.samples[k:k+self.madd_chunk_size])
+            except Exception as e:
+                logging.error('RedisTS.madd(): %s' % str(e))
+                ok = False
+        transaction.samples = []
+
+        if not self.pipelined:
+            return ok
+
+        try:
+            results = transaction.client.execute(raise_on_error=False)
+        except Exception as e:
+            logging.error('Redis pipeline: %s' % str(e))
+            self.ts_set -= set(transaction.creations.values())
+            return False
+
+        for k, result in enumerate(results):
+            if isinstance(result, list):   # TS.MADD: result for each sample
+                result = next((r for r in result if isinstance(r, Exception)), None)
+            if not isinstance(result, Exception):
+                continue
+            if k in transaction.creations:
+                key = transaction.creations[k]
+                try:
+                    if 'already exists' in str(result) and self.redis.type(key) == 'TSDB-TYPE':
+                        continue    # created by another client
+                except Exception as e:
+                    logging.error('Redis: %s' % str(e))
+                self.ts_set.discard(key)
+                logging.error('RedisTS.create(): %s' % str(result))
+            else:
+                logging.error('Redis: %s' % str(result))
+            ok = False
+
+        return ok
 
     
-    def _write_one(self, redis, timestamp, tag, fields, values, update):
+    def _write_one(self, transaction, timestamp, tag, fields, values, update):
         channels = self._channels(tag, fields)
         for i in range(min(len(channels), len(values))):
             if update is True:
-                self.write_element(channel=channels[i], value=values[i])
+                self._set(transaction, channels[i], values[i])
             elif type(values[i]) in [ int, float ]:
-                self.write_timeseries(timestamp, channel=channels[i], value=values[i])
+                self._add_sample(transaction, timestamp, channels[i], values[i])
             else:
-                self.write_object_timeseries(timestamp, channel=channels[i], value=values[i])
+                self._add_object(transaction, timestamp, channels[i], values[i])
+
+
+    def _write_columns(self, timestamps, channels, columns, update):
+        if update is True:
+            return super()._write_columns(timestamps, channels, columns, update)
+
+        transaction = self._open_transaction()
+        if transaction is None:
+            return False
+
+        ok = True
+        try:
+            # numeric columns go to TS.MADD as they are; the others are written one by one
+            msec = (1000 * timestamps).astype(np.int64).tolist()
+            for channel, column in zip(channels, columns):
+                if column.dtype == object:
+                    for timestamp, value in zip(timestamps.tolist(), column.tolist()):
+                        if type(value) in [ int, float ]:
+                            self._add_sample(transaction, timestamp, channel, value)
+                        elif value is not None:
+                            self._add_object(transaction, timestamp, channel, value)
+                elif self._create_timeseries(transaction, channel):
+                    transaction.samples.extend(zip(itertools.repeat(channel), msec, column.tolist()))
+        except Exception as e:
+            logging.warning(f'Redis: error on writing time-series: {e}')
+            ok = False
+        finally:
+            if self._close_transaction(transaction) is False:
+                ok = False
+            
+        return ok
+
+
+    def _set(self, transaction, key, value):
+        try:
+            transaction.client.set(key, str(value))
+        except Exception as e:
+            logging.error('RedisTS.set(): %s' % str(e))
+
+
+    def _add_sample(self, transaction, timestamp, key, value):
+        if self._create_timeseries(transaction, key):
+            transaction.samples.append((key, int(1000*timestamp), value))
+
+
+    def _add_object(self, transaction, timestamp, channel, value):
+        tsname = '%sindex_%s' % (objts_prefix, channel)
+        if not self._create_timeseries(transaction, tsname, retention_length=self.objts_retention_length):
+            return
+
+        index = int((timestamp % self.objts_retention_length) / self.objts_timebin)
+        objname = '%s_%s_%d' % (objts_prefix, channel, int(index))
+        self._set(transaction, objname, value)
+        transaction.samples.append((tsname, int(1000*timestamp), index))
+
+
+    def _create_timeseries(self, transaction, key, retention_length=-1):
+        '''
+        creates a time-series if the key is not known to be one (in the pipeline, if pipelined);
+        returns False if the time-series is not available
+        '''
+        if key in self.ts_set:
+            return True
+
+        if retention_length == -1:
+            retention_length = self.retention_length
+        try:
+            if self.pipelined:
+                transaction.creations[len(transaction.client)] = key
+            if retention_length is None:
+                transaction.ts.create(key)
+            else:
+                transaction.ts.create(key, retention_msecs=1000*retention_length)
+            self.ts_set.add(key)
+        except Exception as e:
+            if 'already exists' in str(e) and self.redis.type(key) == 'TSDB-TYPE':
+                self.ts_set.add(key)
+            else:
+                logging.error('RedisTS.create(): %s' % str(e))
+
+        return key in self.ts_set
+
+
+    def _scan_types(self, batch_size=1000):
+        '''
+        yields (key, type) for all the keys, with SCAN and TYPE commands pipelined in batches
+        '''
+        keys = []
+        for key in itertools.chain(self.redis.scan_iter(count=batch_size), [ None ]):
+            if key is not None:
+                keys.append(key)
+                if len(keys) < batch_size:
+                    continue
+            if len(keys) > 0:
+                pipeline = self.redis.pipeline(transaction=False)
+                for k in keys:
+                    pipeline.type(k)
+                yield from zip(keys, pipeline.execute())
+                keys = []
 
         
     ### Redis specific implementations ###
     
     def write_element(self, channel, value):
-        try:
-            self.redis.set(channel, str(value))
-        except Exception as e:
-            logging.error('RedisTS.set(): %s' % str(e))
+        self._write_with(self._set, channel, value)
             
         
     def write_timeseries(self, timestamp, channel, value):
-        if channel not in self.ts_set:
-            try:
-                if self.retention_length is None:
-                    self.redis.ts().create(channel)
-                else:
-                    self.redis.ts().create(channel, retention_msecs=1000*self.retention_length)
-                self.ts_set.add(channel)
-            except Exception as e:
-                logging.error('RedisTS.create(): %s' % str(e))
-                
-        if channel in self.ts_set:
-            self.redis.ts().add(channel, int(1000*timestamp), value)
+        self._write_with(self._add_sample, timestamp, channel, value)
                     
     
     def write_object_timeseries(self, timestamp, channel, value):
-        tsname = '%sindex_%s' % (objts_prefix, channel)
-        if not self.redis.exists(tsname):
-            try:
-                self.redis.ts().create(tsname, retention_msecs=1000*self.objts_retention_length)
-            except Exception as e:
-                logging.error('RedisTS.create(): %s' % str(e))
-        if self.redis.type(tsname) != 'TSDB-TYPE':
-            logging.error('TSDB-TYPE expected for %s in DB %s' % (tsname, self.db_url))
-            return
+        self._write_with(self._add_object, timestamp, channel, value)
 
-        index = int((timestamp % self.objts_retention_length) / self.objts_timebin)
-        objname = '%s_%s_%d' % (objts_prefix, channel, int(index))
-        try:
-            self.redis.set(objname, str(value))
-        except Exception as e:
-            logging.error(e)
+
+    def _write_with(self, method, *args):
+        transaction = self._open_transaction()
+        if transaction is None:
+            return False
+        ok = True
         try:
-            self.redis.ts().add(tsname, int(1000*timestamp), index)
+            method(transaction, *args)
         except Exception as e:
             logging.error(e)
+            ok = False
+        return (self._close_transaction(transaction) is not False) and ok
 
             
     ### Redis specific methods ###
@@ -142,8 +280,8 @@ class DataStore_Redis(DataStore):
             
     def list_timeseries(self):
         obj_list = []
-        for key in self.redis.keys():
-            if self.redis.type(key) == 'TSDB-TYPE':
+        for key, key_type in self._scan_types():
+            if key_type == 'TSDB-TYPE':
                 info = self.redis.ts().info(key)
                 obj_list.append({
                     'key': key,
@@ -157,7 +295,7 @@ class DataStore_Redis(DataStore):
         
     def list_json(self):
         obj_list = []
-        for key in self.redis.keys():
-            if self.redis.type(key) == 'ReJSON-RL':
+        for key, key_type in self._scan_types():
+            if key_type == 'ReJSON-RL':
                 obj_list.append({ 'key': key })
         return obj_list
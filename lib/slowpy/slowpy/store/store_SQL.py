@@ -1,9 +1,11 @@
 # Created by Sanshiro Enomoto on 3 June 2023 #
 
 
-import os, sys, time, logging, traceback
+import os, sys, time, itertools, logging, traceback
+import numpy as np
 from urllib.parse import urlparse
 from .store import DataStore
+from ..basetypes import TimeSeries
 
 
 class TableFormat:
@@ -61,6 +63,27 @@ class TableFormat:
             logging.error('SQL Error: %s' % str(e))
 
             
+    # override as needed
+    def write_many(self, cur, records):
+        '''
+        - records: list of (timestamp, tag, fields, values), written with the "append" semantics
+        - exceptions are passed to the caller (DataStore_SQL.flush()), which falls back to write()
+        '''
+        for timestamp, tag, fields, values in records:
+            channels = DataStore._channels(tag, fields)
+            for i in range(min(len(channels), len(values))):
+                self.write_single(cur, timestamp, channels[i], values[i], False)
+
+            
+    # override as needed
+    def write_columns(self, cur, timestamps, channels, columns):
+        '''
+        - timestamps: array of UNIX time-stamps, channels: list of channel names, columns: list of value arrays
+        - written with the "append" semantics; exceptions are passed to the caller (DataStore_SQL._write_columns())
+        '''
+        self.write_many(cur, DataStore._columns_to_records(timestamps, channels, columns))
+
+            
     # override as needed
     def write_single(self, cur, timestamp, channel, value, update):
         if update is True:
@@ -98,6 +121,10 @@ class LongTableFormat(TableFormat):
     schema_numeric = '(timestamp REAL, channel VARCHAR(100), value REAL, PRIMARY KEY(timestamp,channel))'
     schema_text = '(timestamp REAL, channel VARCHAR(100), value TEXT, PRIMARY KEY(timestamp,channel))'
 
+    # for batched inserts (write_many()); "{}" in time_expression is replaced with a placeholder
+    insert_columns = '(timestamp,channel,value)'
+    time_expression = '{}'
+
     
     def create_numeric_table(self, cur):
         if self.schema_numeric is None:
@@ -129,12 +156,72 @@ class LongTableFormat(TableFormat):
         sql += f"VALUES(%.3f,%s,%s);" % (timestamp, self.db.placeholder, self.db.placeholder)
         params = (channel, str(value))
         cur.execute(sql, params)
+
+        
+    def write_many(self, cur, records):
+        if not self._is_batchable():
+            return super().write_many(cur, records)
+            
+        rows = []
+        for timestamp, tag, fields, values in records:
+            timestamp = round(timestamp, 3)
+            channels = DataStore._channels(tag, fields)
+            for channel, value in zip(channels, values):
+                rows.append((timestamp, channel, self._row_value(value)))
+
+        self._insert_rows(cur, rows)
+
+        
+    def write_columns(self, cur, timestamps, channels, columns):
+        if not self._is_batchable():
+            return super().write_columns(cur, timestamps, channels, columns)
+
+        timestamps = np.round(timestamps, 3).tolist()
+        rows = []
+        for channel, column in zip(channels, columns):
+            if column.dtype == object:
+                rows.extend(
+                    (timestamp, channel, self._row_value(value))
+                    for timestamp, value in zip(timestamps, column.tolist()) if value is not None
+                )
+            else:
+                rows.extend(zip(timestamps, itertools.repeat(channel), column.tolist()))
+
+        self._insert_rows(cur, rows)
+
+        
+    def _is_batchable(self):
+        # user-defined insert_numeric_data() / insert_text_data() cannot be translated to a batched insert
+        for cls in type(self).__mro__:
+            if 'insert_numeric_data' in cls.__dict__ or 'insert_text_data' in cls.__dict__:
+                return 'time_expression' in cls.__dict__
+        return True
+
+    
+    def _row_value(self, value):
+        if type(value) in [ int, float ]:
+            return value
+        elif type(value) in [ str, bool ]:
+            return str(value)
+        else:
+            try:
+                return float(value)  # Decimal, Fraction, numpy.int64, ...
+            except:
+                return str(value)    # complex goes here, though it is a Number
+
+            
+    def _insert_rows(self, cur, rows):
+        ph = self.db.placeholder
+        template = '(%s,%s,%s)' % (self.time_expression.format(ph), ph, ph)
+        self.db._insert_many(cur, f'INSERT INTO {self.table}{self.insert_columns}', template, rows)
             
             
 
 class LongTableFormat_DateTime_PostgreSQL(LongTableFormat):
     schema_numeric = '("timestamp" TIMESTAMP WITH TIME ZONE , channel VARCHAR(100), value REAL, PRIMARY KEY("timestamp",channel))'
     schema_text = '("timestamp" TIMESTAMP WITH TIME ZONE, channel VARCHAR(100), value TEXT, PRIMARY KEY("timestamp",channel))'
+    insert_columns = '("timestamp",channel,value)'
+    time_expression = 'TO_TIMESTAMP({})'
 
     
     def insert_numeric_data(self, cur, timestamp, channel, value):
@@ -159,6 +246,7 @@ class LongTableFormat_DateTime_MySQL(LongTableFormat):
     # (treated as "naive"), so if this format is used, use "unspecified utc" time type in SlowDash.
     schema_numeric = '(timestamp TIMESTAMP , channel VARCHAR(100), value REAL, PRIMARY KEY(timestamp,channel))'
     schema_text = '(timestamp TIMESTAMP, channel VARCHAR(100), value TEXT, PRIMARY KEY(timestamp,channel))'
+    time_expression = 'FROM_UNIXTIME({})'
 
     
     def insert_numeric_data(self, cur, timestamp, channel, value):
@@ -188,10 +276,21 @@ class DataStore_SQL(DataStore):
         return []
     
     
-    def __init__(self, db_url, table, table_format, lazy_construction=False):
+    def __init__(self, db_url, table, table_format, lazy_construction=False, *, batch_size=None, flush_interval=1.0):
+        '''
+        - batch_size: if set, appended rows are buffered and written in batches (multi-row inserts, one commit per batch),
+          when the number of values reaches batch_size, or flush_interval [sec] has passed since the last flush.
+          The thresholds are checked on each write; call flush() to write the buffered rows immediately.
+          close() flushes the buffer.
+        '''
         super().__init__()
         
         self.lazy_construction = lazy_construction
+        self.batch_size = batch_size if (batch_size is not None and batch_size > 0) else None
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered_values = 0
+        self.last_flush_time = time.monotonic()
         
         self.table = None
         self.conn = None
@@ -227,11 +326,63 @@ class DataStore_SQL(DataStore):
 
         
     def close(self):
+        if not self.flush():
+            logging.error(f'SQL: {len(self.buffer)} buffered rows are not written')
+            self._set_buffer([])
         if self.conn is not None:
             self.conn.close()
             self.conn = None
             logging.info('DB "%s" is disconnected.' % self.db_url)
 
+
+    def flush(self):
+        '''
+        writes the buffered rows (if batch_size is set); returns False on failure.
+        The rows are removed from the buffer only after they are committed; on failure they are kept for the next flush.
+        '''
+        if len(self.buffer) == 0:
+            return True
+        self.last_flush_time = time.monotonic()
+
+        cur = self._open_transaction()
+        if cur is None:
+            return False
+        failed = False
+        try:
+            if self._prepare_table(cur, *self.buffer[0][1:]):
+                self.table_format.write_many(cur, self.buffer)
+        except Exception as e:
+            # e.g., duplicate primary key: the rows are written one by one, skipping only the bad ones
+            logging.warning(f'SQL: error on batch insert, retrying one by one: {e}')
+            self._rollback()
+            failed = True
+        if self._close_transaction(cur) is False:
+            return False
+        if not failed:
+            self._set_buffer([])
+            return True
+            
+        for k, record in enumerate(self.buffer):
+            cur = self._open_transaction()
+            if cur is None:
+                # backend not available: the rest is kept
+                self._set_buffer(self.buffer[k:])
+                return False
+            try:
+                self._write_one(cur, *record, update=False)
+            except Exception as e:
+                logging.warning(f'SQL: dropping a row that cannot be written: {record}: {e}')
+                self._rollback()
+            self._close_transaction(cur)
+        self._set_buffer([])
+        
+        return True
+
+
+    def _set_buffer(self, records):
+        self.buffer = records
+        self.buffered_values = sum(len(record[3]) for record in records)
+
             
     def _write(self, values, tag=None, timestamp=None, update=False):
         if self.lazy_construction:
@@ -239,17 +390,92 @@ class DataStore_SQL(DataStore):
             self.conn = self.construct()
             if self.conn is None:
                 self.table_exists = None
+
+        if isinstance(values, TimeSeries):
+            return self._write_columns(*self._make_columns(values, tag), update)
         
-        super()._write(values, tag, timestamp, update)
+        records = self._make_records(values, tag, timestamp)
+        if self.batch_size is None:
+            return self._write_records(records, update)
+        elif update:
+            # DELETE and INSERT: the buffered rows must be written before (on failure they stay in the buffer)
+            self.flush()
+            return self._write_records(records, update)
+        else:
+            self.buffer.extend(records)
+            self.buffered_values += sum(len(record[3]) for record in records)
+            if self.buffered_values >= self.batch_size or time.monotonic() - self.last_flush_time >= self.flush_interval:
+                if not self.flush() and len(self.buffer) >= len(records):
+                    # none of the new rows is written: they are returned to the caller (e.g., for retrying),
+                    # while the older rows are kept in the buffer
+                    self._set_buffer(self.buffer[:len(self.buffer)-len(records)])
+                    return False
+            return True
 
         
+    def _reconnect(self):
+        if self.table is None:
+            return False
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception as e:
+                logging.warning(f'SQL close(): {e}')
+        
+        self.lazy_construction = False
+        self.conn = self.construct()
+        if self.conn is None:
+            self.table_exists = None
+            return False
+        
+        self.table_exists = False  # table list will be checked on next write
+        return True
+
+        
+    def _write_columns(self, timestamps, channels, columns, update):
+        '''
+        writes all the columns by a multi-row insert in one transaction (regardless of batch_size)
+        '''
+        # the buffered rows are written before, to keep the order (on failure they stay in the buffer)
+        self.flush()
+        if update or len(timestamps) == 0 or len(channels) == 0:
+            return super()._write_columns(timestamps, channels, columns, update)
+
+        cur = self._open_transaction()
+        if cur is None:
+            return False
+        failed = False
+        try:
+            first_value = next((value for value in columns[0].tolist() if value is not None), None)
+            if self._prepare_table(cur, None, channels[:1], [first_value]):
+                self.table_format.write_columns(cur, timestamps, channels, columns)
+        except Exception as e:
+            logging.warning(f'SQL: error on bulk insert, retrying one by one: {e}')
+            self._rollback()
+            failed = True
+        ok = self._close_transaction(cur) is not False
+
+        if failed:
+            ok = super()._write_columns(timestamps, channels, columns, update) and ok
+
+        return ok
+        
+        
     def _write_one(self, cur, timestamp, tag, fields, values, update):
+        if self._prepare_table(cur, tag, fields, values):
+            self.table_format.write(cur, timestamp, tag, fields, values, update)
+
+
+    def _prepare_table(self, cur, tag, fields, values):
+        '''
+        creates the table if it does not exist; returns False if the table is not available
+        '''
         if self.table_exists is None:
-            return
+            return False
         
         if self.table_exists is False:
             if (self.table is None) or (len(self.table)) == 0:
-                return
+                return False
             
             # No table -> update the table list
             table_list = [ name.upper() for name in self.get_table_list(cur) ]
@@ -262,28 +488,45 @@ class DataStore_SQL(DataStore):
                 if self.table_exists is False:
                     # still no table -> give up
                     self.table_exists = None  # no further retrying
-                    return
+                    return False
+
+        return True
+
+
+    # override as needed
+    def _insert_many(self, cur, sql_head, row_template, rows):
+        '''
+        - sql_head: "INSERT INTO table(columns)"
+        - row_template: "(placeholder,...)" for one row, possibly with SQL functions
+        '''
+        if len(rows) > 0:
+            cur.executemany(f'{sql_head} VALUES{row_template}', rows)
 
-        self.table_format.write(cur, timestamp, tag, fields, values, update)
+
+    def _rollback(self):
+        try:
+            self.conn.rollback()
+        except Exception as e:
+            logging.warning(f'SQL rollback(): {e}')
 
                     
         
 class DataStore_SQLite(DataStore_SQL):
     placeholder = '?'
     
-    def __init__(self, db_url, table, table_format=None):
+    def __init__(self, db_url, table, table_format=None, *, batch_size=None, flush_interval=1.0):
         if table_format is None:
             table_format = LongTableFormat()
             
         # lazy_construction is enabled so that the same thread is used for both connect() and write()
-        super().__init__(db_url, table, table_format, lazy_construction=True)
+        super().__init__(db_url, table, table_format, lazy_construction=True, batch_size=batch_size, flush_interval=flush_interval)
         
 
     def another(self, table, table_format=None):
         if table_format is None:
             table_format = type(self.table_format)()
             
-        return DataStore_SQLite(self.db_url, table, table_format)
+        return DataStore_SQLite(self.db_url, table, table_format, batch_size=self.batch_size, flush_interval=self.flush_interval)
         
         
     def construct(self):
@@ -321,32 +564,36 @@ class DataStore_SQLite(DataStore_SQL):
         
     
     def _close_transaction(self, cur):
+        ok = True
         try:
             self.conn.commit()
         except Exception as e:
             logging.error('SQLite commit(): %s' % str(e))
+            ok = False
         finally:
             try:
                 cur.close()
             except Exception as e:
                 logging.warning('SQLite cursor close(): %s' % str(e))
 
+        return ok
+
     
     
 class DataStore_PostgreSQL(DataStore_SQL):
     placeholder = '%s'
         
-    def __init__(self, db_url, table, table_format=None):
+    def __init__(self, db_url, table, table_format=None, *, batch_size=None, flush_interval=1.0):
         if table_format is None:
             table_format = LongTableFormat_DateTime_PostgreSQL()
-        super().__init__(db_url, table, table_format)
+        super().__init__(db_url, table, table_format, batch_size=batch_size, flush_interval=flush_interval)
 
         
     def another(self, table, table_format=None):
         if table_format is None:
             table_format = type(self.table_format)()
             
-        return DataStore_PostgreSQL(self.db_url, table, table_format)
+        return DataStore_PostgreSQL(self.db_url, table, table_format, batch_size=self.batch_size, flush_interval=self.flush_interval)
         
         
     def construct(self):
@@ -385,6 +632,13 @@ class DataStore_PostgreSQL(DataStore_SQL):
         return result
     
 
+    def _insert_many(self, cur, sql_head, row_template, rows):
+        # multi-row VALUES; psycopg2 executemany() sends one statement per row
+        from psycopg2.extras import execute_values
+        if len(rows) > 0:
+            execute_values(cur, f'{sql_head} VALUES %s', rows, template=row_template, page_size=1000)
+        
+
     def _open_transaction(self):
         if self.conn is None:
             return None
@@ -392,10 +646,12 @@ class DataStore_PostgreSQL(DataStore_SQL):
         
     
     def _close_transaction(self, cur):
+        ok = True
         try:
             self.conn.commit()
         except Exception as e:
             logging.error('PostgreSQL commit(): %s' % str(e))
+            ok = False
             try:
                 self.conn.rollback()   # exiting from the "aborted transaction" state (possible only with PostgreSQL)
             except Exception as e:
@@ -406,24 +662,26 @@ class DataStore_PostgreSQL(DataStore_SQL):
             except Exception as e:
                 logging.warning('PostgreSQL cursor close(): %s' % str(e))
 
+        return ok
+
 
                 
 class DataStore_MySQL(DataStore_SQL):
     placeholder = '%s'
         
-    def __init__(self, db_url, table, table_format=None):
+    def __init__(self, db_url, table, table_format=None, *, batch_size=None, flush_interval=1.0):
         if table_format is None:
             # MySQL TIMESTAMP uses UTC, but pymysql cannot handle timezone (treat the time as "native")
             table_format = LongTableFormat()
             #table_format = LongTableFormat_DateTime_MySQL()
-        super().__init__(db_url, table, table_format)
+        super().__init__(db_url, table, table_format, batch_size=batch_size, flush_interval=flush_interval)
 
         
     def another(self, table, table_format=None):
         if table_format is None:
             table_format = type(self.table_format)()
             
-        return DataStore_MySQL(self.db_url, table, table_format)
+        return DataStore_MySQL(self.db_url, table, table_format, batch_size=self.batch_size, flush_interval=self.flush_interval)
         
         
     def construct(self):
@@ -478,12 +736,16 @@ class DataStore_MySQL(DataStore_SQL):
         
     
     def _close_transaction(self, cur):
+        ok = True
         try:
             self.conn.commit()
         except Exception as e:
             logging.error('MySQL commit(): %s' % str(e))
+            ok = False
         finally:
             try:
                 cur.close()
             except Exception as e:
                 logging.warning('MySQL cursor close(): %s' % str(e))
+
+        return ok
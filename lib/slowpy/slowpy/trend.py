@@ -63,20 +63,28 @@ class Trend(DataElement):
         if this_index < 0:
             return
 
-        for index in range(self.current_index+1, this_index+1):
-            k = int(index % self.nbins)
-            self.count[k] = 0
-            self.sum[k] = 0
-            self.sum2[k] = 0
-            self.min[k] = np.nan
-            self.max[k] = np.nan
-                
+        # clears the bins for (current_index, this_index]; at most one full round of the ring
+        nskip = min(this_index - self.current_index, self.nbins)
+        if nskip > 0:
+            first = int((self.current_index + 1) % self.nbins)
+            self._clear_bins(first, min(first + nskip, self.nbins))
+            if first + nskip > self.nbins:
+                self._clear_bins(0, first + nskip - self.nbins)
+            
         if complete:
             self.current_index = this_index + 1
         else:
             self.current_index = this_index
             
         
+    def _clear_bins(self, begin, end):
+        self.count[begin:end] = 0
+        self.sum[begin:end] = 0
+        self.sum2[begin:end] = 0
+        self.min[begin:end] = np.nan
+        self.max[begin:end] = np.nan
+        
+        
     def fill(self, t=None, value=None, weight=1):
         if t is None:
             t = time.time()
@@ -96,6 +104,35 @@ class Trend(DataElement):
             self.has_values = False
 
 
+    def fill_many(self, t, value=None, weight=1):
+        """fills arrays of (time, value, weight) at once; entries are binned by their own time stamps, so the order does not matter
+        Entries before the start time or in the bins already rotated out of the ring are dropped.
+        """
+        t = np.asarray(t, dtype=float).ravel()
+        if len(t) == 0:
+            return
+        weight = np.broadcast_to(np.asarray(weight, dtype=float).ravel() if np.ndim(weight) > 0 else float(weight), t.shape)
+        
+        index = np.floor((t - self.start_time) / self.tick).astype(np.int64)
+        last_index = max(int(np.max(index)), self.current_index)
+        self._evolve(self.start_time + (last_index + 0.5) * self.tick)
+
+        selected = (index >= 0) & (index > last_index - self.nbins)
+        k = index[selected] % self.nbins
+        w = weight[selected]
+        
+        self.count += np.bincount(k, weights=w, minlength=self.nbins).astype(self.count.dtype)
+        if value is None:
+            self.has_values = False
+            return
+        
+        x = np.asarray(value, dtype=float).ravel()[selected]
+        self.sum += np.bincount(k, weights=w*x, minlength=self.nbins).astype(self.sum.dtype)
+        self.sum2 += np.bincount(k, weights=w*x*x, minlength=self.nbins).astype(self.sum2.dtype)
+        np.fmin.at(self.min, k, x.astype(self.min.dtype))
+        np.fmax.at(self.max, k, x.astype(self.max.dtype))
+
+        
     def timeseries(self, field='x', flush=False):
     # returns a time-series object
         length = self.tick * self.nbins
@@ -105,12 +142,8 @@ class Trend(DataElement):
             start = self.start_time + self.tick * (self.current_index - self.nbins + 1)
         start_offset = start - self.start_time
         
-        ts = TimeSeries(start=start, length=length)
-        ts.fields = []
-        ts.values = []
-        
+        fields, columns = [], []
         record = self.to_json()
-        ts.t = [ t - start_offset for t in record['x'] ]
         for key in record:
             if key == 'y':
                 this_field = field
@@ -118,8 +151,12 @@ class Trend(DataElement):
                 this_field = f'{field}_{key[2:]}'
             else:
                 continue
-            ts.fields.append(this_field)
-            ts.values.append(record[key])
+            fields.append(this_field)
+            columns.append(record[key])
+            
+        ts = TimeSeries(fields=fields, start=start, length=length)
+        ts.t = np.asarray(record['x']) - start_offset
+        ts.values = columns
 
         if flush:
             self.flush()
@@ -130,13 +167,14 @@ class Trend(DataElement):
     def to_json(self):
     # returns a graph object
         n = min(self.current_index - self.start_index, self.nbins-1)
-        indexes = [ int((self.current_index - n + k) % self.nbins) for k in range(n) ]
-        lapse = [ self.tick/2 + self.tick * (self.current_index - n + k) for k in range(n) ]
+        bin_index = self.current_index - n + np.arange(n)
+        indexes = bin_index % self.nbins
+        lapse = self.tick/2 + self.tick * bin_index
         
         self.attr_values['start_timestamp'] = self.start_time
         record = { **super().to_json(),  **{
             'labels': [ 'lapse', self.metric ],
-            'x': lapse,
+            'x': lapse.tolist(),
             'y': []
         }}
         
@@ -0,0 +1,20 @@
+
+import time
+from slowpy.control import RandomWalkDevice
+from slowpy.store import DataStore_SQLite
+
+# rows are buffered and written by multi-row inserts, every 400 values or every 5 seconds
+datastore = DataStore_SQLite('sqlite:///SlowTestData.db', 'TestBatch', batch_size=400, flush_interval=5)
+device = RandomWalkDevice(n=4)
+
+
+try:
+    while True:
+        records = { 'ch%01d'%ch: device.read(ch) for ch in range(4) }
+        print(records)
+    
+        datastore.append(records)
+        time.sleep(0.1)
+        
+except KeyboardInterrupt:
+    datastore.close()   # buffered rows are written here
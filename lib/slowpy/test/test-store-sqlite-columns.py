@@ -0,0 +1,21 @@
+
+import time
+import numpy as np
+from slowpy import TimeSeries
+from slowpy.store import DataStore_SQLite
+
+# arrays of time points are written by one multi-row insert
+datastore = DataStore_SQLite('sqlite:///SlowTestData.db', 'TestColumns')
+
+
+while True:
+    t = time.time() + np.arange(0, 1, 0.01)
+    waveform = np.sin(2 * np.pi * 5 * t)
+    datastore.append_columns(t, { 'sin': waveform, 'cos': np.cos(2 * np.pi * 5 * t) }, tag='wave')
+
+    ts = TimeSeries(fields=['x', 'x_abs'])
+    ts.extend(t, [ waveform, np.abs(waveform) ])
+    datastore.append(ts.slice(t[0], t[50]), tag='half')   # channels: "half" and "half_x_abs"
+    print(ts.slice(t[0], t[5]))
+
+    time.sleep(1)
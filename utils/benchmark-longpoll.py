@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+# Compares the idle CPU usage of N concurrent long-polls:
+#   - "sleep loop": each poll re-checks the revision every 0.2 s (the former TaskModuleComponent.task_status())
+#   - "notifier": each poll waits on a RevisionNotifier, woken up once per change
+# Usage: python3 utils/benchmark-longpoll.py [NUMBER_OF_POLLERS] [DURATION_SEC]
+
+import sys, os, time, asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'server'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib', 'slowlette'))
+from sd_component import RevisionNotifier
+
+
+class SleepLoopStatus:
+    def __init__(self):
+        self.revision = 1
+        self.wakeups = 0
+        
+    def notify(self):
+        self.revision += 1
+        
+    async def wait(self, since):
+        while self.revision <= since:
+            self.wakeups += 1
+            await asyncio.sleep(0.2)
+        return self.revision
+
+    
+
+async def measure(status, npollers, duration, nchanges):
+    async def poller():
+        since = status.revision
+        while True:
+            since = await status.wait(since)
+            received[0] += 1
+
+    received = [0]
+    tasks = [ asyncio.create_task(poller()) for k in range(npollers) ]
+    await asyncio.sleep(0.1)
+    
+    cpu0, t0 = time.process_time(), time.monotonic()
+    for k in range(nchanges):
+        await asyncio.sleep(duration / nchanges)
+        status.notify()
+    cpu1, t1 = time.process_time(), time.monotonic()
+    
+    await asyncio.sleep(0.3)   # for the sleep loops to catch the last change
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return 100 * (cpu1 - cpu0) / (t1 - t0), received[0]
+
+
+
+async def main(npollers, duration, nchanges=5):
+    for name, status in [ ('sleep loop', SleepLoopStatus()), ('notifier', RevisionNotifier()) ]:
+        cpu, received = await measure(status, npollers, duration, nchanges)
+        print(f'{name:12s}: {npollers} pollers, {nchanges} changes in {duration} s: CPU {cpu:5.2f} %, {received} replies')
+
+        
+
+if __name__ == '__main__':
+    npollers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(npollers, duration))